@@ -13,6 +13,7 @@ from config import config
 from services import LLMService, EmailService, FileService, GenerationService, GmailService, GDriveService
 from services.scheduler_service import SchedulerService
 from services.receipt_processor import ReceiptProcessor
+from services.sync_state_store import GmailSyncStateStore
 from prompts import ReceiptPrompts
 from database import init_db, SessionLocal
 from models.receipt_models import ReceiptJob, Recibo, JobStatus
@@ -222,6 +223,21 @@ def create_app() -> Flask:
         except Exception as e:
             return jsonify({'success': False, 'error': str(e)}), 500
 
+    @app.route('/api/debug/gmail-rate-limit', methods=['GET'])
+    def debug_gmail_rate_limit():
+        """Métricas do token bucket compartilhado da Gmail API."""
+        if not gmail_service:
+            return jsonify({'success': False, 'error': 'Gmail não configurado'}), 400
+        return jsonify({'success': True, 'metrics': gmail_service.get_rate_limit_metrics()})
+
+    @app.route('/api/debug/gmail-cache', methods=['GET'])
+    def debug_gmail_cache():
+        """Contadores do cache local de mensagens e do pool de clientes do Gmail."""
+        if not gmail_service:
+            return jsonify({'success': False, 'error': 'Gmail não configurado'}), 400
+        return jsonify({'success': True, 'stats': gmail_service.get_cache_stats(),
+                        'client_pool': gmail_service.get_client_pool_stats()})
+
     @app.route('/api/debug/registry', methods=['POST'])
     def debug_registry():
         """Inspeciona ou limpa o registro de duplicatas do encaminhador.
@@ -233,18 +249,13 @@ def create_app() -> Flask:
             action = (request.get_json(silent=True) or {}).get('action', 'view')
             if action == 'clear':
                 try:
-                    if os.path.exists(fwd._registry_path):
-                        os.remove(fwd._registry_path)
+                    fwd._registry.clear()
                     return jsonify({'success': True, 'message': 'Registry limpo'})
                 except Exception as e:
                     return jsonify({'success': False, 'error': str(e)}), 500
             # view
-            if os.path.exists(fwd._registry_path):
-                with open(fwd._registry_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-            else:
-                data = {'by_invoice': {}, 'by_triplet': {}}
-            return jsonify({'success': True, 'registry': data, 'path': fwd._registry_path})
+            return jsonify({'success': True, 'registry': fwd._registry.to_dict(), 'path': fwd._registry_path,
+                            'stats': fwd._registry.get_stats()})
         except Exception as e:
             return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -406,6 +417,9 @@ def create_app() -> Flask:
             target_email = request.form.get('target_email', 'contasapagar@zello.tec.br')
             max_results = request.form.get('max_results', '')
             use_pagination = request.form.get('use_pagination', 'false') == 'true'
+            use_batch = request.form.get('use_batch', 'false') == 'true'
+            concurrency = int(request.form.get('concurrency') or 0) or None
+            incremental = request.form.get('incremental', 'false') == 'true'
             selected_providers = request.form.getlist('providers')
             
             # Converter max_results para int ou None
@@ -429,6 +443,7 @@ def create_app() -> Flask:
                     print(f"   Período: {days_back} dias")
                     print(f"   Provedores selecionados: {selected_providers}")
                     print(f"   Paginação: {'Sim' if use_pagination else 'Não'}")
+                    print(f"   Busca em lote: {'Sim' if use_batch else 'Não'}")
                     print(f"   Limite: {max_results if max_results else 'Sem limite'}")
                     
                     # Callback de progresso
@@ -441,27 +456,49 @@ def create_app() -> Flask:
                         session.modified = True
                     
                     # Processar emails com paginação
-                    if use_pagination:
-                        print("🔄 Usando paginação automática...")
+                    if incremental:
+                        print("🔄 Usando sincronização incremental (historyId)...")
+                        receipts = gmail_service.process_receipt_emails_incremental(
+                            user_email=config.GMAIL_MONITORED_EMAIL,
+                            state_store=GmailSyncStateStore(),
+                            days_back=days_back,
+                            progress_callback=progress_callback,
+                            use_batch=use_batch
+                        )
+                    elif use_pagination and concurrency and concurrency > 1:
+                        print("🔄 Usando paginação automática (pipeline concorrente)...")
                         receipts = gmail_service.process_all_receipt_emails(
                             user_email=config.GMAIL_MONITORED_EMAIL,
                             days_back=days_back,
                             max_results=max_results,
-                            progress_callback=progress_callback
+                            progress_callback=progress_callback,
+                            use_batch=use_batch,
+                            concurrency=concurrency
+                        )
+                    elif use_pagination:
+                        print("🔄 Usando paginação automática (streaming)...")
+                        # Gerador: cada recibo é agregado assim que sua página é processada
+                        receipts = gmail_service.iter_receipts(
+                            user_email=config.GMAIL_MONITORED_EMAIL,
+                            days_back=days_back,
+                            max_results=max_results,
+                            progress_callback=progress_callback,
+                            use_batch=use_batch
                         )
                     else:
                         print("⚡ Usando método rápido (sem paginação)...")
                         # Usar método antigo sem paginação
                         receipts = gmail_service.process_receipt_emails(
                             user_email=config.GMAIL_MONITORED_EMAIL,
-                            days_back=days_back
+                            days_back=days_back,
+                            concurrency=concurrency
                         )
                     
-                    print(f"✅ Varredura concluída! Encontrados {len(receipts)} recibos")
-                    
-                    # Organizar resultados por provedor
+                    # Organizar resultados por provedor (mantém só o resumo de cada recibo)
                     emails_found = {}
+                    total_receipts = 0
                     for receipt in receipts:
+                        total_receipts += 1
                         provider = receipt.get('provedor', 'Unknown')
                         if provider not in emails_found:
                             emails_found[provider] = []
@@ -475,12 +512,14 @@ def create_app() -> Flask:
                             'receipt_number': receipt.get('numero_recibo', 'N/A')
                         })
                     
+                    print(f"✅ Varredura concluída! Encontrados {total_receipts} recibos")
+                    
                     scan_results = {
                         'timestamp': datetime.now().strftime('%d/%m/%Y %H:%M:%S'),
                         'days_scanned': days_back,
                         'accounts_scanned': [config.GMAIL_MONITORED_EMAIL],
                         'emails_found': emails_found,
-                        'total_emails': len(receipts),
+                        'total_emails': total_receipts,
                         'total_accounts': 1,
                         'providers_used': selected_providers,
                         'pagination_used': use_pagination,
@@ -1184,56 +1223,54 @@ def create_app() -> Flask:
         """
         if not gmail_service:
             return jsonify({'success': False, 'error': 'Gmail não configurado'}), 400
-        from database import SessionLocal
-        from models.receipt_models import ReceiptJob, JobStatus
-        import datetime as _dt
+        from services.job_discovery import JobDiscoveryService
         payload = request.get_json(silent=True) or {}
         users = payload.get('users') or ([config.GMAIL_DELEGATED_USER] if config.GMAIL_DELEGATED_USER else [])
         max_results = int(payload.get('max', 20))
         if not users:
             return jsonify({'success': False, 'error': 'Nenhum usuário fornecido'}), 400
-        session = SessionLocal()
+        discovery = JobDiscoveryService()
         created = 0
+        skipped = 0
+        timings = {}
         errors = []
+        
+        def _discover_user(user):
+            msgs = gmail_service.list_gemini_messages(user, max_results=max_results)
+            # Deduplicação por hash (id da mensagem) e insert em lote em uma transação
+            return discovery.discover(user, [m['id'] for m in msgs])
+        
         try:
+            # Listagem e descoberta das caixas em paralelo (um cliente Gmail por caixa/thread)
+            per_user = gmail_service.run_per_mailbox(users, _discover_user)
             for user in users:
-                try:
-                    msgs = gmail_service.list_gemini_messages(user, max_results=max_results)
-                    for m in msgs:
-                        mid = m['id']
-                        full = gmail_service.get_message(user, mid)
-                        text = gmail_service.extract_plain_text(full)
-                        # hash simples baseado em id da mensagem
-                        file_hash = mid
-                        exists = session.query(ReceiptJob).filter_by(source_hash=file_hash).first()
-                        if exists:
-                            continue
-                        # opcionalmente salva no Drive
-                        gdrive_path = None
-                        if gdrive_service and config.GDRIVE_ROOT_FOLDER_ID:
-                            folder_user = gdrive_service.ensure_folder(config.GDRIVE_ROOT_FOLDER_ID, user)
-                            fid = gdrive_service.upload_text(folder_user, f"receipt_{mid}.txt", text)
-                            gdrive_path = f"drive://{fid}"
-                        job = ReceiptJob(
-                            source_uri=f"gmail://{user}/{mid}",
-                            source_hash=file_hash,
-                            status=JobStatus.DISCOVERED,
-                            attempts=0,
-                            created_at=_dt.datetime.utcnow(),
-                            updated_at=_dt.datetime.utcnow(),
-                            collaborator_email=user,
-                        )
-                        session.add(job)
-                        session.commit()
-                        created += 1
-                except Exception as ue:
-                    errors.append({'user': user, 'error': str(ue)})
-            return jsonify({'success': True, 'created': created, 'errors': errors})
+                outcome = per_user.get(user)
+                if outcome is None:
+                    continue
+                if not outcome['success']:
+                    errors.append({'user': user, 'error': outcome['error']})
+                    continue
+                result = outcome['result']
+                created += result['created']
+                skipped += result['skipped']
+                timings[user] = result['timings']
+                # opcionalmente salva no Drive (apenas mensagens novas; cliente do Drive não é thread-safe)
+                if gdrive_service and config.GDRIVE_ROOT_FOLDER_ID and result['created_ids']:
+                    try:
+                        folder_user = gdrive_service.ensure_folder(config.GDRIVE_ROOT_FOLDER_ID, user)
+                        fetched = gmail_service.get_messages_batch(user, result['created_ids'])
+                        for mid, item in fetched.items():
+                            if not item['success']:
+                                errors.append({'user': user, 'message_id': mid, 'error': item['error']})
+                                continue
+                            text = gmail_service.extract_plain_text(item['message'])
+                            gdrive_service.upload_text(folder_user, f"receipt_{mid}.txt", text)
+                    except Exception as ue:
+                        errors.append({'user': user, 'error': str(ue)})
+            return jsonify({'success': True, 'created': created, 'skipped': skipped,
+                            'timings': timings, 'errors': errors})
         except Exception as e:
-            session.rollback()
             return jsonify({'success': False, 'error': str(e)}), 500
-        finally:
-            session.close()
     
     @app.route('/api/process-receipt', methods=['POST'])
     def process_receipt():
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+CLI: Reextração em lote de emails já armazenados (NDJSON), em vários processos
+
+Entrada: uma linha JSON por email, no formato de `cli_scan.py --ndjson`
+({"id", "email": {...}}) ou o próprio email ({"id", "sender", "subject", "body"}).
+Saída: uma linha JSON por email, na mesma ordem da entrada.
+"""
+import argparse
+import json
+import sys
+import time
+
+from services.batch_extraction import available_cpus, extract_batch
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reextrai recibos de emails armazenados em NDJSON")
+    parser.add_argument("input", nargs="?", default="-", help="Arquivo NDJSON de entrada (default: stdin)")
+    parser.add_argument("--workers", type=int, default=0, help=f"Processos (default: EXTRACTION_WORKERS ou {available_cpus()} núcleos)")
+    parser.add_argument("--chunksize", type=int, default=0, help="Emails por tarefa (default: EXTRACTION_CHUNKSIZE)")
+    args = parser.parse_args()
+
+    source = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8")
+
+    def items():
+        for line in source:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            email = dict(record.get("email") or record)
+            email.setdefault("id", record.get("id"))
+            yield email
+
+    total = 0
+    ok_count = 0
+    started = time.perf_counter()
+    try:
+        for result in extract_batch(items(), workers=args.workers or None, chunksize=args.chunksize or None):
+            total += 1
+            if result.get("success") and result["receipt"].get("success"):
+                ok_count += 1
+            sys.stdout.write(json.dumps(result, ensure_ascii=False, default=str) + "\n")
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+    duration = time.perf_counter() - started
+    print(
+        f"Reextraídos: {total} | Recibos válidos: {ok_count} | {duration:.2f}s "
+        f"({total / duration if duration else 0:.0f} emails/s)",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -20,58 +20,61 @@ def main():
     parser.add_argument("--send", action="store_true", help="Enviar relatório por email ao final")
     parser.add_argument("--to", dest="target_email", default=os.getenv("REPORTS_EMAIL", "contasapagar@zello.tec.br"), help="Email destino do relatório")
     parser.add_argument("--oauth2", action="store_true", help="Força uso de OAuth2 (oauth2_credentials.json)")
+    parser.add_argument("--ndjson", action="store_true", help="Emite cada mensagem como uma linha JSON assim que é processada (logs vão para stderr)")
     args = parser.parse_args()
 
-    print("=== Varredura de Recibos - CLI ===")
-    print(f"Email monitorado: {config.GMAIL_MONITORED_EMAIL}")
-    print(f"Periodo: últimos {args.days} dias | Limite: {args.max_results}")
+    # Em modo NDJSON o stdout fica reservado para os registros
+    log_stream = sys.stderr if args.ndjson else sys.stdout
+
+    def log(*values):
+        print(*values, file=log_stream, flush=True)
+
+    log("=== Varredura de Recibos - CLI ===")
+    log(f"Email monitorado: {config.GMAIL_MONITORED_EMAIL}")
+    log(f"Periodo: últimos {args.days} dias | Limite: {args.max_results}")
 
     # Inicializa GmailService
     try:
         if args.oauth2 or (os.path.exists("oauth2_credentials.json")):
             gs = GmailService("oauth2_credentials.json", use_oauth2=True)
-            print("Auth: OAuth2")
+            log("Auth: OAuth2")
         else:
             gs = GmailService(config.GOOGLE_CREDENTIALS_JSON, delegated_user=config.GMAIL_DELEGATED_USER)
-            print("Auth: Service Account")
+            log("Auth: Service Account")
     except Exception as e:
-        print(f"Erro ao inicializar GmailService: {e}")
+        log(f"Erro ao inicializar GmailService: {e}")
         sys.exit(1)
 
-    # Construir query e buscar mensagens
+    def page_progress(info):
+        if info.get("status") == "processing":
+            log(f"Página: +{info.get('messages_in_page', 0)} mensagens (acumulado: {info.get('total_messages', 0)})")
+
+    # Construir query e processar as mensagens à medida que as páginas chegam
+    total = 0
+    ok_count = 0
+    ok = []  # só o necessário para o relatório e a amostra
     try:
         query = gs._build_receipt_search_query(args.days)
-        print(f"Query: {query}")
-        page_token = None
-        total = 0
-        receipts = []
-        while True:
-            limit_this_page = min(100, max(0, args.max_results - total))
-            if limit_this_page == 0:
-                break
-            resp = gs.list_receipt_messages(
-                config.GMAIL_MONITORED_EMAIL,
-                page_token=page_token,
-                max_results=limit_this_page,
-                days_back=args.days,
-            )
-            msgs = resp.get("messages", [])
-            print(f"Página: +{len(msgs)} mensagens (acumulado: {total + len(msgs)})")
-            for m in msgs:
-                full = gs.get_message(config.GMAIL_MONITORED_EMAIL, m["id"])
-                basic = gs._extract_basic_email_data(full)
-                data = gs.receipt_extractor.extract_receipt_data(basic)
-                receipts.append({"id": m["id"], "email": basic, "receipt": data})
-                total += 1
-                if total >= args.max_results:
-                    break
-            page_token = resp.get("nextPageToken")
-            if not page_token or total >= args.max_results:
-                break
-        ok = [r for r in receipts if r["receipt"].get("success")]
-        print(f"Total mensagens: {total} | Recibos válidos: {len(ok)}")
+        log(f"Query: {query}")
+        messages = gs.iter_receipt_messages(
+            config.GMAIL_MONITORED_EMAIL, query, max_results=args.max_results, progress_callback=page_progress
+        )
+        for m in messages:
+            full = gs.get_message(config.GMAIL_MONITORED_EMAIL, m["id"])
+            basic = gs._extract_basic_email_data(full)
+            data = gs.receipt_extractor.extract_receipt_data(basic)
+            record = {"id": m["id"], "email": basic, "receipt": data}
+            total += 1
+            if args.ndjson:
+                sys.stdout.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+                sys.stdout.flush()
+            if data.get("success"):
+                ok_count += 1
+                if len(ok) < 50:
+                    ok.append(record)
+        log(f"Total mensagens: {total} | Recibos válidos: {ok_count}")
     except Exception as e:
-        print(f"Erro na varredura: {e}")
+        log(f"Erro na varredura: {e}")
         sys.exit(1)
 
     # Enviar relatório opcional
@@ -93,19 +96,21 @@ def main():
                 + "".join(linhas)
                 + "</table></body></html>"
             )
-            res = es.send_email([args.target_email], subject=f"Relatório de Recibos - {len(ok)} encontrados", body=html, is_html=True)
-            print("Envio:", res)
+            res = es.send_email([args.target_email], subject=f"Relatório de Recibos - {ok_count} encontrados", body=html, is_html=True)
+            log("Envio:", res)
         except Exception as e:
-            print(f"Erro ao enviar relatório: {e}")
+            log(f"Erro ao enviar relatório: {e}")
             sys.exit(1)
 
-    # Saída JSON resumida
+    # Saída JSON resumida (no modo NDJSON os registros já foram emitidos)
+    if args.ndjson:
+        return
     print("\nResumo JSON:")
     print(
         json.dumps(
             {
                 "messages_processed": total,
-                "receipts_ok": len(ok),
+                "receipts_ok": ok_count,
                 "sample": ok[:3],
             },
             ensure_ascii=False,
@@ -113,7 +118,6 @@ def main():
         )
     )
 
-
 if __name__ == "__main__":
     main()
 
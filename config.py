@@ -28,6 +28,47 @@ class Config:
     OPENAI_API_KEY: Optional[str] = os.getenv('OPENAI_API_KEY')
     ZELLO_API_KEY: Optional[str] = os.getenv('ZELLO_API_KEY')
     ZELLO_BASE_URL: str = os.getenv('ZELLO_BASE_URL', 'https://api.zello.com')
+    OPENAI_BASE_URL: str = os.getenv('OPENAI_BASE_URL', 'https://api.openai.com')
+    OPENAI_MODEL: str = os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo')
+    
+    # Cliente HTTP das LLMs (pool keep-alive, timeout e retry por chamada)
+    LLM_TIMEOUT_SECONDS: float = float(os.getenv('LLM_TIMEOUT_SECONDS', '30'))
+    LLM_MAX_RETRIES: int = int(os.getenv('LLM_MAX_RETRIES', '2'))
+    LLM_BACKOFF_SECONDS: float = float(os.getenv('LLM_BACKOFF_SECONDS', '0.5'))
+    LLM_MAX_RETRY_DELAY_SECONDS: float = float(os.getenv('LLM_MAX_RETRY_DELAY_SECONDS', '30'))  # teto do backoff e do Retry-After
+    LLM_POOL_SIZE: int = int(os.getenv('LLM_POOL_SIZE', '10'))  # conexões mantidas por host
+    LLM_ASYNC_CONCURRENCY: int = int(os.getenv('LLM_ASYNC_CONCURRENCY', '8'))  # chamadas simultâneas no modo async
+    
+    # Cache de respostas de extração (SQLite, TTL + limite de entradas)
+    LLM_CACHE_ENABLED: bool = os.getenv('LLM_CACHE_ENABLED', 'true').lower() == 'true'
+    LLM_CACHE_PATH: str = os.getenv('LLM_CACHE_PATH', 'data/llm_cache.db')
+    LLM_CACHE_TTL_HOURS: float = float(os.getenv('LLM_CACHE_TTL_HOURS', '720'))  # 30 dias
+    LLM_CACHE_MAX_ENTRIES: int = int(os.getenv('LLM_CACHE_MAX_ENTRIES', '10000'))
+    
+    # Extração determinística (regex) antes da LLM
+    RECEIPT_FAST_PATH_ENABLED: bool = os.getenv('RECEIPT_FAST_PATH_ENABLED', 'true').lower() == 'true'
+    RECEIPT_FAST_PATH_MIN_CONFIDENCE: int = int(os.getenv('RECEIPT_FAST_PATH_MIN_CONFIDENCE', '90'))  # 0-100
+    # JSON com os provedores de IA ({"Provedor": {"senders": [...], "domains": [...]}}); vazio = provedores padrão
+    PROVIDERS_CONFIG_PATH: Optional[str] = os.getenv('PROVIDERS_CONFIG_PATH')
+    # Reextração em lote (pool de processos): 0 = todos os núcleos disponíveis
+    EXTRACTION_WORKERS: int = int(os.getenv('EXTRACTION_WORKERS', '0'))
+    EXTRACTION_CHUNKSIZE: int = int(os.getenv('EXTRACTION_CHUNKSIZE', '64'))
+    # Trecho do email enviado à LLM: k blocos mais densos em palavras de recibo, dentro do orçamento
+    RECEIPT_SEGMENT_TOP_K: int = int(os.getenv('RECEIPT_SEGMENT_TOP_K', '4'))
+    RECEIPT_SEGMENT_MAX_CHARS: int = int(os.getenv('RECEIPT_SEGMENT_MAX_CHARS', '3000'))
+    RECEIPT_SEGMENT_BLOCK_MAX_CHARS: int = int(os.getenv('RECEIPT_SEGMENT_BLOCK_MAX_CHARS', '800'))
+    RECEIPT_SEGMENT_MAX_INPUT_CHARS: int = int(os.getenv('RECEIPT_SEGMENT_MAX_INPUT_CHARS', '2000000'))
+
+    # Anexos (PDF/imagem): camada de texto do PDF primeiro, OCR em pool de processos só quando faltar
+    ATTACHMENT_INGESTION_ENABLED: bool = os.getenv('ATTACHMENT_INGESTION_ENABLED', 'true').lower() == 'true'
+    ATTACHMENT_MAX_MB: int = int(os.getenv('ATTACHMENT_MAX_MB', '15'))
+    ATTACHMENT_MIN_TEXT_CHARS: int = int(os.getenv('ATTACHMENT_MIN_TEXT_CHARS', '40'))  # abaixo disso a página vai para OCR
+    ATTACHMENT_OCR_WORKERS: int = int(os.getenv('ATTACHMENT_OCR_WORKERS', '2'))
+    ATTACHMENT_OCR_DPI: int = int(os.getenv('ATTACHMENT_OCR_DPI', '200'))
+    ATTACHMENT_OCR_LANG: str = os.getenv('ATTACHMENT_OCR_LANG', 'por+eng')
+    ATTACHMENT_CACHE_PATH: str = os.getenv('ATTACHMENT_CACHE_PATH', 'data/attachment_cache.db')
+    ATTACHMENT_CACHE_TTL_HOURS: float = float(os.getenv('ATTACHMENT_CACHE_TTL_HOURS', '8760'))  # 1 ano
+    ATTACHMENT_CACHE_MAX_ENTRIES: int = int(os.getenv('ATTACHMENT_CACHE_MAX_ENTRIES', '5000'))
     
     # APIs de faturamento
     ANTHROPIC_ADMIN_API_KEY: Optional[str] = os.getenv('ANTHROPIC_ADMIN_API_KEY')
@@ -39,6 +80,14 @@ class Config:
     SMTP_USERNAME: Optional[str] = os.getenv('EMAIL_USERNAME')
     SMTP_PASSWORD: Optional[str] = os.getenv('EMAIL_PASSWORD')
     EMAIL_FROM: Optional[str] = os.getenv('EMAIL_FROM', os.getenv('EMAIL_USERNAME'))
+    SMTP_STARTTLS: bool = os.getenv('EMAIL_SMTP_STARTTLS', 'true').lower() == 'true'  # false só para sinks locais
+    SMTP_TIMEOUT_SECONDS: float = float(os.getenv('EMAIL_SMTP_TIMEOUT_SECONDS', '30'))
+    
+    # Pool de sessões SMTP do encaminhador
+    SMTP_POOL_SIZE: int = int(os.getenv('EMAIL_SMTP_POOL_SIZE', '3'))
+    SMTP_SESSION_MAX_IDLE_SECONDS: float = float(os.getenv('EMAIL_SMTP_SESSION_MAX_IDLE_SECONDS', '60'))
+    SMTP_SESSION_MAX_MESSAGES: int = int(os.getenv('EMAIL_SMTP_SESSION_MAX_MESSAGES', '100'))
+    FORWARDER_WORKERS: int = int(os.getenv('FORWARDER_WORKERS', '3'))
     
     # Configurações de upload
     MAX_CONTENT_LENGTH: int = int(os.getenv('MAX_CONTENT_LENGTH', '16777216'))  # 16MB
@@ -55,16 +104,68 @@ class Config:
     # Configurações de monitoramento
     GMAIL_MONITORED_EMAIL: Optional[str] = os.getenv('GMAIL_MONITORED_EMAIL')
     REPORTS_EMAIL: Optional[str] = os.getenv('REPORTS_EMAIL')
+
+    # Encaminhador: label aplicado aos recibos já tratados (excluído da busca) e tamanho do lote de batchModify
+    FORWARDER_PROCESSED_LABEL: str = os.getenv('FORWARDER_PROCESSED_LABEL', 'IA-Recibos/Encaminhado')
+    FORWARDER_LABEL_BATCH_SIZE: int = int(os.getenv('FORWARDER_LABEL_BATCH_SIZE', '500'))  # até 1000
+    # Encaminhador em modo daemon: polling mais curto nos dias de pico (MONITOR_PEAK_DAYS), dobrando a cada ciclo ocioso até o teto
+    FORWARDER_POLL_SECONDS: int = int(os.getenv('FORWARDER_POLL_SECONDS', '900'))
+    FORWARDER_PEAK_POLL_SECONDS: int = int(os.getenv('FORWARDER_PEAK_POLL_SECONDS', '120'))
+    FORWARDER_IDLE_MAX_POLL_SECONDS: int = int(os.getenv('FORWARDER_IDLE_MAX_POLL_SECONDS', '3600'))
     
     # Configurações de agendamento
     MONITOR_PEAK_DAYS: str = os.getenv('MONITOR_PEAK_DAYS', '15,16,17,18')
     MONITOR_PEAK_INTERVAL_HOURS: int = int(os.getenv('MONITOR_PEAK_INTERVAL_HOURS', '2'))
     MONITOR_NORMAL_INTERVAL_HOURS: int = int(os.getenv('MONITOR_NORMAL_INTERVAL_HOURS', '12'))
 
+    # Processamento de jobs (vazão do motor paralelo)
+    JOB_BATCH_LIMIT: int = int(os.getenv('JOB_BATCH_LIMIT', '50'))  # jobs reivindicados por execução
+    JOB_PROCESS_INTERVAL_MINUTES: int = int(os.getenv('JOB_PROCESS_INTERVAL_MINUTES', '30'))
+    JOB_WORKERS: int = int(os.getenv('JOB_WORKERS', '4'))  # jobs processados em paralelo
+    JOB_LLM_PROVIDER: str = os.getenv('JOB_LLM_PROVIDER', 'auto')  # 'auto', 'openai' ou 'zello'
+    JOB_PROVIDER_CONCURRENCY: str = os.getenv('JOB_PROVIDER_CONCURRENCY', 'openai=4,zello=2,auto=4')
+    JOB_STATUS_COMMIT_BATCH: int = int(os.getenv('JOB_STATUS_COMMIT_BATCH', '10'))
+    # Jobs em PROCESSING há mais tempo que isso (processo caiu no meio) voltam a ser reivindicados
+    JOB_CLAIM_TIMEOUT_MINUTES: int = int(os.getenv('JOB_CLAIM_TIMEOUT_MINUTES', '60'))
+
     # Google APIs
     GOOGLE_CREDENTIALS_JSON: Optional[str] = os.getenv('GOOGLE_CREDENTIALS_JSON')  # caminho do JSON da service account
     GMAIL_DELEGATED_USER: Optional[str] = os.getenv('GMAIL_DELEGATED_USER')  # e-mail a ser delegado (DWD)
     GDRIVE_ROOT_FOLDER_ID: Optional[str] = os.getenv('GDRIVE_ROOT_FOLDER_ID')  # pasta raiz onde salvar
+
+    # Busca em lote na Gmail API (até 100 chamadas por requisição HTTP batch)
+    GMAIL_BATCH_SIZE: int = int(os.getenv('GMAIL_BATCH_SIZE', '100'))
+    GMAIL_BATCH_URI: Optional[str] = os.getenv('GMAIL_BATCH_URI')  # endpoint batch alternativo (ex.: stub local)
+
+    # Rate limiting da Gmail API (token bucket em unidades de quota; limite por usuário = 250/s)
+    GMAIL_QUOTA_UNITS_PER_SECOND: float = float(os.getenv('GMAIL_QUOTA_UNITS_PER_SECOND', '250'))
+    GMAIL_QUOTA_BURST_UNITS: float = float(os.getenv('GMAIL_QUOTA_BURST_UNITS', '250'))
+    GMAIL_BACKOFF_BASE_SECONDS: float = float(os.getenv('GMAIL_BACKOFF_BASE_SECONDS', '1'))
+
+    # Sincronização incremental via historyId (fallback para varredura da janela de dias)
+    GMAIL_INCREMENTAL_SYNC: bool = os.getenv('GMAIL_INCREMENTAL_SYNC', 'true').lower() == 'true'
+    GMAIL_SYNC_DAYS_BACK: int = int(os.getenv('GMAIL_SYNC_DAYS_BACK', '30'))
+
+    # Backfill fragmentado (remetente x janela de datas, paginados em paralelo)
+    GMAIL_BACKFILL_SHARDED: bool = os.getenv('GMAIL_BACKFILL_SHARDED', 'true').lower() == 'true'
+    GMAIL_BACKFILL_WORKERS: int = int(os.getenv('GMAIL_BACKFILL_WORKERS', '4'))
+    GMAIL_BACKFILL_WINDOW_DAYS: int = int(os.getenv('GMAIL_BACKFILL_WINDOW_DAYS', '30'))
+
+    # Pipeline concorrente (listagem -> download -> extração)
+    GMAIL_PIPELINE_CONCURRENCY: int = int(os.getenv('GMAIL_PIPELINE_CONCURRENCY', '4'))  # workers de download
+    GMAIL_PIPELINE_QUEUE_SIZE: int = int(os.getenv('GMAIL_PIPELINE_QUEUE_SIZE', '200'))  # capacidade de cada fila
+    
+    # Busca em duas fases: metadados (From/Subject/Date) antes do corpo completo
+    GMAIL_TWO_PHASE_FETCH: bool = os.getenv('GMAIL_TWO_PHASE_FETCH', 'true').lower() == 'true'
+
+    # Varredura concorrente de várias caixas (um cliente por caixa/thread, credenciais compartilhadas)
+    GMAIL_MAILBOX_CONCURRENCY: int = int(os.getenv('GMAIL_MAILBOX_CONCURRENCY', '4'))
+    GMAIL_TOKEN_REFRESH_MARGIN_SECONDS: int = int(os.getenv('GMAIL_TOKEN_REFRESH_MARGIN_SECONDS', '300'))
+
+    # Cache local de mensagens brutas (gzip em disco, LRU limitado por tamanho)
+    GMAIL_MESSAGE_CACHE_ENABLED: bool = os.getenv('GMAIL_MESSAGE_CACHE_ENABLED', 'true').lower() == 'true'
+    GMAIL_MESSAGE_CACHE_DIR: str = os.getenv('GMAIL_MESSAGE_CACHE_DIR', 'data/message_cache')
+    GMAIL_MESSAGE_CACHE_MAX_MB: int = int(os.getenv('GMAIL_MESSAGE_CACHE_MAX_MB', '512'))
     
     @classmethod
     def validate_config(cls) -> list[str]:
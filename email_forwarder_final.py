@@ -10,22 +10,34 @@ Funcionalidade:
 4. Marca como processado
 
 Uso:
-    python email_forwarder_final.py
+    python email_forwarder_final.py            # execução única
+    python email_forwarder_final.py --daemon   # contínuo, retomando do checkpoint
 """
 
+import argparse
 import os
+import re
+import signal
 import sys
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 # Adicionar o diretório atual ao path para imports
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from config import config
-from services.gmail_service import GmailService
+from services.gmail_service import GmailService, GmailMessageNotFoundError, MESSAGE_GONE_STATUS
 from services.email_service import EmailService
-from services.receipt_parser import parse_receipt_basic
+from services.smtp_pool import SMTPConnectionPool
+from services.receipt_parser import parse_receipt_basic, scan_keywords
+from services.processed_registry import ProcessedRegistry
+from services.provider_registry import get_provider_registry
+from services.sync_state_store import GmailSyncStateStore
+from database import init_db
 
 # Configurar logging
 logging.basicConfig(
@@ -38,29 +50,8 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Provedores de IA para filtrar
-IA_PROVIDERS = [
-    'openai.com',
-    'anthropic.com', 
-    'cursor.com',
-    'manus.ai',
-    'n8n.io',
-    'gemini-noreply@google.com',  # Google AI
-    'noreply@openai.com',
-    'noreply@anthropic.com',
-    'billing@openai.com',
-    'billing@anthropic.com',
-    'support@cursor.com',
-    'billing@manus.ai',
-    'noreply@n8n.io'
-]
-
-# Palavras-chave para identificar recibos
-RECEIPT_KEYWORDS = [
-    'invoice', 'recibo', 'fatura', 'bill', 'receipt',
-    'billing', 'payment', 'pagamento', 'cobranca',
-    'subscription', 'assinatura', 'usage', 'uso'
-]
+# Data ISO no corpo (fallback da chave de duplicata)
+ISO_DATE_RE = re.compile(r"\b(20\d{2})-(0[1-9]|1[0-2])-(0[1-9]|[12]\d|3[01])\b")
 
 
 class EmailForwarder:
@@ -70,10 +61,25 @@ class EmailForwarder:
         """Inicializa o encaminhador."""
         self.gmail_service = None
         self.email_service = EmailService()
+        self.provider_registry = get_provider_registry()
         self.processed_count = 0
         self.error_count = 0
-        self._registry_path = os.path.join(os.path.dirname(__file__), 'processed_registry.json')
-        self._registry = self._load_registry()
+        self.fetch_stats = {
+            'listed': 0, 'candidates': 0, 'full_downloads_avoided': 0, 'bytes_avoided': 0,
+            'metadata_bytes': 0, 'net_bytes_saved': 0, 'http_requests': 0, 'http_requests_single_mode': 0
+        }
+        # Label dos já tratados: aplicado em lote e excluído das próximas buscas
+        self.processed_label = config.FORWARDER_PROCESSED_LABEL
+        self.label_batch_size = max(1, min(1000, config.FORWARDER_LABEL_BATCH_SIZE))
+        self._pending_labels: Dict[str, List[str]] = {}
+        self.labeled_count = 0
+        self.fetch_errors = 0
+        self.missing_messages = 0
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        self._registry_path = os.path.join(base_dir, 'processed_registry.jsonl')
+        self._registry = ProcessedRegistry(
+            self._registry_path, legacy_json_path=os.path.join(base_dir, 'processed_registry.json')
+        )
         
         # Inicializar Gmail Service
         if config.GOOGLE_CREDENTIALS_JSON and os.path.exists(config.GOOGLE_CREDENTIALS_JSON):
@@ -97,97 +103,63 @@ class EmailForwarder:
             sys.exit(1)
 
     # -----------------------------
-    # Registro de duplicatas (arquivo JSON simples)
+    # Registro de duplicatas (log append-only com índices em memória)
     # -----------------------------
-    def _load_registry(self) -> Dict[str, Any]:
-        try:
-            import json
-            if os.path.exists(self._registry_path):
-                with open(self._registry_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    data.setdefault('by_invoice', {})
-                    data.setdefault('by_triplet', {})
-                    return data
-        except Exception as e:
-            logger.warning(f"Falha ao carregar registry: {e}")
-        return {'by_invoice': {}, 'by_triplet': {}}
-
-    def _save_registry(self) -> None:
-        try:
-            import json
-            with open(self._registry_path, 'w', encoding='utf-8') as f:
-                json.dump(self._registry, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            logger.warning(f"Falha ao salvar registry: {e}")
-
     def _make_triplet_key(self, provider: str | None, date_iso: str | None, amount: float | None) -> str:
         return f"{(provider or '').lower()}|{date_iso or ''}|{str(amount or '')}"
 
-    def is_duplicate(self, receipt_email: Dict[str, Any]) -> bool:
-        """Detecta duplicatas por número de recibo; fallback em (provider, date, amount)."""
+    def _registry_keys(self, receipt_email: Dict[str, Any]) -> Dict[str, Any]:
+        """Número do recibo e dados da chave (provider, date, amount) de um recibo."""
         parsed = receipt_email.get('parsed') or {}
         invoice = (parsed.get('invoice_number') or '').strip()
         provider = (parsed.get('provider') or receipt_email.get('sender') or '').strip()
-        # Extrair data ISO do texto já parseado se existir
-        date_iso = None
-        # Tentar achar data no body em ISO como fallback
-        try:
-            import re
-            m = re.search(r"\b(20\d{2})-(0[1-9]|1[0-2])-(0[1-9]|[12]\d|3[01])\b", receipt_email.get('body') or '')
-            if m:
-                date_iso = m.group(0)
-        except Exception:
-            pass
+        # Data ISO no body como fallback
+        m = ISO_DATE_RE.search(receipt_email.get('body') or '')
+        date_iso = m.group(0) if m else None
         amount = parsed.get('amount')
+        return {
+            'invoice': invoice,
+            'provider': provider,
+            'date': date_iso,
+            'amount': amount,
+            'triplet': self._make_triplet_key(provider, date_iso, amount),
+        }
 
-        if invoice:
-            if invoice in self._registry['by_invoice']:
-                return True
-        triplet = self._make_triplet_key(provider, date_iso, amount)
-        if triplet in self._registry['by_triplet']:
+    def is_duplicate(self, receipt_email: Dict[str, Any]) -> bool:
+        """Detecta duplicatas por número de recibo; fallback em (provider, date, amount)."""
+        keys = self._registry_keys(receipt_email)
+        if keys['invoice'] and self._registry.contains_invoice(keys['invoice']):
             return True
-        return False
+        return self._registry.contains_triplet(keys['triplet'])
 
     def register_processed(self, receipt_email: Dict[str, Any]) -> None:
-        parsed = receipt_email.get('parsed') or {}
-        invoice = (parsed.get('invoice_number') or '').strip()
-        provider = (parsed.get('provider') or receipt_email.get('sender') or '').strip()
-        # Data ISO fallback
-        date_iso = None
+        keys = self._registry_keys(receipt_email)
         try:
-            import re
-            m = re.search(r"\b(20\d{2})-(0[1-9]|1[0-2])-(0[1-9]|[12]\d|3[01])\b", receipt_email.get('body') or '')
-            if m:
-                date_iso = m.group(0)
-        except Exception:
-            pass
-        amount = parsed.get('amount')
-        if invoice:
-            self._registry['by_invoice'][invoice] = {
-                'provider': provider,
-                'date': date_iso,
-                'amount': amount,
-                'message_id': receipt_email.get('id')
-            }
-        triplet = self._make_triplet_key(provider, date_iso, amount)
-        self._registry['by_triplet'][triplet] = {
-            'invoice_number': invoice,
-            'message_id': receipt_email.get('id')
-        }
-        self._save_registry()
-    
+            self._registry.register(
+                keys['triplet'],
+                {'invoice_number': keys['invoice'], 'message_id': receipt_email.get('id')},
+                invoice=keys['invoice'] or None,
+                invoice_value={
+                    'provider': keys['provider'],
+                    'date': keys['date'],
+                    'amount': keys['amount'],
+                    'message_id': receipt_email.get('id')
+                }
+            )
+        except Exception as e:
+            logger.warning(f"Falha ao salvar registry: {e}")
+
     def is_ia_provider_email(self, sender: str) -> bool:
         """
-        Verifica se o email é de um provedor de IA.
+        Verifica se o email é de um provedor de IA (endereço, tag `+` ou domínio do provedor).
         
         Args:
-            sender: Email do remetente
+            sender: Header From ou email do remetente
             
         Returns:
             True se for de provedor de IA
         """
-        sender_lower = sender.lower()
-        return any(provider in sender_lower for provider in IA_PROVIDERS)
+        return self.provider_registry.resolve(sender) is not None
     
     def is_receipt_email(self, subject: str, body: str) -> bool:
         """
@@ -200,8 +172,91 @@ class EmailForwarder:
         Returns:
             True se for um recibo
         """
-        text = f"{subject} {body}".lower()
-        return any(keyword in text for keyword in RECEIPT_KEYWORDS)
+        return bool(scan_keywords(f"{subject} {body}")['receipt_keywords'])
+    
+    def _is_candidate_headers(self, headers: Dict[str, str]) -> bool:
+        """Classificação pelos metadados: só remetentes de IA têm o corpo baixado."""
+        return self.is_ia_provider_email(headers.get('from', ''))
+    
+    def _accumulate_fetch_stats(self, stats: Dict[str, Any]) -> None:
+        for key in self.fetch_stats:
+            self.fetch_stats[key] += stats.get(key, 0)
+    
+    def _build_receipt_emails(self, user_email: str, messages: List[Dict[str, Any]],
+                              limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Baixa e filtra uma leva de mensagens, montando os recibos de IA.
+        
+        Args:
+            user_email: Caixa das mensagens
+            messages: Mensagens no formato da listagem ({'id': ...})
+            limit: Máximo de recibos retornados (None = sem limite)
+            
+        Returns:
+            Recibos com 'id', 'sender', 'subject', 'body', 'message' e 'parsed'
+        """
+        receipt_emails: List[Dict[str, Any]] = []
+        limit = limit if limit is not None else len(messages)
+        
+        # Fase 1: metadados de todas; fase 2: corpo só dos remetentes de IA
+        prefetched = None
+        if self.gmail_service.two_phase_fetch:
+            prefetched, stats = self.gmail_service.fetch_candidate_messages(
+                user_email, [m['id'] for m in messages], self._is_candidate_headers
+            )
+            self._accumulate_fetch_stats(stats)
+
+        for msg_summary in messages:
+            try:
+                # Obter detalhes completos do email
+                if prefetched is not None:
+                    if msg_summary['id'] not in prefetched:
+                        continue  # remetente fora dos provedores de IA
+                    fetch_result = prefetched[msg_summary['id']]
+                    if not fetch_result['success']:
+                        if fetch_result.get('status') in MESSAGE_GONE_STATUS:
+                            raise GmailMessageNotFoundError(fetch_result['error'])
+                        raise Exception(fetch_result['error'])
+                    message = fetch_result['message']
+                else:
+                    message = self.gmail_service.get_message(user_email, msg_summary['id'])
+
+                # Extrair informações do email
+                headers = message.get('payload', {}).get('headers', [])
+                sender = next((h['value'] for h in headers if h['name'] == 'From'), '')
+                subject = next((h['value'] for h in headers if h['name'] == 'Subject'), '')
+
+                # Extrair corpo do email
+                body = self.gmail_service.extract_plain_text(message)
+
+                # Verificar se é de provedor de IA e se é recibo (uma varredura serve também ao parser)
+                keyword_hits = scan_keywords(f"{subject}\n{body}") if self.is_ia_provider_email(sender) else None
+                if keyword_hits and keyword_hits['receipt_keywords']:
+
+                    parsed = parse_receipt_basic(subject, body, keyword_hits=keyword_hits)
+                    receipt_emails.append({
+                        'id': msg_summary['id'],
+                        'sender': sender,
+                        'subject': subject,
+                        'body': body,
+                        'message': message,
+                        'parsed': parsed
+                    })
+
+                    logger.info(f"Recibo encontrado: {subject} de {sender}")
+                    if len(receipt_emails) >= limit:
+                        break
+
+            except GmailMessageNotFoundError:
+                # Removida entre o histórico e a leitura: nada a encaminhar, não segura o checkpoint
+                logger.info(f"Email {msg_summary['id']} removido antes da leitura; ignorado")
+                self.missing_messages += 1
+                continue
+            except Exception as e:
+                logger.warning(f"Erro ao processar email {msg_summary['id']}: {e}")
+                self.fetch_errors += 1
+                continue
+        return receipt_emails
     
     def get_receipt_emails(self, user_email: str, max_results: int = 500) -> List[Dict[str, Any]]:
         """
@@ -225,49 +280,18 @@ class EmailForwarder:
                 resp = self.gmail_service.list_receipt_messages(
                     user_email=user_email,
                     page_token=page_token,
-                    max_results=min(page_size, max_results - fetched)
+                    max_results=min(page_size, max_results - fetched),
+                    exclude_label=self.processed_label or None
                 )
                 messages = resp.get('messages', [])
                 page_token = resp.get('nextPageToken')
                 
                 if not messages:
                     break
-            
-                for msg_summary in messages:
-                try:
-                    # Obter detalhes completos do email
-                    message = self.gmail_service.get_message(user_email, msg_summary['id'])
-                    
-                    # Extrair informações do email
-                    headers = message.get('payload', {}).get('headers', [])
-                    sender = next((h['value'] for h in headers if h['name'] == 'From'), '')
-                    subject = next((h['value'] for h in headers if h['name'] == 'Subject'), '')
-                    
-                    # Extrair corpo do email
-                    body = self.gmail_service.extract_plain_text(message)
-                    
-                    # Verificar se é de provedor de IA e se é recibo
-                    if (self.is_ia_provider_email(sender) and 
-                        self.is_receipt_email(subject, body)):
-                        
-                        parsed = parse_receipt_basic(subject, body)
-                        receipt_emails.append({
-                            'id': msg_summary['id'],
-                            'sender': sender,
-                            'subject': subject,
-                            'body': body,
-                            'message': message,
-                            'parsed': parsed
-                        })
-                        
-                        logger.info(f"Recibo encontrado: {subject} de {sender}")
-                        fetched += 1
-                        if fetched >= max_results:
-                            break
                 
-                except Exception as e:
-                    logger.warning(f"Erro ao processar email {msg_summary['id']}: {e}")
-                    continue
+                page_receipts = self._build_receipt_emails(user_email, messages, max_results - fetched)
+                receipt_emails.extend(page_receipts)
+                fetched += len(page_receipts)
                 
                 if fetched >= max_results:
                     break
@@ -281,13 +305,15 @@ class EmailForwarder:
             logger.error(f"Erro ao buscar emails: {e}")
             return []
     
-    def forward_email(self, receipt_email: Dict[str, Any], target_email: str) -> bool:
+    def forward_email(self, receipt_email: Dict[str, Any], target_email: str,
+                      smtp_pool: Optional[SMTPConnectionPool] = None) -> bool:
         """
         Encaminha um email de recibo para o email de destino.
         
         Args:
             receipt_email: Dados do email de recibo
             target_email: Email de destino
+            smtp_pool: Pool de sessões SMTP (sem ele, uma conexão por envio)
             
         Returns:
             True se encaminhado com sucesso
@@ -334,41 +360,148 @@ Este email foi processado automaticamente pelo sistema de automacao de recibos d
             """.strip()
             
             # Enviar email
-            success = self.email_service.send_email(
-                to=[target_email],
+            result = self.email_service.send_email(
+                to_emails=[target_email],
                 subject=forward_subject,
-                body=forward_body
+                body=forward_body,
+                smtp_pool=smtp_pool
             )
             
-            if success:
+            if result.get('success'):
                 logger.info(f"Email encaminhado: {subject} -> {target_email}")
                 return True
             else:
-                logger.error(f"Falha ao encaminhar: {subject}")
+                logger.error(f"Falha ao encaminhar: {subject} ({result.get('error')})")
                 return False
                 
         except Exception as e:
             logger.error(f"Erro ao encaminhar email: {e}")
             return False
     
+    def forward_receipts(self, receipt_emails: List[Dict[str, Any]], source_email: str,
+                         target_email: str, workers: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Encaminha os recibos em paralelo, reaproveitando sessões SMTP autenticadas.
+        
+        Duplicatas (no registro ou repetidas nesta leva) são filtradas antes do envio;
+        registro e labels são atualizados na thread chamadora.
+        
+        Args:
+            receipt_emails: Recibos retornados por `get_receipt_emails`
+            source_email: Caixa de origem (para o label de processado)
+            target_email: Email de destino
+            workers: Envios simultâneos (padrão: FORWARDER_WORKERS)
+            
+        Returns:
+            Estatísticas: enviados, falhas, duplicatas, latência por mensagem e vazão
+        """
+        started = time.perf_counter()
+        to_send = []
+        seen_keys = set()
+        duplicates = 0
+        for receipt_email in receipt_emails:
+            keys = self._registry_keys(receipt_email)
+            run_keys = {('invoice', keys['invoice'])} if keys['invoice'] else set()
+            run_keys.add(('triplet', keys['triplet']))
+            if self.is_duplicate(receipt_email) or run_keys & seen_keys:
+                logger.info(f"Ignorado duplicata: {receipt_email.get('subject')}")
+                self.mark_as_processed(source_email, receipt_email['id'])  # não volta na próxima busca
+                duplicates += 1
+                continue
+            seen_keys |= run_keys
+            to_send.append(receipt_email)
+        
+        latencies: List[float] = []
+        sent = failed = 0
+        smtp_stats: Dict[str, Any] = {}
+        if to_send:
+            smtp_pool = self.email_service.create_smtp_pool()
+            
+            def _forward(receipt_email):
+                sent_at = time.perf_counter()
+                ok = self.forward_email(receipt_email, target_email, smtp_pool)
+                return ok, time.perf_counter() - sent_at
+            
+            try:
+                max_workers = min(len(to_send), max(1, workers or config.FORWARDER_WORKERS))
+                with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='forwarder') as executor:
+                    futures = {executor.submit(_forward, receipt_email): receipt_email for receipt_email in to_send}
+                    for future in as_completed(futures):
+                        receipt_email = futures[future]
+                        try:
+                            ok, latency = future.result()
+                        except Exception as e:
+                            logger.error(f"Erro ao processar email {receipt_email['id']}: {e}")
+                            ok, latency = False, None
+                        if latency is not None:
+                            latencies.append(latency)
+                        if ok:
+                            sent += 1
+                            self.processed_count += 1
+                            self.mark_as_processed(source_email, receipt_email['id'])
+                            self.register_processed(receipt_email)
+                        else:
+                            failed += 1
+                            self.error_count += 1
+            finally:
+                smtp_stats = smtp_pool.get_stats()
+                smtp_pool.close()
+        
+        duration = time.perf_counter() - started
+        ordered = sorted(latencies)
+        return {
+            'sent': sent,
+            'failed': failed,
+            'duplicates': duplicates,
+            'duration_seconds': round(duration, 3),
+            'throughput_per_minute': round(sent / duration * 60, 2) if duration > 0 and sent else 0.0,
+            'latency_avg': round(sum(ordered) / len(ordered), 3) if ordered else 0.0,
+            'latency_p95': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3) if ordered else 0.0,
+            'latency_max': round(ordered[-1], 3) if ordered else 0.0,
+            'smtp': smtp_stats,
+        }
+    
     def mark_as_processed(self, user_email: str, message_id: str) -> bool:
         """
-        Marca um email como processado (adiciona label).
+        Marca um email como processado (label aplicado em lote via batchModify).
+        
+        O ID entra na fila e o label é gravado quando a fila atinge
+        FORWARDER_LABEL_BATCH_SIZE ou ao fim da execução (`flush_processed_labels`).
         
         Args:
             user_email: Email do usuário
             message_id: ID da mensagem
             
         Returns:
-            True se marcado com sucesso
+            True se marcado (ou enfileirado) com sucesso
         """
-        try:
-            # Por simplicidade, vamos apenas logar que foi processado
-            # Em uma implementação real, você adicionaria uma label específica
+        if not self.processed_label:
             logger.info(f"Email {message_id} marcado como processado")
             return True
+        
+        self._pending_labels.setdefault(user_email, []).append(message_id)
+        if len(self._pending_labels[user_email]) >= self.label_batch_size:
+            return self.flush_processed_labels(user_email)
+        return True
+
+    def flush_processed_labels(self, user_email: str) -> bool:
+        """
+        Aplica o label de processado às mensagens enfileiradas da caixa.
+        
+        Returns:
+            True se o label foi aplicado (ou não havia nada pendente)
+        """
+        message_ids = self._pending_labels.pop(user_email, [])
+        if not message_ids or not self.processed_label:
+            return True
+        try:
+            label_id = self.gmail_service.get_or_create_label(user_email, self.processed_label)
+            calls = self.gmail_service.batch_modify_labels(user_email, message_ids, add_label_ids=[label_id])
+            self.labeled_count += len(message_ids)
+            logger.info(f"Label '{self.processed_label}' aplicado a {len(message_ids)} emails ({calls} chamadas batchModify)")
+            return True
         except Exception as e:
-            logger.error(f"Erro ao marcar email como processado: {e}")
+            logger.error(f"Erro ao marcar emails como processados: {e}")
             return False
     
     def run_forwarding(self, source_email: str, target_email: str) -> Dict[str, Any]:
@@ -401,26 +534,9 @@ Este email foi processado automaticamente pelo sistema de automacao de recibos d
             
             logger.info(f"Encontrados {len(receipt_emails)} recibos para processar")
             
-            # Processar cada email
-            for receipt_email in receipt_emails:
-                try:
-                    # Evitar duplicatas
-                    if self.is_duplicate(receipt_email):
-                        logger.info(f"Ignorado duplicata: {receipt_email.get('subject')}")
-                        continue
-                    # Encaminhar email
-                    if self.forward_email(receipt_email, target_email):
-                        self.processed_count += 1
-                        
-                        # Marcar como processado
-                        self.mark_as_processed(source_email, receipt_email['id'])
-                        self.register_processed(receipt_email)
-                    else:
-                        self.error_count += 1
-                        
-                except Exception as e:
-                    logger.error(f"Erro ao processar email {receipt_email['id']}: {e}")
-                    self.error_count += 1
+            # Encaminhar em paralelo por sessões SMTP reaproveitadas
+            forward_stats = self.forward_receipts(receipt_emails, source_email, target_email)
+            self.flush_processed_labels(source_email)
             
             # Relatório final
             duration = (datetime.now() - start_time).total_seconds()
@@ -431,14 +547,29 @@ Este email foi processado automaticamente pelo sistema de automacao de recibos d
                 'errors': self.error_count,
                 'total_found': len(receipt_emails),
                 'duration_seconds': duration,
+                'fetch_stats': dict(self.fetch_stats),
+                'labeled': self.labeled_count,
+                'forward_stats': forward_stats,
                 'message': f'Processados: {self.processed_count}, Erros: {self.error_count}'
             }
             
             logger.info(f"Processo concluido em {duration:.2f}s - {result['message']}")
+            logger.info(
+                f"Encaminhamento: {forward_stats['sent']} enviados em {forward_stats['duration_seconds']}s "
+                f"({forward_stats['throughput_per_minute']}/min, latencia media {forward_stats['latency_avg']}s, "
+                f"p95 {forward_stats['latency_p95']}s)"
+            )
+            if self.fetch_stats['listed']:
+                logger.info(
+                    f"Busca em duas fases: {self.fetch_stats['full_downloads_avoided']} corpos nao baixados, "
+                    f"{self.fetch_stats['net_bytes_saved']} bytes economizados, "
+                    f"{self.fetch_stats['http_requests']} requisicoes HTTP (contra {self.fetch_stats['http_requests_single_mode']})"
+                )
             return result
             
         except Exception as e:
             logger.error(f"Erro geral no processo: {e}")
+            self.flush_processed_labels(source_email)  # não perde o que já foi encaminhado
             return {
                 'success': False,
                 'processed': self.processed_count,
@@ -446,9 +577,144 @@ Este email foi processado automaticamente pelo sistema de automacao de recibos d
                 'message': f'Erro: {str(e)}'
             }
 
+    def run_sync_cycle(self, source_email: str, target_email: str, state_store,
+                       scope: str = 'forwarder') -> Dict[str, Any]:
+        """
+        Um ciclo do modo daemon: lê só as mensagens novas desde o checkpoint e encaminha.
+        
+        O checkpoint (historyId da caixa) só avança quando todo o ciclo deu certo;
+        após uma queda, o próximo ciclo retoma do último checkpoint gravado e o que
+        já tinha sido encaminhado é descartado pelo registro de duplicatas.
+        
+        Args:
+            source_email: Email para monitorar
+            target_email: Email de destino
+            state_store: Store de checkpoints (ex.: GmailSyncStateStore)
+            scope: Escopo do checkpoint
+            
+        Returns:
+            Relatório do ciclo ('found' = recibos encontrados)
+        """
+        started = time.perf_counter()
+        self.processed_count = 0
+        self.error_count = 0
+        self.fetch_errors = 0
+        self.missing_messages = 0
+        
+        try:
+            # Sem checkpoint (primeira execução ou historyId expirado): varredura sem os já encaminhados
+            sync = self.gmail_service.sync_message_ids(
+                source_email,
+                query=self.gmail_service.build_receipt_query(config.GMAIL_SYNC_DAYS_BACK, self.processed_label or None),
+                state_store=state_store,
+                scope=scope
+            )
+            messages = sync['messages']
+            
+            receipt_emails: List[Dict[str, Any]] = []
+            for start in range(0, len(messages), 100):
+                receipt_emails.extend(self._build_receipt_emails(source_email, messages[start:start + 100]))
+            
+            forward_stats = self.forward_receipts(receipt_emails, source_email, target_email)
+            self.flush_processed_labels(source_email)
+            
+            checkpointed = forward_stats['failed'] == 0 and self.fetch_errors == 0
+            if checkpointed:
+                self.gmail_service.commit_sync(source_email, sync, state_store, scope=scope)
+            else:
+                logger.warning(
+                    f"Checkpoint mantido em {sync['previous_history_id']}: {forward_stats['failed']} envios e "
+                    f"{self.fetch_errors} leituras falharam (serão refeitos no próximo ciclo)"
+                )
+            
+            return {
+                'success': True,
+                'mode': sync['mode'],
+                'messages': len(messages),
+                'found': len(receipt_emails),
+                'processed': self.processed_count,
+                'errors': self.error_count + self.fetch_errors,
+                'missing_messages': self.missing_messages,
+                'checkpointed': checkpointed,
+                'history_id': sync['history_id'] if checkpointed else sync['previous_history_id'],
+                'forward_stats': forward_stats,
+                'duration_seconds': round(time.perf_counter() - started, 3),
+            }
+        except Exception as e:
+            logger.error(f"Erro no ciclo de {source_email}: {e}")
+            self.flush_processed_labels(source_email)
+            return {
+                'success': False,
+                'found': 0,
+                'processed': self.processed_count,
+                'errors': self.error_count + 1,
+                'checkpointed': False,
+                'message': f'Erro: {str(e)}'
+            }
+    
+    def run_daemon(self, source_email: str, target_email: str,
+                   stop_event: Optional[threading.Event] = None,
+                   state_store=None, max_cycles: Optional[int] = None) -> None:
+        """
+        Modo contínuo: ciclos incrementais em intervalo adaptativo até `stop_event`.
+        
+        Args:
+            source_email: Email para monitorar
+            target_email: Email de destino
+            stop_event: Evento de parada (SIGTERM/SIGINT no `main`)
+            state_store: Store de checkpoints (padrão: GmailSyncStateStore)
+            max_cycles: Encerra após este número de ciclos (None = sem limite)
+        """
+        stop_event = stop_event or threading.Event()
+        state_store = state_store or GmailSyncStateStore()
+        idle_cycles = 0
+        cycles = 0
+        
+        logger.info(f"Daemon iniciado: {source_email} -> {target_email}")
+        while not stop_event.is_set():
+            result = self.run_sync_cycle(source_email, target_email, state_store)
+            cycles += 1
+            idle_cycles = 0 if result['found'] else idle_cycles + 1
+            if max_cycles and cycles >= max_cycles:
+                break
+            
+            interval = compute_poll_interval(datetime.now(), idle_cycles)
+            logger.info(
+                f"Ciclo {cycles} ({result.get('mode', 'erro')}): {result['found']} recibos, "
+                f"{result['processed']} encaminhados, {result['errors']} erros; próximo em {interval}s"
+            )
+            stop_event.wait(interval)
+        logger.info("Daemon encerrado")
+
+
+def compute_poll_interval(now: datetime, idle_cycles: int = 0) -> int:
+    """
+    Intervalo (segundos) até o próximo ciclo do daemon.
+    
+    Nos dias de pico (MONITOR_PEAK_DAYS) parte de FORWARDER_PEAK_POLL_SECONDS e nunca
+    passa do intervalo normal; nos demais parte de FORWARDER_POLL_SECONDS. Cada ciclo
+    seguido sem recibos dobra o intervalo até o teto FORWARDER_IDLE_MAX_POLL_SECONDS.
+    
+    Args:
+        now: Momento atual
+        idle_cycles: Ciclos consecutivos sem recibos
+    """
+    peak_days = {int(day) for day in config.MONITOR_PEAK_DAYS.split(',') if day.strip().isdigit()}
+    if now.day in peak_days:
+        base, ceiling = config.FORWARDER_PEAK_POLL_SECONDS, config.FORWARDER_POLL_SECONDS
+    else:
+        base, ceiling = config.FORWARDER_POLL_SECONDS, config.FORWARDER_IDLE_MAX_POLL_SECONDS
+    base = max(1, base)
+    return int(min(max(base, ceiling), base * 2 ** min(idle_cycles, 16)))
+
 
 def main():
     """Função principal."""
+    parser = argparse.ArgumentParser(description='Encaminha recibos de provedores de IA')
+    parser.add_argument('--daemon', action='store_true',
+                        help='Executa continuamente, retomando do último checkpoint da caixa')
+    args = parser.parse_args()
+    
     logger.info("=" * 60)
     logger.info("AUTOMACAO DE ENCAMINHAMENTO DE RECIBOS DE IA")
     logger.info("=" * 60)
@@ -465,6 +731,14 @@ def main():
     # Inicializar encaminhador
     forwarder = EmailForwarder()
     
+    if args.daemon:
+        init_db()  # tabela de checkpoints
+        stop_event = threading.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, lambda signum, frame: stop_event.set())
+        forwarder.run_daemon(config.GMAIL_MONITORED_EMAIL, config.REPORTS_EMAIL, stop_event=stop_event)
+        sys.exit(0)
+    
     # Executar encaminhamento
     result = forwarder.run_forwarding(
         source_email=config.GMAIL_MONITORED_EMAIL,
@@ -22,6 +22,7 @@ class JobStatus:
 
 # Importar novos modelos de recibos
 from .receipt_models import ReceiptJob, Recibo
+from .sync_models import GmailSyncState
 
 # Aliases para compatibilidade
 ReceiptData = Recibo
@@ -31,4 +32,5 @@ __all__ = [
     "ReceiptJob",
     "Recibo", 
     "ReceiptData",
+    "GmailSyncState",
 ]
\ No newline at end of file
@@ -16,6 +16,9 @@ class ReceiptJob(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     source_email_id: Mapped[str] = mapped_column(String(255), nullable=False, index=True)
     source_type: Mapped[str] = mapped_column(String(32), nullable=False)  # 'EMAIL' ou 'API'
+    source_uri: Mapped[Optional[str]] = mapped_column(String(1024), nullable=True)  # ex.: gmail://usuario/id
+    source_hash: Mapped[Optional[str]] = mapped_column(String(255), nullable=True, index=True)  # chave de deduplicação
+    collaborator_email: Mapped[Optional[str]] = mapped_column(String(255), nullable=True, index=True)
     plataforma: Mapped[Optional[str]] = mapped_column(String(50), nullable=True, index=True)
     status: Mapped[str] = mapped_column(String(32), nullable=False, index=True, default=JobStatus.DISCOVERED)
     attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
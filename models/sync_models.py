@@ -0,0 +1,24 @@
+"""Modelos de estado da sincronização incremental com o Gmail."""
+
+from __future__ import annotations
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import String, Integer, DateTime, UniqueConstraint
+from sqlalchemy.orm import Mapped, mapped_column
+from database import Base
+
+
+class GmailSyncState(Base):
+    """Último historyId sincronizado por caixa monitorada e escopo de coleta."""
+    __tablename__ = "gmail_sync_state"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    user_email: Mapped[str] = mapped_column(String(255), nullable=False, index=True)
+    scope: Mapped[str] = mapped_column(String(50), nullable=False, default='receipts')  # ex.: 'receipts', 'gemini_jobs'
+    history_id: Mapped[str] = mapped_column(String(32), nullable=False)
+    last_full_sync_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint('user_email', 'scope', name='uq_gmail_sync_user_scope'),
+    )
@@ -8,6 +8,9 @@ from typing import Dict, Any
 class ReceiptPrompts:
     """Prompts para processamento de recibos de IA."""
     
+    # Incrementar ao alterar qualquer prompt: invalida o cache de respostas das LLMs
+    PROMPT_VERSION = "1"
+    
     @staticmethod
     def get_extractor_prompt() -> str:
         """Prompt para extrair dados estruturados de recibos."""
@@ -44,3 +47,13 @@ class ReceiptPrompts:
             "feedback": "sugestões de melhoria se necessário"
         }
         """
+    
+    @classmethod
+    def extract_receipt_data(cls, receipt_text: str) -> str:
+        """Prompt de extração aplicado ao texto do recibo."""
+        return f"{cls.get_extractor_prompt()}\n\nTexto do recibo:\n{receipt_text}"
+    
+    @classmethod
+    def analyze_receipt_quality(cls, extracted_json: str) -> str:
+        """Prompt de validação aplicado aos dados extraídos."""
+        return f"{cls.get_validator_prompt()}\n\nDados extraídos:\n{extracted_json}"
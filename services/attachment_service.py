@@ -0,0 +1,305 @@
+"""
+Ingestão de anexos de recibos (PDF e imagens).
+
+Muitas faturas chegam só no PDF anexo. Os anexos são baixados um a um pela
+API de anexos do Gmail; de cada PDF usa-se primeiro a camada de texto e só as
+páginas sem texto são rasterizadas e passam por OCR, em paralelo (uma página
+por tarefa) em um pool de processos. O resultado é guardado por SHA-256 do
+conteúdo, então faturas repetidas não custam nada.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from PyPDF2 import PdfReader
+
+from config import config
+from . import mime_parser
+from .llm_cache import get_llm_cache
+
+logger = logging.getLogger(__name__)
+
+# Versão da extração (faz parte da chave do cache: mudou o algoritmo, muda a chave)
+EXTRACTION_VERSION = "1"
+
+PDF_MIME_TYPES = {'application/pdf', 'application/x-pdf'}
+IMAGE_MIME_TYPES = {'image/png', 'image/jpeg', 'image/jpg', 'image/tiff', 'image/gif', 'image/bmp', 'image/webp'}
+_EXTENSION_MIME_TYPES = {
+    '.pdf': 'application/pdf', '.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg',
+    '.tif': 'image/tiff', '.tiff': 'image/tiff', '.gif': 'image/gif', '.bmp': 'image/bmp', '.webp': 'image/webp',
+}
+
+
+def _ocr_pdf_page(content: bytes, page_number: int, dpi: int, lang: str) -> str:
+    """Rasteriza e faz OCR de uma página do PDF (executa no pool de processos)."""
+    from pdf2image import convert_from_bytes
+    import pytesseract
+
+    images = convert_from_bytes(content, dpi=dpi, first_page=page_number, last_page=page_number)
+    return '\n'.join(pytesseract.image_to_string(image, lang=lang) for image in images)
+
+
+def _ocr_image(content: bytes, lang: str) -> str:
+    """Faz OCR de uma imagem (executa no pool de processos)."""
+    from PIL import Image
+    import pytesseract
+
+    with Image.open(io.BytesIO(content)) as image:
+        return pytesseract.image_to_string(image, lang=lang)
+
+
+def resolve_mime_type(mime_type: Optional[str], filename: str = '') -> str:
+    """Normaliza o MIME type, deduzindo pela extensão quando vier genérico."""
+    mime_type = (mime_type or '').lower()
+    if mime_type in PDF_MIME_TYPES or mime_type in IMAGE_MIME_TYPES:
+        return mime_type
+    return _EXTENSION_MIME_TYPES.get(os.path.splitext(filename or '')[1].lower(), mime_type)
+
+
+def is_supported_attachment(mime_type: Optional[str], filename: str = '') -> bool:
+    """Indica se o anexo é um PDF ou imagem processável."""
+    mime_type = resolve_mime_type(mime_type, filename)
+    return mime_type in PDF_MIME_TYPES or mime_type in IMAGE_MIME_TYPES
+
+
+class AttachmentService:
+    """Extrai texto de anexos PDF/imagem com cache por hash do conteúdo."""
+
+    def __init__(self, ocr_workers: Optional[int] = None, cache=None):
+        """
+        Inicializa o serviço.
+
+        Args:
+            ocr_workers: Processos de OCR (padrão: ATTACHMENT_OCR_WORKERS)
+            cache: Cache de resultados (padrão: SQLite em ATTACHMENT_CACHE_PATH)
+        """
+        self.ocr_workers = max(1, ocr_workers or config.ATTACHMENT_OCR_WORKERS)
+        self.ocr_dpi = config.ATTACHMENT_OCR_DPI
+        self.ocr_lang = config.ATTACHMENT_OCR_LANG
+        self.min_text_chars = config.ATTACHMENT_MIN_TEXT_CHARS
+        self.max_bytes = config.ATTACHMENT_MAX_MB * 1024 * 1024
+        self.cache = cache if cache is not None else get_llm_cache(
+            config.ATTACHMENT_CACHE_PATH,
+            config.ATTACHMENT_CACHE_TTL_HOURS * 3600,
+            config.ATTACHMENT_CACHE_MAX_ENTRIES
+        )
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._stats = {'attachments': 0, 'cache_hits': 0, 'pdf_text_pages': 0, 'ocr_pages': 0,
+                       'ocr_images': 0, 'skipped': 0, 'errors': 0, 'ocr_pool_restarts': 0}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                # spawn: o pool nasce em threads do scheduler/Flask, e um fork herdaria locks presos
+                self._executor = ProcessPoolExecutor(max_workers=self.ocr_workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _discard_executor(self, executor: ProcessPoolExecutor) -> None:
+        """Descarta um pool quebrado (o próximo uso cria outro)."""
+        with self._executor_lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run_ocr(self, fn: Callable[..., str], calls: Sequence[Tuple]) -> List[str]:
+        """
+        Executa as chamadas de OCR no pool, na ordem de `calls`.
+
+        Se um processo morrer (crash do tesseract), o pool fica quebrado: ele é
+        recriado e as chamadas são repetidas uma vez.
+        """
+        for attempt in range(2):
+            executor = self._get_executor()
+            try:
+                futures = [executor.submit(fn, *args) for args in calls]
+                return [future.result() for future in futures]
+            except BrokenProcessPool:
+                self._discard_executor(executor)
+                self._count('ocr_pool_restarts')
+                if attempt:
+                    raise
+                logger.warning("Pool de OCR quebrado; recriando e repetindo")
+        return []
+
+    def shutdown(self) -> None:
+        """Encerra o pool de processos de OCR."""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def _count(self, key: str, amount: int = 1) -> None:
+        with self._lock:
+            self._stats[key] += amount
+
+    def _cache_key(self, digest: str) -> str:
+        return f"attachment|{EXTRACTION_VERSION}|{self.ocr_lang}|{self.ocr_dpi}|{digest}"
+
+    def extract_text(self, content: bytes, mime_type: Optional[str], filename: str = '') -> Dict[str, Any]:
+        """
+        Extrai o texto de um anexo.
+
+        Args:
+            content: Bytes do anexo
+            mime_type: MIME type informado na mensagem
+            filename: Nome do arquivo (usado para deduzir o tipo)
+
+        Returns:
+            Dict com 'success', 'text', 'method' ('pdf_text', 'ocr', 'pdf_text+ocr' ou 'image_ocr'),
+            'sha256', 'pages', 'cached' e 'error' (se houver)
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        self._count('attachments')
+        mime_type = resolve_mime_type(mime_type, filename)
+
+        if len(content) > self.max_bytes:
+            self._count('skipped')
+            return {"success": False, "error": f"Anexo maior que {config.ATTACHMENT_MAX_MB} MB", "sha256": digest}
+
+        key = self._cache_key(digest)
+        cached = self.cache.get(key) if self.cache else None
+        if cached is not None:
+            self._count('cache_hits')
+            return {**cached, 'cached': True}
+
+        started = time.perf_counter()
+        try:
+            if mime_type in PDF_MIME_TYPES:
+                result = self._extract_pdf(content)
+            elif mime_type in IMAGE_MIME_TYPES:
+                text = self._run_ocr(_ocr_image, [(content, self.ocr_lang)])[0]
+                self._count('ocr_images')
+                result = {'text': text.strip(), 'method': 'image_ocr', 'pages': 1}
+            else:
+                self._count('skipped')
+                return {"success": False, "error": f"Tipo de anexo não suportado: {mime_type or filename}", "sha256": digest}
+        except Exception as e:
+            self._count('errors')
+            logger.error(f"Erro ao extrair texto do anexo {filename or digest[:12]}: {e}")
+            return {"success": False, "error": str(e), "sha256": digest}
+
+        result.update({'success': True, 'sha256': digest, 'duration': round(time.perf_counter() - started, 3)})
+        if self.cache:
+            self.cache.put(key, result)
+        return {**result, 'cached': False}
+
+    def _extract_pdf(self, content: bytes) -> Dict[str, Any]:
+        """Camada de texto por página; OCR em paralelo só nas páginas sem texto."""
+        reader = PdfReader(io.BytesIO(content))
+        page_texts: List[str] = []
+        for page in reader.pages:
+            try:
+                page_texts.append((page.extract_text() or '').strip())
+            except Exception:
+                page_texts.append('')
+
+        missing = [index for index, text in enumerate(page_texts) if len(text) < self.min_text_chars]
+        self._count('pdf_text_pages', len(page_texts) - len(missing))
+        if missing:
+            ocr_texts = self._run_ocr(
+                _ocr_pdf_page, [(content, index + 1, self.ocr_dpi, self.ocr_lang) for index in missing]
+            )
+            for index, ocr_text in zip(missing, ocr_texts):
+                ocr_text = ocr_text.strip()
+                if len(ocr_text) > len(page_texts[index]):
+                    page_texts[index] = ocr_text
+            self._count('ocr_pages', len(missing))
+
+        if not missing:
+            method = 'pdf_text'
+        elif len(missing) == len(page_texts):
+            method = 'ocr'
+        else:
+            method = 'pdf_text+ocr'
+        return {'text': '\n\n'.join(text for text in page_texts if text), 'method': method, 'pages': len(page_texts)}
+
+    def iter_message_attachments(self, gmail_service, user_email: str,
+                                 message: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """
+        Baixa e extrai, um por vez, os anexos PDF/imagem de uma mensagem.
+
+        Anexos inline (body.data) não geram chamada à API; os demais usam
+        `messages.attachments.get`. Só um anexo fica em memória por vez.
+
+        Args:
+            gmail_service: GmailService usado para baixar os anexos
+            user_email: Caixa da mensagem
+            message: Mensagem no formato "full"
+
+        Yields:
+            Resultado de `extract_text` com 'filename', 'mime_type' e 'size'
+        """
+        for part in mime_parser.iter_attachments(message.get('payload', {})):
+            filename = part.get('filename', '')
+            mime_type = part.get('mimeType', '')
+            if not is_supported_attachment(mime_type, filename):
+                continue
+
+            body = part.get('body', {})
+            if body.get('size', 0) > self.max_bytes:
+                self._count('skipped')
+                yield {'success': False, 'filename': filename, 'mime_type': mime_type, 'size': body.get('size'),
+                       'error': f"Anexo maior que {config.ATTACHMENT_MAX_MB} MB"}
+                continue
+
+            try:
+                if body.get('data'):
+                    content = mime_parser.decode_base64url(body['data'])
+                else:
+                    content = gmail_service.get_attachment(user_email, message.get('id', ''), body['attachmentId'])
+            except Exception as e:
+                self._count('errors')
+                yield {'success': False, 'filename': filename, 'mime_type': mime_type, 'error': str(e)}
+                continue
+
+            result = self.extract_text(content, mime_type, filename)
+            result.update({'filename': filename, 'mime_type': mime_type, 'size': len(content)})
+            yield result
+
+    def get_message_attachments_text(self, gmail_service, user_email: str, message: Dict[str, Any]) -> str:
+        """
+        Texto de todos os anexos suportados da mensagem, com um cabeçalho por anexo.
+
+        Returns:
+            Texto concatenado ('' se não houver anexos legíveis)
+        """
+        sections = []
+        for result in self.iter_message_attachments(gmail_service, user_email, message):
+            if result.get('success') and result.get('text'):
+                sections.append(f"--- Anexo: {result['filename']} ---\n{result['text']}")
+            elif not result.get('success'):
+                logger.warning(f"Anexo {result.get('filename')} ignorado: {result.get('error')}")
+        return '\n\n'.join(sections)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Retorna contadores de anexos, acertos de cache, páginas com texto e com OCR."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['ocr_workers'] = self.ocr_workers
+        return stats
+
+
+_service: Optional[AttachmentService] = None
+_service_lock = threading.Lock()
+
+
+def get_attachment_service() -> AttachmentService:
+    """Retorna a instância compartilhada do serviço (um pool de OCR por processo)."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = AttachmentService()
+        return _service
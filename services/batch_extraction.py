@@ -0,0 +1,114 @@
+"""
+Extração em lote, em vários processos (reextração de corpos já armazenados).
+
+A extração por regex (`ReceiptExtractor.extract_receipt_data` e
+`receipt_parser.parse_receipt_basic`) é CPU-bound e, em threads, fica presa ao
+GIL. `extract_batch` divide a entrada em blocos e os distribui por um pool de
+processos; cada processo monta o extrator uma única vez (padrões compilados e
+registro de provedores prontos). A entrada é consumida aos poucos, com um
+número limitado de blocos em voo, e os resultados voltam em streaming, na
+ordem de entrada.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from config import config
+from .receipt_extractor import ReceiptExtractor
+from .receipt_parser import parse_receipt_basic
+
+logger = logging.getLogger(__name__)
+
+# Extrator do processo (um por worker, criado no initializer)
+_extractor: Optional[ReceiptExtractor] = None
+
+
+def _init_worker() -> None:
+    """Monta o extrator do processo e compila os padrões antes do primeiro bloco."""
+    global _extractor
+    _extractor = ReceiptExtractor()
+    for field in _extractor.patterns:
+        _extractor._compiled_patterns(field)
+    parse_receipt_basic('', '')
+
+
+def extract_one(item: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Extrai um item no processo atual.
+
+    Args:
+        item: Email com 'sender', 'subject' e 'body' (e 'id' opcional)
+
+    Returns:
+        Dict com 'success', 'receipt' (resultado de `extract_receipt_data`),
+        'parsed' (resultado de `parse_receipt_basic`), 'id' (se informado) e 'error' (se houver)
+    """
+    if _extractor is None:
+        _init_worker()
+    try:
+        result = {
+            'success': True,
+            'receipt': _extractor.extract_receipt_data(item),
+            'parsed': parse_receipt_basic(item.get('subject') or '', item.get('body') or ''),
+        }
+    except Exception as e:
+        result = {'success': False, 'error': str(e)}
+    if 'id' in item:
+        result['id'] = item['id']
+    return result
+
+
+def _extract_chunk(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [extract_one(item) for item in items]
+
+
+def available_cpus() -> int:
+    """Núcleos disponíveis para o processo (respeita a afinidade de CPU do container)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def extract_batch(items: Iterable[Dict[str, Any]], workers: Optional[int] = None,
+                  chunksize: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Extrai um iterável de emails em paralelo, devolvendo os resultados na ordem de entrada.
+
+    Args:
+        items: Emails no formato de `extract_one` (pode ser um gerador)
+        workers: Processos (padrão: EXTRACTION_WORKERS; 0 = todos os núcleos disponíveis).
+            Com 1, extrai no próprio processo
+        chunksize: Itens por tarefa enviada a um processo (padrão: EXTRACTION_CHUNKSIZE)
+
+    Yields:
+        Resultado de `extract_one` para cada item
+    """
+    workers = workers or config.EXTRACTION_WORKERS or available_cpus()
+    chunksize = max(1, chunksize or config.EXTRACTION_CHUNKSIZE)
+    iterator = iter(items)
+    chunks = iter(lambda: list(islice(iterator, chunksize)), [])
+
+    if workers <= 1:
+        for chunk in chunks:
+            yield from _extract_chunk(chunk)
+        return
+
+    # Até dois blocos por processo em voo: mantém todos ocupados sem ler a entrada inteira
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+    pending = deque()
+    try:
+        for chunk in chunks:
+            pending.append(executor.submit(_extract_chunk, chunk))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
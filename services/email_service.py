@@ -11,6 +11,7 @@ from email.mime.base import MIMEBase
 from email import encoders
 from typing import List, Optional, Dict, Any
 from config import config
+from services.smtp_pool import SMTPConnectionPool
 
 
 class EmailService:
@@ -23,6 +24,27 @@ class EmailService:
         self.username = config.SMTP_USERNAME
         self.password = config.SMTP_PASSWORD
         self.from_email = config.EMAIL_FROM
+        self.starttls = config.SMTP_STARTTLS
+        self.timeout = config.SMTP_TIMEOUT_SECONDS
+    
+    def create_smtp_pool(self, size: Optional[int] = None) -> SMTPConnectionPool:
+        """
+        Cria um pool de sessões SMTP autenticadas com as configurações do serviço.
+        
+        Args:
+            size: Sessões simultâneas (padrão: SMTP_POOL_SIZE)
+            
+        Returns:
+            Pool para passar em `send_email(..., smtp_pool=pool)`; feche com `pool.close()`
+        """
+        return SMTPConnectionPool(
+            self.smtp_server, self.smtp_port, self.username, self.password,
+            size=size or config.SMTP_POOL_SIZE,
+            starttls=self.starttls,
+            timeout=self.timeout,
+            max_idle_seconds=config.SMTP_SESSION_MAX_IDLE_SECONDS,
+            max_messages_per_session=config.SMTP_SESSION_MAX_MESSAGES
+        )
     
     def send_email(
         self,
@@ -30,7 +52,8 @@ class EmailService:
         subject: str,
         body: str,
         is_html: bool = False,
-        attachments: Optional[List[Dict[str, Any]]] = None
+        attachments: Optional[List[Dict[str, Any]]] = None,
+        smtp_pool: Optional[SMTPConnectionPool] = None
     ) -> Dict[str, Any]:
         """
         Envia um e-mail.
@@ -41,6 +64,7 @@ class EmailService:
             body: Corpo do e-mail
             is_html: Se o corpo é HTML
             attachments: Lista de anexos (opcional)
+            smtp_pool: Pool de sessões a reaproveitar (sem ele, abre uma conexão só para este envio)
             
         Returns:
             Dicionário com resultado do envio
@@ -48,7 +72,7 @@ class EmailService:
         Raises:
             Exception: Se houver erro no envio
         """
-        if not all([self.username, self.password, self.from_email]):
+        if not self.from_email or (smtp_pool is None and not all([self.username, self.password])):
             return {
                 "success": False,
                 "error": "Configurações de e-mail não definidas"
@@ -73,11 +97,14 @@ class EmailService:
                     self._add_attachment(msg, attachment)
             
             # Conectar e enviar
-            context = ssl.create_default_context()
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.starttls(context=context)
-                server.login(self.username, self.password)
-                server.send_message(msg)
+            if smtp_pool is not None:
+                smtp_pool.send_message(msg)
+            else:
+                with smtplib.SMTP(self.smtp_server, self.smtp_port, timeout=self.timeout) as server:
+                    if self.starttls:
+                        server.starttls(context=ssl.create_default_context())
+                    server.login(self.username, self.password)
+                    server.send_message(msg)
             
             return {
                 "success": True,
@@ -36,3 +36,27 @@ class FileService:
         except Exception as e:
             logger.error(f"Erro ao ler arquivo: {e}")
             return {"success": False, "error": str(e)}
+
+    def extract_text_from_file(self, file_path: str) -> Dict[str, Any]:
+        """
+        Extrai o texto de um arquivo de recibo (PDF, imagem ou texto).
+        
+        PDFs e imagens passam pelo AttachmentService (camada de texto, OCR e cache por hash).
+        """
+        try:
+            from services.attachment_service import get_attachment_service, is_supported_attachment
+            
+            filename = os.path.basename(file_path)
+            if is_supported_attachment(None, filename):
+                with open(file_path, 'rb') as f:
+                    content = f.read()
+                result = get_attachment_service().extract_text(content, None, filename)
+                if not result['success']:
+                    return {"success": False, "error": result['error']}
+                return {"success": True, "text": result['text'], "method": result['method']}
+            
+            with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+                return {"success": True, "text": f.read(), "method": "text"}
+        except Exception as e:
+            logger.error(f"Erro ao extrair texto do arquivo: {e}")
+            return {"success": False, "error": str(e)}
@@ -0,0 +1,116 @@
+"""
+Pool de clientes da Gmail API por (caixa delegada, thread).
+
+O transporte httplib2 usado pelo googleapiclient não é thread-safe, então cada
+thread recebe o seu próprio recurso. As credenciais, por outro lado, são
+compartilhadas entre threads (uma por caixa delegada) e renovadas antes de
+expirar, para que workers concorrentes não disparem refresh ao mesmo tempo.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+
+from google.auth.transport.requests import Request
+from googleapiclient.discovery import build
+
+logger = logging.getLogger(__name__)
+
+
+class GmailClientPool:
+    """Recursos googleapiclient por (subject, thread) com cache de credenciais compartilhado."""
+
+    def __init__(self, credentials_factory: Callable[[Optional[str]], Any], refresh_margin_seconds: int = 300):
+        """
+        Inicializa o pool.
+
+        Args:
+            credentials_factory: Cria as credenciais de um subject (caixa delegada; None = padrão)
+            refresh_margin_seconds: Renova o token quando faltar menos que isso para expirar
+        """
+        self.credentials_factory = credentials_factory
+        self.refresh_margin = timedelta(seconds=refresh_margin_seconds)
+        self._credentials: Dict[Optional[str], Any] = {}
+        self._locks: Dict[Optional[str], threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats = {'clients_built': 0, 'credentials_created': 0, 'token_refreshes': 0, 'refresh_errors': 0}
+
+    def _subject_lock(self, subject: Optional[str]) -> threading.Lock:
+        with self._lock:
+            if subject not in self._locks:
+                self._locks[subject] = threading.Lock()
+            return self._locks[subject]
+
+    def get_credentials(self, subject: Optional[str] = None):
+        """
+        Retorna as credenciais compartilhadas do subject, renovando o token se estiver perto de expirar.
+
+        Args:
+            subject: Caixa delegada (service account) ou None
+
+        Returns:
+            Credenciais google-auth
+        """
+        with self._subject_lock(subject):
+            creds = self._credentials.get(subject)
+            if creds is None:
+                creds = self.credentials_factory(subject)
+                self._credentials[subject] = creds
+                with self._lock:
+                    self._stats['credentials_created'] += 1
+
+            if self._needs_refresh(creds):
+                try:
+                    creds.refresh(Request())
+                    with self._lock:
+                        self._stats['token_refreshes'] += 1
+                except Exception as e:
+                    # Mantém o token atual; o transporte tentará renovar na próxima chamada
+                    logger.warning(f"Falha ao renovar token de {subject or 'padrão'}: {e}")
+                    with self._lock:
+                        self._stats['refresh_errors'] += 1
+            return creds
+
+    def _needs_refresh(self, creds) -> bool:
+        if not getattr(creds, 'token', None):
+            return True
+        expiry = getattr(creds, 'expiry', None)
+        if expiry is None:
+            return False
+        # google-auth usa datetime UTC sem timezone
+        return expiry - self.refresh_margin <= datetime.utcnow()
+
+    def get_service(self, subject: Optional[str] = None):
+        """
+        Retorna o recurso Gmail desta thread para o subject.
+
+        Args:
+            subject: Caixa delegada (service account) ou None
+
+        Returns:
+            Recurso googleapiclient exclusivo da thread atual
+        """
+        creds = self.get_credentials(subject)
+
+        services = getattr(self._local, 'services', None)
+        if services is None:
+            services = self._local.services = {}
+
+        service = services.get(subject)
+        if service is None:
+            service = build("gmail", "v1", credentials=creds, cache_discovery=False)
+            services[subject] = service
+            with self._lock:
+                self._stats['clients_built'] += 1
+        return service
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Retorna contadores do pool (clientes criados, credenciais e renovações)."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['subjects'] = len(self._credentials)
+        return stats
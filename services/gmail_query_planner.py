@@ -0,0 +1,189 @@
+"""
+Planejador de consultas fragmentadas para backfills grandes no Gmail.
+
+Uma única query `(from:a OR from:b ...) after:...` só pode ser paginada em
+série (cada página depende do pageToken da anterior). O planejador divide o
+backfill em fragmentos disjuntos (remetente x janela de datas, com
+`after:`/`before:`), pagina os fragmentos em paralelo e junta os IDs sem
+duplicatas, de modo que um import de anos escale com o número de workers.
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Formato de data aceito por after:/before: na busca do Gmail
+GMAIL_DATE_FORMAT = '%Y/%m/%d'
+
+
+def plan_shards(senders: List[str], start: date, end: date, window_days: int = 30,
+                extra_query: str = '') -> List[Dict[str, Any]]:
+    """
+    Divide o intervalo [start, end] em fragmentos (remetente, janela).
+
+    As janelas são contíguas e usam `after:` (inclusivo) e `before:` (exclusivo)
+    com a mesma data na fronteira, então nenhum dia é coberto duas vezes.
+
+    Args:
+        senders: Remetentes (um fragmento por remetente e janela)
+        start: Primeiro dia do backfill
+        end: Último dia do backfill (inclusivo)
+        window_days: Tamanho de cada janela em dias
+        extra_query: Termos adicionais aplicados a todos os fragmentos
+
+    Returns:
+        Fragmentos com 'sender', 'after', 'before' e 'query', dos mais recentes aos mais antigos
+    """
+    window = timedelta(days=max(1, window_days))
+    stop = end + timedelta(days=1)  # before: é exclusivo
+
+    windows = []
+    cursor = start
+    while cursor < stop:
+        window_end = min(cursor + window, stop)
+        windows.append((cursor, window_end))
+        cursor = window_end
+    windows.reverse()  # recentes primeiro: os recibos mais novos chegam antes
+
+    shards = []
+    for after, before in windows:
+        for sender in dict.fromkeys(s.strip() for s in senders if s and s.strip()):
+            terms = [
+                f"from:{sender}",
+                f"after:{after.strftime(GMAIL_DATE_FORMAT)}",
+                f"before:{before.strftime(GMAIL_DATE_FORMAT)}",
+            ]
+            if extra_query:
+                terms.append(extra_query)
+            shards.append({
+                'sender': sender,
+                'after': after.isoformat(),
+                'before': before.isoformat(),
+                'query': ' '.join(terms),
+            })
+    return shards
+
+
+class GmailQueryPlanner:
+    """Pagina fragmentos de uma busca em paralelo e junta os IDs."""
+
+    def __init__(self, gmail_service, workers: int = 4, window_days: int = 30, page_size: int = 100):
+        """
+        Inicializa o planejador.
+
+        Args:
+            gmail_service: GmailService (usa `list_by_query`, seguro entre threads)
+            workers: Fragmentos paginados simultaneamente
+            window_days: Tamanho padrão da janela de cada fragmento
+            page_size: Mensagens por página (máximo da API: 500)
+        """
+        self.gmail_service = gmail_service
+        self.workers = max(1, workers)
+        self.window_days = max(1, window_days)
+        self.page_size = max(1, min(500, page_size))
+
+    def plan(self, senders: List[str], days_back: int, extra_query: str = '',
+             window_days: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Planeja os fragmentos dos últimos `days_back` dias."""
+        today = datetime.now().date()
+        return plan_shards(
+            senders, today - timedelta(days=days_back), today,
+            window_days or self.window_days, extra_query
+        )
+
+    def _list_shard(self, user_email: str, shard: Dict[str, Any]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        ids: List[str] = []
+        pages = 0
+        page_token = None
+        while True:
+            response = self.gmail_service.list_by_query(
+                user_email, shard['query'], page_token=page_token, max_results=self.page_size
+            )
+            ids.extend(message['id'] for message in response.get('messages', []))
+            pages += 1
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+        return {'ids': ids, 'pages': pages, 'duration': time.perf_counter() - started}
+
+    def collect_ids(self, user_email: str, shards: List[Dict[str, Any]],
+                    progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+                    max_results: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Pagina os fragmentos em paralelo e junta os IDs sem duplicatas.
+
+        Os IDs são juntados na ordem dos fragmentos (recentes primeiro), não na ordem
+        em que terminam, então `max_results` sempre corta os mais antigos.
+
+        Args:
+            user_email: Caixa a consultar
+            shards: Fragmentos gerados por `plan`/`plan_shards`
+            progress_callback: Chamado (na thread do chamador) ao fim de cada fragmento
+            max_results: Limite de IDs retornados (None = sem limite)
+
+        Returns:
+            Dicionário com 'message_ids', 'shards' (estatísticas por fragmento),
+            'total_listed', 'duplicates', 'errors' e 'duration'
+        """
+        started = time.perf_counter()
+        shard_ids: List[List[str]] = [[] for _ in shards]
+        seen: set = set()
+        shard_stats: List[Dict[str, Any]] = []
+        errors: List[Dict[str, Any]] = []
+        total_listed = 0
+
+        if shards:
+            workers = min(self.workers, len(shards))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='gmail-shard') as executor:
+                futures = {executor.submit(self._list_shard, user_email, shard): index
+                           for index, shard in enumerate(shards)}
+                for future in as_completed(futures):
+                    index = futures[future]
+                    shard = shards[index]
+                    stats = {'query': shard['query'], 'sender': shard['sender'],
+                             'after': shard['after'], 'before': shard['before']}
+                    try:
+                        result = future.result()
+                        total_listed += len(result['ids'])
+                        shard_ids[index] = result['ids']
+                        seen.update(result['ids'])
+                        stats.update({'status': 'completed', 'messages': len(result['ids']),
+                                      'pages': result['pages'], 'duration': round(result['duration'], 3)})
+                    except Exception as e:
+                        logger.error(f"Fragmento '{shard['query']}' falhou: {e}")
+                        errors.append({'query': shard['query'], 'error': str(e)})
+                        stats.update({'status': 'error', 'error': str(e)})
+                    shard_stats.append(stats)
+
+                    if progress_callback:
+                        progress_callback({
+                            'status': 'shard_completed' if stats['status'] == 'completed' else 'shard_error',
+                            'message': f"Fragmento {len(shard_stats)}/{len(shards)} - {stats['query']}",
+                            'completed_shards': len(shard_stats),
+                            'total_shards': len(shards),
+                            'total_messages': len(seen),
+                            'shard': stats
+                        })
+
+        merged: Dict[str, None] = {}
+        for ids in shard_ids:
+            merged.update(dict.fromkeys(ids))
+        message_ids = list(merged)
+        if max_results:
+            message_ids = message_ids[:max_results]
+
+        return {
+            'message_ids': message_ids,
+            'shards': shard_stats,
+            'total_listed': total_listed,
+            'duplicates': total_listed - len(merged),
+            'errors': errors,
+            'duration': round(time.perf_counter() - started, 3),
+        }
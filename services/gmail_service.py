@@ -5,14 +5,17 @@ Suporta OAuth2 e Domain-Wide Delegation (DWD) via service account.
 
 from __future__ import annotations
 
-from typing import Any, Dict, List, Optional, Callable
-import base64
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
 import re
 import os
 import json
 import pickle
+import queue
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
+from itertools import islice
 
 from google.oauth2 import service_account
 from google.oauth2.credentials import Credentials
@@ -20,7 +23,15 @@ from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from googleapiclient.http import BatchHttpRequest
 
+from config import config
+from .gmail_client_pool import GmailClientPool
+from .gmail_query_planner import GmailQueryPlanner
+from . import mime_parser
+from .message_cache import get_message_cache
+from .rate_limiter import GMAIL_QUOTA_UNITS, RETRYABLE_STATUS, get_gmail_rate_limiter
+from .provider_registry import get_provider_registry, parse_address
 from .receipt_extractor import ReceiptExtractor
 
 
@@ -30,42 +41,131 @@ GMAIL_SCOPES = [
 ]
 
 
+# Limite de IDs por chamada de messages.batchModify
+BATCH_MODIFY_MAX_IDS = 1000
+
+# Headers pedidos na fase de metadados (classificação sem baixar o corpo)
+METADATA_HEADERS = ['From', 'Subject', 'Date']
+
+
+class GmailHistoryExpiredError(Exception):
+    """O historyId salvo é antigo demais e a Gmail API não consegue mais listar o histórico."""
+
+
+class GmailMessageNotFoundError(Exception):
+    """A mensagem não existe mais (removida entre a listagem e a leitura)."""
+
+
+# Status de leitura de mensagem que não adianta repetir: a mensagem foi removida
+MESSAGE_GONE_STATUS = {404, 410}
+
+
 class GmailService:
     def __init__(self, credentials_json_path: str, delegated_user: Optional[str] = None, use_oauth2: bool = False):
         self.credentials_json_path = credentials_json_path
         self.delegated_user = delegated_user
         self.use_oauth2 = use_oauth2
-        self._service = None
+        self._base_credentials = None
+        self._credentials_lock = threading.Lock()
         self._token_file = "token.pickle" if use_oauth2 else None
         
-        # Inicializar ReceiptExtractor
+        # Um recurso googleapiclient por (caixa, thread) (httplib2 não é thread-safe) e
+        # credenciais compartilhadas por caixa, renovadas antes de expirar
+        self.client_pool = GmailClientPool(self._create_credentials, config.GMAIL_TOKEN_REFRESH_MARGIN_SECONDS)
+        self.mailbox_concurrency = max(1, config.GMAIL_MAILBOX_CONCURRENCY)
+        self._label_ids: Dict[tuple, str] = {}
+        
+        # Inicializar ReceiptExtractor e o registro de provedores (compartilhado com o extrator)
         self.receipt_extractor = ReceiptExtractor()
+        self.provider_registry = get_provider_registry()
         
-        # Configurações de rate limiting
-        self.rate_limit_delay = 0.1  # Delay entre requests (segundos)
+        # Configurações de rate limiting (token bucket compartilhado entre instâncias e threads)
+        self.rate_limiter = get_gmail_rate_limiter()
+        self.backoff_base = config.GMAIL_BACKOFF_BASE_SECONDS  # Atraso base do backoff exponencial (segundos)
         self.max_retries = 3  # Máximo de tentativas em caso de erro
-        self.quota_exceeded_delay = 60  # Delay quando quota excedida (segundos)
+        self.quota_exceeded_delay = 60  # Atraso máximo do backoff (segundos)
+        
+        # Configurações de busca em lote (HTTP batch)
+        self.batch_size = max(1, min(config.GMAIL_BATCH_SIZE, 100))  # Limite da Gmail API: 100 por batch
+        self.batch_uri = config.GMAIL_BATCH_URI  # None = endpoint padrão do discovery
+        
+        # Configurações do pipeline concorrente
+        self.pipeline_concurrency = max(1, config.GMAIL_PIPELINE_CONCURRENCY)
+        self.pipeline_queue_size = max(1, config.GMAIL_PIPELINE_QUEUE_SIZE)
+        
+        # Busca em duas fases (metadados primeiro, corpo só das candidatas)
+        self.two_phase_fetch = config.GMAIL_TWO_PHASE_FETCH
+        
+        # Cache local de mensagens (cada mensagem é baixada uma única vez)
+        self.message_cache = None
+        if config.GMAIL_MESSAGE_CACHE_ENABLED:
+            self.message_cache = get_message_cache(
+                config.GMAIL_MESSAGE_CACHE_DIR, config.GMAIL_MESSAGE_CACHE_MAX_MB * 1024 * 1024
+            )
 
-    def _get_service(self):
-        if self._service:
-            return self._service
+    def _get_service(self, user_email: Optional[str] = None):
+        """Recurso Gmail da thread atual para a caixa `user_email`."""
+        return self.client_pool.get_service(self._subject_for(user_email))
+
+    def _subject_for(self, user_email: Optional[str]) -> Optional[str]:
+        """
+        Subject das credenciais para acessar a caixa.
         
+        Com Service Account (DWD) cada caixa exige credencial com o próprio usuário como
+        subject; com OAuth2 há uma única credencial.
+        """
         if self.use_oauth2:
-            creds = self._get_oauth2_credentials()
-        else:
-            creds = self._get_service_account_credentials()
+            return None
+        if user_email and '@' in user_email:
+            return user_email.lower()
+        return self.delegated_user
+
+    def _create_credentials(self, subject: Optional[str]):
+        """Cria as credenciais de um subject (chamado uma vez por caixa pelo pool)."""
+        if self.use_oauth2:
+            return self._get_oauth2_credentials()
         
-        self._service = build("gmail", "v1", credentials=creds, cache_discovery=False)
-        return self._service
+        with self._credentials_lock:
+            if self._base_credentials is None:
+                self._base_credentials = service_account.Credentials.from_service_account_file(
+                    self.credentials_json_path, scopes=GMAIL_SCOPES
+                )
+        return self._base_credentials.with_subject(subject) if subject else self._base_credentials
 
-    def _get_service_account_credentials(self):
-        """Obtém credenciais via Service Account (Domain-wide Delegation)."""
-        creds = service_account.Credentials.from_service_account_file(
-            self.credentials_json_path, scopes=GMAIL_SCOPES
-        )
-        if self.delegated_user:
-            creds = creds.with_subject(self.delegated_user)
-        return creds
+    def get_client_pool_stats(self) -> Dict[str, Any]:
+        """Retorna contadores do pool de clientes (clientes por thread, credenciais, renovações)."""
+        return self.client_pool.get_stats()
+
+    def run_per_mailbox(self, user_emails: List[str], func: Callable[[str], Any],
+                        max_workers: Optional[int] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Executa `func(user_email)` para várias caixas em paralelo.
+        
+        Cada worker usa seu próprio cliente e a credencial compartilhada da caixa.
+        
+        Args:
+            user_emails: Caixas a processar
+            func: Função chamada com o email de cada caixa
+            max_workers: Caixas simultâneas (padrão: GMAIL_MAILBOX_CONCURRENCY)
+            
+        Returns:
+            Dicionário {user_email: {'success': True, 'result': ...}} ou {'success': False, 'error': ...}
+        """
+        users = list(dict.fromkeys(user_emails))
+        results: Dict[str, Dict[str, Any]] = {}
+        if not users:
+            return results
+        
+        workers = min(len(users), max(1, max_workers or self.mailbox_concurrency))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='gmail-mailbox') as executor:
+            futures = {executor.submit(func, user): user for user in users}
+            for future in as_completed(futures):
+                user = futures[future]
+                try:
+                    results[user] = {'success': True, 'result': future.result()}
+                except Exception as e:
+                    results[user] = {'success': False, 'error': str(e)}
+        return results
 
     def _get_oauth2_credentials(self):
         """Obtém credenciais via OAuth2 (mais simples, não requer DWD)."""
@@ -124,13 +224,59 @@ class GmailService:
         
         return creds
 
+    def _execute_request(self, request, operation: str) -> Dict[str, Any]:
+        """
+        Executa uma requisição da Gmail API respeitando o token bucket compartilhado.
+        
+        Consome as unidades de quota do método antes de cada tentativa e, em 429/5xx ou
+        falha de rede, aguarda backoff exponencial com jitter antes de repetir.
+        
+        Args:
+            request: HttpRequest do googleapiclient
+            operation: Nome do método (chave de GMAIL_QUOTA_UNITS, ex.: 'messages.get')
+            
+        Returns:
+            Resposta JSON da API
+            
+        Raises:
+            HttpError: Se a API falhar após `max_retries` tentativas ou com erro não recuperável
+        """
+        units = GMAIL_QUOTA_UNITS.get(operation, 5)
+        
+        for attempt in range(self.max_retries):
+            self.rate_limiter.acquire(units)
+            try:
+                return request.execute()
+            except HttpError as e:
+                if e.resp.status not in RETRYABLE_STATUS or attempt >= self.max_retries - 1:
+                    raise
+                status = e.resp.status
+            except OSError:
+                if attempt >= self.max_retries - 1:
+                    raise
+                status = None
+            
+            delay = self.rate_limiter.backoff(attempt, status, base=self.backoff_base, cap=self.quota_exceeded_delay)
+            print(f"Gmail API {operation} falhou ({status or 'rede'}). Aguardando {delay:.1f}s antes de tentar novamente...")
+            time.sleep(delay)
+
+    def get_rate_limit_metrics(self) -> Dict[str, Any]:
+        """Retorna métricas do token bucket compartilhado da Gmail API."""
+        return self.rate_limiter.get_metrics()
+
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Retorna contadores do cache local de mensagens."""
+        if not self.message_cache:
+            return {'enabled': False}
+        return {'enabled': True, **self.message_cache.get_stats()}
+
     def list_gemini_messages(self, user_email: str, max_results: int = 50) -> List[Dict[str, Any]]:
-        service = self._get_service()
+        service = self._get_service(user_email)
         query = 'from:gemini-noreply@google.com'
         try:
-            resp = service.users().messages().list(
+            resp = self._execute_request(service.users().messages().list(
                 userId=user_email, q=query, maxResults=max_results
-            ).execute()
+            ), 'messages.list')
             return resp.get("messages", [])
         except HttpError as e:
             raise Exception(f"Erro Gmail list: {e}")
@@ -153,10 +299,14 @@ class GmailService:
             "subject:\"Your receipt from\" OR subject:\"Seu recibo de\" OR subject:\"Transacao da subscricao\")"
         )
 
-    def list_receipt_messages(self, user_email: str, page_token: Optional[str] = None, max_results: int = 100, days_back: int = 7) -> Dict[str, Any]:
-        """Lista mensagens de recibos abrangendo histórico completo (paginável)."""
-        service = self._get_service()
-        query = self._build_receipt_search_query(days_back)
+    def list_receipt_messages(self, user_email: str, page_token: Optional[str] = None, max_results: int = 100,
+                              days_back: int = 7, exclude_label: Optional[str] = None) -> Dict[str, Any]:
+        """Lista mensagens de recibos abrangendo histórico completo (paginável).
+        
+        Com `exclude_label`, mensagens que já têm o label ficam fora da busca.
+        """
+        service = self._get_service(user_email)
+        query = self.build_receipt_query(days_back, exclude_label)
         try:
             req = service.users().messages().list(
                 userId=user_email,
@@ -165,7 +315,7 @@ class GmailService:
                 maxResults=max_results,
                 pageToken=page_token
             )
-            resp = req.execute()
+            resp = self._execute_request(req, 'messages.list')
             return {
                 'messages': resp.get('messages', []),
                 'nextPageToken': resp.get('nextPageToken')
@@ -183,15 +333,15 @@ class GmailService:
             max_results: até 100 por página
             include_spam_trash: inclui spam/lixeira
         """
-        service = self._get_service()
+        service = self._get_service(user_email)
         try:
-            resp = service.users().messages().list(
+            resp = self._execute_request(service.users().messages().list(
                 userId=user_email,
                 q=query,
                 includeSpamTrash=include_spam_trash,
                 maxResults=max_results,
                 pageToken=page_token
-            ).execute()
+            ), 'messages.list')
             return {
                 'messages': resp.get('messages', []),
                 'nextPageToken': resp.get('nextPageToken')
@@ -199,35 +349,539 @@ class GmailService:
         except HttpError as e:
             raise Exception(f"Erro Gmail list (custom): {e}")
 
-    def get_message(self, user_email: str, message_id: str) -> Dict[str, Any]:
-        service = self._get_service()
+    # ==========================
+    # Labels
+    # ==========================
+    def build_receipt_query(self, days_back: int = 7, exclude_label: Optional[str] = None) -> str:
+        """Query de recibos dos provedores de IA, opcionalmente sem as mensagens com `exclude_label`."""
+        query = self._build_receipt_search_query(days_back)
+        if exclude_label:
+            query = f"{query} -{self.label_query_term(exclude_label)}"
+        return query
+
+    @staticmethod
+    def label_query_term(label_name: str) -> str:
+        """Termo de busca `label:` (a busca do Gmail troca espaços e '/' por '-')."""
+        return "label:" + re.sub(r'[\s/]+', '-', label_name.strip())
+
+    def get_or_create_label(self, user_email: str, label_name: str) -> str:
+        """
+        Retorna o ID do label, criando-o se não existir (resultado em cache por caixa).
+        
+        Args:
+            user_email: Email do usuário
+            label_name: Nome do label (ex.: 'IA/Encaminhado')
+            
+        Returns:
+            ID do label
+        """
+        key = (user_email.lower(), label_name)
+        if key in self._label_ids:
+            return self._label_ids[key]
+        
+        service = self._get_service(user_email)
+        try:
+            labels = self._execute_request(service.users().labels().list(userId=user_email), 'labels.list')
+            label_id = next(
+                (label['id'] for label in labels.get('labels', []) if label.get('name') == label_name), None
+            )
+            if label_id is None:
+                created = self._execute_request(service.users().labels().create(userId=user_email, body={
+                    'name': label_name,
+                    'labelListVisibility': 'labelShow',
+                    'messageListVisibility': 'show'
+                }), 'labels.create')
+                label_id = created['id']
+        except HttpError as e:
+            raise Exception(f"Erro Gmail labels: {e}")
+        
+        self._label_ids[key] = label_id
+        return label_id
+
+    def batch_modify_labels(self, user_email: str, message_ids: List[str],
+                            add_label_ids: Optional[List[str]] = None,
+                            remove_label_ids: Optional[List[str]] = None) -> int:
+        """
+        Adiciona/remove labels de várias mensagens com `messages.batchModify`.
+        
+        Args:
+            user_email: Email do usuário
+            message_ids: IDs das mensagens (enviados em blocos de até 1000)
+            add_label_ids: Labels a adicionar
+            remove_label_ids: Labels a remover
+            
+        Returns:
+            Número de chamadas batchModify feitas
+        """
+        ids = list(dict.fromkeys(mid for mid in message_ids if mid))
+        if not ids or not (add_label_ids or remove_label_ids):
+            return 0
+        
+        service = self._get_service(user_email)
+        calls = 0
+        for start in range(0, len(ids), BATCH_MODIFY_MAX_IDS):
+            body = {'ids': ids[start:start + BATCH_MODIFY_MAX_IDS]}
+            if add_label_ids:
+                body['addLabelIds'] = add_label_ids
+            if remove_label_ids:
+                body['removeLabelIds'] = remove_label_ids
+            try:
+                self._execute_request(
+                    service.users().messages().batchModify(userId=user_email, body=body), 'messages.batchModify'
+                )
+            except HttpError as e:
+                raise Exception(f"Erro Gmail batchModify: {e}")
+            calls += 1
+        return calls
+
+    # ==========================
+    # Sincronização incremental (history API)
+    # ==========================
+    def get_current_history_id(self, user_email: str) -> str:
+        """Retorna o historyId atual da caixa (ponto de partida da próxima sincronização)."""
+        service = self._get_service(user_email)
+        try:
+            profile = self._execute_request(service.users().getProfile(userId=user_email), 'getProfile')
+            return str(profile['historyId'])
+        except HttpError as e:
+            raise Exception(f"Erro Gmail profile: {e}")
+
+    def list_history_message_ids(self, user_email: str, start_history_id: str) -> tuple[List[str], str]:
+        """
+        Lista os IDs de mensagens adicionadas desde `start_history_id`.
+        
+        Args:
+            user_email: Email do usuário
+            start_history_id: Último historyId sincronizado
+            
+        Returns:
+            Tupla com (IDs adicionados em ordem cronológica, novo historyId)
+            
+        Raises:
+            GmailHistoryExpiredError: Se o historyId expirou (HTTP 404)
+        """
+        service = self._get_service(user_email)
+        message_ids: List[str] = []
+        seen = set()
+        page_token = None
+        latest_history_id = str(start_history_id)
+        
+        while True:
+            params = {
+                'userId': user_email,
+                'startHistoryId': start_history_id,
+                'historyTypes': ['messageAdded'],
+                'maxResults': 500
+            }
+            if page_token:
+                params['pageToken'] = page_token
+            
+            try:
+                resp = self._execute_request(service.users().history().list(**params), 'history.list')
+            except HttpError as e:
+                if e.resp.status == 404:
+                    raise GmailHistoryExpiredError(f"historyId {start_history_id} expirado para {user_email}")
+                raise Exception(f"Erro Gmail history: {e}")
+            
+            for record in resp.get('history', []):
+                for added in record.get('messagesAdded', []):
+                    message = added.get('message', {})
+                    message_id = message.get('id')
+                    if not message_id or message_id in seen or 'DRAFT' in message.get('labelIds', []):
+                        continue
+                    seen.add(message_id)
+                    message_ids.append(message_id)
+            
+            latest_history_id = str(resp.get('historyId') or latest_history_id)
+            page_token = resp.get('nextPageToken')
+            if not page_token:
+                break
+        
+        return message_ids, latest_history_id
+
+    def list_message_ids_sharded(self, user_email: str, senders: List[str], days_back: int,
+                                 extra_query: str = '', max_results: Optional[int] = None,
+                                 workers: Optional[int] = None, window_days: Optional[int] = None,
+                                 progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """
+        Lista os IDs de um backfill dividido em fragmentos (remetente x janela de datas).
+        
+        Os fragmentos são disjuntos e paginados em paralelo; os IDs são unidos sem duplicatas.
+        
+        Args:
+            user_email: Email do usuário
+            senders: Remetentes buscados
+            days_back: Dias cobertos pelo backfill
+            extra_query: Termos adicionais aplicados a todos os fragmentos
+            max_results: Limite de IDs retornados
+            workers: Fragmentos simultâneos (padrão: GMAIL_BACKFILL_WORKERS)
+            window_days: Janela de cada fragmento (padrão: GMAIL_BACKFILL_WINDOW_DAYS)
+            progress_callback: Chamado ao fim de cada fragmento
+            
+        Returns:
+            Resultado de `GmailQueryPlanner.collect_ids` mais 'total_shards'
+        """
+        planner = GmailQueryPlanner(
+            self,
+            workers=workers or config.GMAIL_BACKFILL_WORKERS,
+            window_days=window_days or config.GMAIL_BACKFILL_WINDOW_DAYS
+        )
+        shards = planner.plan(senders, days_back, extra_query)
+        result = planner.collect_ids(user_email, shards, progress_callback, max_results)
+        result['total_shards'] = len(shards)
+        print(
+            f"Backfill fragmentado de {user_email}: {len(shards)} fragmentos, "
+            f"{len(result['message_ids'])} mensagens ({result['duplicates']} duplicadas) em {result['duration']}s"
+        )
+        return result
+
+    def sync_message_ids(self, user_email: str, query: str, state_store,
+                         scope: str = 'receipts', senders: Optional[List[str]] = None,
+                         max_results: Optional[int] = None,
+                         backfill_days: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Descobre mensagens novas desde a última sincronização.
+        
+        Com checkpoint salvo, usa a history API e lê apenas o delta. Sem checkpoint, ou
+        com historyId expirado, faz a varredura completa por `query` (janela de dias).
+        O checkpoint não é gravado aqui: chame `commit_sync` após processar as mensagens
+        para não perder nada se o processamento falhar no meio.
+        
+        Args:
+            user_email: Email do usuário
+            query: Query da varredura completa (fallback)
+            state_store: Store de checkpoints (ex.: GmailSyncStateStore)
+            scope: Escopo do checkpoint
+            senders: Remetentes aceitos no modo incremental (filtro pelo header From)
+            max_results: Limite da varredura completa
+            backfill_days: Janela da varredura completa; com `senders` e GMAIL_BACKFILL_SHARDED,
+                a varredura é fragmentada por remetente e datas e paginada em paralelo
+            
+        Returns:
+            Dicionário com 'mode' ('incremental' ou 'full'), 'messages', 'history_id'
+            e 'previous_history_id'
+        """
+        previous_history_id = state_store.get_history_id(user_email, scope=scope)
+        
+        if previous_history_id:
+            try:
+                message_ids, history_id = self.list_history_message_ids(user_email, previous_history_id)
+                if senders:
+                    message_ids = self._filter_ids_by_sender(user_email, message_ids, senders)
+                return {
+                    'mode': 'incremental',
+                    'messages': [{'id': message_id} for message_id in message_ids],
+                    'history_id': history_id,
+                    'previous_history_id': previous_history_id
+                }
+            except GmailHistoryExpiredError as e:
+                print(f"{e}. Executando varredura completa...")
+        
+        # Captura o historyId antes de listar: o que chegar durante a varredura entra no próximo delta
+        history_id = self.get_current_history_id(user_email)
+        if backfill_days and senders and config.GMAIL_BACKFILL_SHARDED:
+            backfill = self.list_message_ids_sharded(user_email, senders, backfill_days, max_results=max_results)
+            if backfill['errors']:
+                # Sem todos os fragmentos o checkpoint pularia mensagens
+                raise Exception(f"Backfill incompleto: {len(backfill['errors'])} fragmentos falharam")
+            messages = [{'id': message_id} for message_id in backfill['message_ids']]
+        else:
+            messages = self.get_all_receipt_messages(user_email, query, max_results)
+        return {
+            'mode': 'full',
+            'messages': messages,
+            'history_id': history_id,
+            'previous_history_id': previous_history_id
+        }
+
+    def commit_sync(self, user_email: str, sync_result: Dict[str, Any], state_store,
+                    scope: str = 'receipts') -> None:
+        """Grava o checkpoint de uma sincronização já processada."""
+        state_store.save_history_id(
+            user_email, sync_result['history_id'], scope=scope,
+            full_sync=sync_result['mode'] == 'full'
+        )
+
+    def _filter_ids_by_sender(self, user_email: str, message_ids: List[str], senders: List[str]) -> List[str]:
+        """
+        Mantém apenas mensagens de um dos remetentes (busca só os metadados, em lote).
+        
+        O header From é resolvido pelo registro de provedores, como no restante do serviço:
+        aceita os endereços com tag `+` e subdomínios do provedor de cada remetente, e não
+        endereços que apenas contêm o de um provedor. Remetentes fora do registro valem
+        pelo endereço exato.
+        
+        Raises:
+            Exception: Se os metadados de alguma mensagem falharem por erro transitório
+                (o checkpoint não deve avançar sem classificá-la)
+        """
+        wanted_providers = {provider for provider in map(self.provider_registry.resolve, senders) if provider}
+        wanted_addresses = {address for address in map(parse_address, senders) if address}
+        accepted = []
+        
+        metadata = self.get_messages_batch(user_email, message_ids, format="metadata")
+        for message_id in message_ids:
+            result = metadata.get(message_id) or {'success': False, 'error': 'ausente no batch'}
+            if not result['success']:
+                if result.get('status') in MESSAGE_GONE_STATUS:
+                    continue  # removida entre o histórico e a leitura
+                raise Exception(f"Erro ao ler metadados do email {message_id}: {result['error']}")
+            headers = result['message'].get('payload', {}).get('headers', [])
+            sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), '')
+            if self.provider_registry.resolve(sender) in wanted_providers or parse_address(sender) in wanted_addresses:
+                accepted.append(message_id)
+        
+        return accepted
+
+    def get_message(self, user_email: str, message_id: str, format: str = "full") -> Dict[str, Any]:
+        if self.message_cache:
+            cached = self.message_cache.get(user_email, message_id, format)
+            if cached is not None:
+                return cached
+        
+        service = self._get_service(user_email)
         try:
-            return service.users().messages().get(userId=user_email, id=message_id, format="full").execute()
+            message = self._execute_request(
+                self._message_get_request(service, user_email, message_id, format),
+                'messages.get'
+            )
         except HttpError as e:
+            if e.resp.status in MESSAGE_GONE_STATUS:
+                raise GmailMessageNotFoundError(f"Mensagem {message_id} não encontrada: {e}")
             raise Exception(f"Erro Gmail get: {e}")
+        
+        if self.message_cache:
+            self.message_cache.put(user_email, message_id, message, format)
+        return message
+
+    def get_attachment(self, user_email: str, message_id: str, attachment_id: str) -> bytes:
+        """
+        Baixa o conteúdo de um anexo pela API de anexos.
+        
+        Args:
+            user_email: Email do usuário
+            message_id: ID da mensagem
+            attachment_id: body.attachmentId da parte de anexo
+            
+        Returns:
+            Bytes do anexo
+        """
+        service = self._get_service(user_email)
+        try:
+            response = self._execute_request(
+                service.users().messages().attachments().get(userId=user_email, messageId=message_id, id=attachment_id),
+                'messages.attachments.get'
+            )
+        except HttpError as e:
+            raise Exception(f"Erro Gmail attachments.get: {e}")
+        return mime_parser.decode_base64url(response.get('data', ''))
+
+    @staticmethod
+    def _message_get_request(service, user_email: str, message_id: str, format: str):
+        """Monta `messages.get`; no formato metadata traz apenas os headers de METADATA_HEADERS."""
+        if format == "metadata":
+            return service.users().messages().get(
+                userId=user_email, id=message_id, format="metadata", metadataHeaders=METADATA_HEADERS
+            )
+        return service.users().messages().get(userId=user_email, id=message_id, format=format)
+
+    def get_messages_batch(self, user_email: str, message_ids: List[str],
+                           format: str = "full") -> Dict[str, Dict[str, Any]]:
+        """
+        Obtém várias mensagens completas agrupando `messages.get` em requisições HTTP batch.
+        
+        Mensagens já presentes no cache local não são baixadas de novo. Cada requisição
+        batch leva até `batch_size` chamadas. Erros são mantidos por mensagem: uma falha
+        individual não invalida as demais do mesmo lote. Mensagens que recebem 429/5xx
+        dentro do lote são reenviadas em um novo batch.
+        
+        Args:
+            user_email: Email do usuário
+            message_ids: IDs das mensagens a buscar
+            format: Formato da Gmail API ('full' ou 'metadata')
+            
+        Returns:
+            Dicionário {message_id: {'success': True, 'message': {...}}} ou
+            {message_id: {'success': False, 'error': '...', 'status': <HTTP ou None>}}
+        """
+        results: Dict[str, Dict[str, Any]] = {}
+        unique_ids = list(dict.fromkeys(message_ids))
+        
+        missing: List[str] = []
+        for message_id in unique_ids:
+            cached = self.message_cache.get(user_email, message_id, format) if self.message_cache else None
+            if cached is not None:
+                results[message_id] = {'success': True, 'message': cached}
+            else:
+                missing.append(message_id)
+        
+        for start in range(0, len(missing), self.batch_size):
+            chunk = missing[start:start + self.batch_size]
+            fetched = self._execute_get_batch(user_email, chunk, format)
+            if self.message_cache:
+                for message_id, result in fetched.items():
+                    if result['success']:
+                        self.message_cache.put(user_email, message_id, result['message'], format)
+            results.update(fetched)
+        
+        return results
+
+    def _execute_get_batch(self, user_email: str, message_ids: List[str],
+                           format: str = "full") -> Dict[str, Dict[str, Any]]:
+        """
+        Executa um único lote de `messages.get`, com retry apenas das mensagens que falharam
+        por quota (429) ou erro do servidor (5xx).
+        
+        Args:
+            user_email: Email do usuário
+            message_ids: IDs do lote (no máximo `batch_size`)
+            format: Formato da Gmail API
+            
+        Returns:
+            Resultados por mensagem no mesmo formato de `get_messages_batch`
+        """
+        results: Dict[str, Dict[str, Any]] = {}
+        pending = list(message_ids)
+        
+        for attempt in range(self.max_retries):
+            retryable: List[str] = []
+            statuses: List[int] = []
+            
+            def _callback(request_id, response, exception):
+                if exception is None:
+                    results[request_id] = {'success': True, 'message': response}
+                    return
+                status = getattr(getattr(exception, 'resp', None), 'status', None)
+                if status in RETRYABLE_STATUS and attempt < self.max_retries - 1:
+                    retryable.append(request_id)
+                    statuses.append(status)
+                else:
+                    results[request_id] = {'success': False, 'error': f"Erro Gmail get: {exception}", 'status': status}
+            
+            try:
+                service = self._get_service(user_email)
+                batch = self._new_batch_request(service, _callback)
+                for message_id in pending:
+                    batch.add(
+                        self._message_get_request(service, user_email, message_id, format),
+                        request_id=message_id
+                    )
+                # Cada chamada do lote consome a quota de um messages.get
+                self.rate_limiter.acquire(GMAIL_QUOTA_UNITS['messages.get'] * len(pending))
+                batch.execute()
+            except HttpError as e:
+                # Falha do lote inteiro (ex.: quota global): todas as pendentes são reenviadas
+                if e.resp.status in RETRYABLE_STATUS and attempt < self.max_retries - 1:
+                    retryable = [mid for mid in pending if mid not in results]
+                    statuses.append(e.resp.status)
+                else:
+                    for message_id in pending:
+                        results.setdefault(message_id, {'success': False, 'error': f"Erro Gmail batch: {e}"})
+                    return results
+            except Exception as e:
+                for message_id in pending:
+                    results.setdefault(message_id, {'success': False, 'error': f"Erro Gmail batch: {e}"})
+                return results
+            
+            if not retryable:
+                break
+            
+            pending = retryable
+            status = 429 if 429 in statuses else statuses[0]
+            delay = self.rate_limiter.backoff(attempt, status, base=self.backoff_base, cap=self.quota_exceeded_delay)
+            print(f"Batch com {len(pending)} mensagens limitadas. Aguardando {delay:.1f}s antes de tentar novamente...")
+            time.sleep(delay)
+        
+        return results
+
+    def _new_batch_request(self, service, callback: Callable) -> BatchHttpRequest:
+        """Cria requisição batch no endpoint da Gmail API (ou em `batch_uri`, se configurado)."""
+        if self.batch_uri:
+            return BatchHttpRequest(callback=callback, batch_uri=self.batch_uri)
+        return service.new_batch_http_request(callback=callback)
+
+    def fetch_candidate_messages(self, user_email: str, message_ids: List[str],
+                                 is_candidate: Callable[[Dict[str, str]], bool]) -> tuple[Dict[str, Dict[str, Any]], Dict[str, Any]]:
+        """
+        Busca em duas fases: metadados (From/Subject/Date) de todas as mensagens e corpo
+        completo apenas das candidatas.
+        
+        Mensagens já em cache no formato completo não passam pela fase de metadados. Se os
+        metadados de uma mensagem falharem, ela é tratada como candidata.
+        
+        Args:
+            user_email: Email do usuário
+            message_ids: IDs listados
+            is_candidate: Recebe os headers (nomes em minúsculas) e decide se vale baixar o corpo
+            
+        Returns:
+            Tupla (resultados completos das candidatas no formato de `get_messages_batch`,
+            estatísticas com chamadas e bytes economizados)
+        """
+        unique_ids = list(dict.fromkeys(message_ids))
+        cached_full = [mid for mid in unique_ids
+                       if self.message_cache and self.message_cache.contains(user_email, mid, "full")]
+        to_classify = [mid for mid in unique_ids if mid not in set(cached_full)]
+        
+        metadata = self.get_messages_batch(user_email, to_classify, format="metadata")
+        
+        candidates = set(cached_full)
+        rejected: List[str] = []
+        bytes_avoided = 0
+        metadata_bytes = 0
+        for message_id in to_classify:
+            result = metadata.get(message_id) or {'success': False}
+            if not result['success']:
+                candidates.add(message_id)
+                continue
+            message = result['message']
+            metadata_bytes += len(json.dumps(message))
+            headers = {h['name'].lower(): h['value'] for h in message.get('payload', {}).get('headers', [])}
+            if is_candidate(headers):
+                candidates.add(message_id)
+            else:
+                rejected.append(message_id)
+                bytes_avoided += int(message.get('sizeEstimate') or 0)
+        
+        ordered_candidates = [mid for mid in unique_ids if mid in candidates]
+        fetched = self.get_messages_batch(user_email, ordered_candidates)
+        
+        stats = {
+            'listed': len(unique_ids),
+            'metadata_fetched': len(to_classify),
+            'candidates': len(ordered_candidates),
+            'rejected_ids': rejected,
+            'full_downloads_avoided': len(rejected),
+            'bytes_avoided': bytes_avoided,
+            'metadata_bytes': metadata_bytes,
+            'net_bytes_saved': bytes_avoided - metadata_bytes,
+            # Requisições HTTP: lotes de metadados + lotes completos, contra uma por mensagem no modo simples
+            'http_requests': -(-len(to_classify) // self.batch_size) + -(-len(ordered_candidates) // self.batch_size),
+            'http_requests_single_mode': len(unique_ids),
+        }
+        return fetched, stats
+
+    def _is_receipt_candidate(self, headers: Dict[str, str]) -> bool:
+        """Classificação da fase de metadados: remetente de provedor de IA conhecido."""
+        return self.provider_registry.resolve(headers.get('from', '')) is not None
 
     def extract_plain_text(self, message: Dict[str, Any]) -> str:
-        # Procura partes text/plain preferencialmente
-        payload = message.get("payload", {})
-        parts = payload.get("parts", [])
-        if parts:
-            for part in parts:
-                if part.get("mimeType") == "text/plain" and "data" in part.get("body", {}):
-                    data = part["body"]["data"]
-                    return base64.urlsafe_b64decode(data.encode()).decode("utf-8", errors="replace")
-        # Fallback: corpo simples
-        body = payload.get("body", {}).get("data")
-        if body:
-            return base64.urlsafe_b64decode(body.encode()).decode("utf-8", errors="replace")
-        return ""
-
-    def process_receipt_emails(self, user_email: str, days_back: int = 7) -> List[Dict[str, Any]]:
+        """
+        Texto do corpo da mensagem (text/plain em qualquer nível, senão HTML convertido).
+        
+        O resultado fica em cache na própria mensagem; ver `services.mime_parser`.
+        """
+        return mime_parser.extract_text(message)
+
+    def process_receipt_emails(self, user_email: str, days_back: int = 7,
+                               concurrency: Optional[int] = None) -> List[Dict[str, Any]]:
         """
         Processa emails de recibos usando ReceiptExtractor.
         
         Args:
             user_email: Email do usuário para buscar
             days_back: Número de dias para buscar no passado
+            concurrency: Workers de download; acima de 1 usa o pipeline concorrente
             
         Returns:
             Lista estruturada de recibos processados
@@ -235,32 +889,38 @@ class GmailService:
         try:
             # Buscar emails dos provedores de IA
             query = self._build_receipt_search_query(days_back)
-            messages_response = self.list_messages(user_email, query)
+            
+            if concurrency and concurrency > 1:
+                return self.process_receipts_pipelined(
+                    user_email, query, max_results=100, concurrency=concurrency
+                )
+            
+            messages_response = self.list_by_query(user_email, query)
             
             processed_receipts = []
             
+            prefetched: Optional[Dict[str, Dict[str, Any]]] = None
+            if self.two_phase_fetch:
+                message_ids = [m['id'] for m in messages_response.get('messages', [])]
+                prefetched, fetch_stats = self.fetch_candidate_messages(user_email, message_ids, self._is_receipt_candidate)
+                print(f"Busca em duas fases: {fetch_stats['candidates']}/{fetch_stats['listed']} corpos baixados, "
+                      f"{fetch_stats['net_bytes_saved']} bytes economizados")
+            
             for message in messages_response.get('messages', []):
                 try:
                     # Obter dados completos do email
                     message_id = message['id']
-                    full_message = self.get_message(user_email, message_id)
-                    
-                    # Extrair dados básicos do email
-                    email_data = self._extract_basic_email_data(full_message)
-                    
-                    # Usar ReceiptExtractor para extrair dados estruturados
-                    receipt_data = self.receipt_extractor.extract_receipt_data(email_data)
+                    if prefetched is not None:
+                        if message_id not in prefetched:
+                            continue  # descartada pelos metadados
+                        if not prefetched[message_id]['success']:
+                            raise Exception(prefetched[message_id]['error'])
+                        full_message = prefetched[message_id]['message']
+                    else:
+                        full_message = self.get_message(user_email, message_id)
                     
-                    if receipt_data.get('success', False):
-                        # Adicionar metadados do email
-                        receipt_data.update({
-                            'message_id': message_id,
-                            'email_date': email_data.get('date'),
-                            'email_subject': email_data.get('subject'),
-                            'email_sender': email_data.get('sender'),
-                            'processed_at': datetime.now().isoformat()
-                        })
-                        
+                    receipt_data = self._build_receipt_from_message(message_id, full_message)
+                    if receipt_data:
                         processed_receipts.append(receipt_data)
                     
                 except Exception as e:
@@ -332,7 +992,7 @@ class GmailService:
         
         # Obter emails de todos os provedores suportados
         provider_emails = []
-        for provider, emails in self.receipt_extractor.ia_providers.items():
+        for provider, emails in self.provider_registry.sender_map().items():
             provider_emails.extend(emails)
         
         # Construir query com remetentes
@@ -425,6 +1085,8 @@ class GmailService:
         """
         Coleta todas as mensagens de recibos com paginação automática.
         
+        Materializa `iter_receipt_messages`; prefira o gerador para caixas grandes.
+        
         Args:
             user_email: Email do usuário para buscar
             query: Query de busca Gmail
@@ -434,77 +1096,140 @@ class GmailService:
         Returns:
             Lista completa de mensagens encontradas
         """
-        all_messages = []
+        return list(self.iter_receipt_messages(user_email, query, max_results, progress_callback))
+
+    def iter_receipt_messages(self, user_email: str, query: str,
+                              max_results: Optional[int] = None,
+                              progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Gera as mensagens da busca à medida que cada página chega.
+        
+        Só uma página fica em memória; a próxima é pedida quando o consumidor
+        termina a anterior.
+        
+        Args:
+            user_email: Email do usuário para buscar
+            query: Query de busca Gmail
+            max_results: Limite máximo de resultados (None = sem limite)
+            progress_callback: Função para reportar progresso
+            
+        Yields:
+            Mensagens no formato da listagem ({'id': ..., 'threadId': ...})
+        """
+        for page_messages in self._iter_message_pages(user_email, query, max_results, progress_callback):
+            yield from page_messages
+
+    def _iter_message_pages(self, user_email: str, query: str,
+                            max_results: Optional[int] = None,
+                            progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Gera as páginas da busca, reportando progresso por página.
+        
+        O fim da listagem é reportado como 'listing_completed'; 'completed' fica para o
+        fim do processamento dos recibos.
+        """
         page_token = None
         page_count = 0
         total_found = 0
         
-        try:
-            while True:
-                # Verificar limite de resultados
-                if max_results and total_found >= max_results:
-                    if progress_callback:
-                        progress_callback({
-                            'status': 'completed',
-                            'message': f'Limite de {max_results} resultados atingido',
-                            'page_count': page_count,
-                            'total_messages': total_found
-                        })
-                    break
-                
-                # Buscar página atual
+        while True:
+            # Verificar limite de resultados
+            if max_results and total_found >= max_results:
+                if progress_callback:
+                    progress_callback({
+                        'status': 'listing_completed',
+                        'message': f'Limite de {max_results} resultados atingido',
+                        'page_count': page_count,
+                        'total_messages': total_found
+                    })
+                return
+            
+            # Buscar página atual
+            try:
                 page_messages, next_page_token = self._fetch_page_with_retry(
                     user_email, query, page_token, max_results, total_found
                 )
-                
-                # Adicionar mensagens à lista total
-                all_messages.extend(page_messages)
-                total_found += len(page_messages)
-                page_count += 1
-                
-                # Callback de progresso
+            except Exception as e:
                 if progress_callback:
                     progress_callback({
-                        'status': 'processing',
-                        'message': f'Página {page_count} processada - {len(page_messages)} mensagens encontradas',
+                        'status': 'error',
+                        'message': f'Erro durante paginação: {str(e)}',
                         'page_count': page_count,
-                        'total_messages': total_found,
-                        'messages_in_page': len(page_messages)
+                        'total_messages': total_found
                     })
-                
-                # Verificar se há próxima página
-                if not next_page_token:
-                    if progress_callback:
-                        progress_callback({
-                            'status': 'completed',
-                            'message': 'Todas as páginas processadas',
-                            'page_count': page_count,
-                            'total_messages': total_found
-                        })
-                    break
-                
-                page_token = next_page_token
-                
-                # Rate limiting - delay entre requests
-                time.sleep(self.rate_limit_delay)
+                raise Exception(f"Erro na paginação de mensagens: {e}")
             
-            return all_messages
+            total_found += len(page_messages)
+            page_count += 1
             
-        except Exception as e:
+            # Callback de progresso
             if progress_callback:
                 progress_callback({
-                    'status': 'error',
-                    'message': f'Erro durante paginação: {str(e)}',
+                    'status': 'processing',
+                    'message': f'Página {page_count} processada - {len(page_messages)} mensagens encontradas',
                     'page_count': page_count,
-                    'total_messages': total_found
+                    'total_messages': total_found,
+                    'messages_in_page': len(page_messages)
                 })
-            raise Exception(f"Erro na paginação de mensagens: {e}")
+            
+            yield page_messages
+            
+            # Verificar se há próxima página
+            if not next_page_token:
+                if progress_callback:
+                    progress_callback({
+                        'status': 'listing_completed',
+                        'message': 'Todas as páginas processadas',
+                        'page_count': page_count,
+                        'total_messages': total_found
+                    })
+                return
+            
+            page_token = next_page_token
+
+    def iter_receipts(self, user_email: str, days_back: int = 30,
+                      max_results: Optional[int] = None,
+                      progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+                      use_batch: bool = False) -> Iterator[Dict[str, Any]]:
+        """
+        Gera os recibos extraídos à medida que as páginas são listadas e baixadas.
+        
+        O primeiro recibo sai após a primeira página (ou lote), e a memória usada
+        não cresce com o tamanho da caixa.
+        
+        Args:
+            user_email: Email do usuário para buscar
+            days_back: Número de dias para buscar no passado
+            max_results: Limite máximo de mensagens (None = sem limite)
+            progress_callback: Função para reportar progresso
+            use_batch: Se True, busca as mensagens em lotes HTTP batch
+            
+        Yields:
+            Recibos estruturados (mesmo formato de `process_all_receipt_emails`)
+        """
+        query = self._build_receipt_search_query(days_back)
+        messages = self.iter_receipt_messages(user_email, query, max_results, progress_callback)
+        counters = {'messages': 0}
+        total_processed = 0
+        for receipt in self._iter_receipts_from_messages(user_email, messages, progress_callback, use_batch, counters):
+            total_processed += 1
+            yield receipt
+        
+        if progress_callback:
+            progress_callback({
+                'status': 'completed',
+                'message': f'Processamento concluído - {total_processed} recibos extraídos',
+                'total_processed': total_processed,
+                'total_messages': counters['messages']
+            })
 
     def _fetch_page_with_retry(self, user_email: str, query: str, page_token: Optional[str], 
                               max_results: Optional[int], current_total: int) -> tuple[List[Dict[str, Any]], Optional[str]]:
         """
         Busca uma página de mensagens com retry automático.
         
+        As tentativas e o backoff com jitter ficam a cargo de `_execute_request`.
+        
         Args:
             user_email: Email do usuário
             query: Query de busca
@@ -515,66 +1240,45 @@ class GmailService:
         Returns:
             Tupla com (mensagens_da_página, próximo_page_token)
         """
-        for attempt in range(self.max_retries):
-            try:
-                # Calcular quantas mensagens buscar nesta página
-                page_size = 100  # Tamanho padrão da página
-                if max_results:
-                    remaining = max_results - current_total
-                    page_size = min(page_size, remaining)
-                
-                # Fazer request para a página
-                service = self._get_service()
-                request_params = {
-                    'userId': user_email,
-                    'q': query,
-                    'maxResults': page_size,
-                    'includeSpamTrash': True
-                }
-                
-                if page_token:
-                    request_params['pageToken'] = page_token
-                
-                response = service.users().messages().list(**request_params).execute()
-                
-                messages = response.get('messages', [])
-                next_page_token = response.get('nextPageToken')
-                
-                return messages, next_page_token
-                
-            except HttpError as e:
-                if e.resp.status == 429:  # Quota exceeded
-                    if attempt < self.max_retries - 1:
-                        print(f"Quota excedida. Aguardando {self.quota_exceeded_delay}s antes de tentar novamente...")
-                        time.sleep(self.quota_exceeded_delay)
-                        continue
-                    else:
-                        raise Exception(f"Quota excedida após {self.max_retries} tentativas")
-                elif e.resp.status in [500, 502, 503, 504]:  # Server errors
-                    if attempt < self.max_retries - 1:
-                        delay = 2 ** attempt  # Exponential backoff
-                        print(f"Erro do servidor. Aguardando {delay}s antes de tentar novamente...")
-                        time.sleep(delay)
-                        continue
-                    else:
-                        raise Exception(f"Erro do servidor após {self.max_retries} tentativas: {e}")
-                else:
-                    raise Exception(f"Erro Gmail API: {e}")
-            
-            except Exception as e:
-                if attempt < self.max_retries - 1:
-                    delay = 1 * (attempt + 1)  # Linear backoff
-                    print(f"Erro inesperado. Aguardando {delay}s antes de tentar novamente...")
-                    time.sleep(delay)
-                    continue
-                else:
-                    raise Exception(f"Erro após {self.max_retries} tentativas: {e}")
+        # Calcular quantas mensagens buscar nesta página
+        page_size = 100  # Tamanho padrão da página
+        if max_results:
+            remaining = max_results - current_total
+            page_size = min(page_size, remaining)
+        
+        # Fazer request para a página
+        service = self._get_service(user_email)
+        request_params = {
+            'userId': user_email,
+            'q': query,
+            'maxResults': page_size,
+            'includeSpamTrash': True
+        }
         
-        return [], None
+        if page_token:
+            request_params['pageToken'] = page_token
+        
+        try:
+            response = self._execute_request(service.users().messages().list(**request_params), 'messages.list')
+        except HttpError as e:
+            if e.resp.status == 429:  # Quota exceeded
+                raise Exception(f"Quota excedida após {self.max_retries} tentativas")
+            elif e.resp.status in RETRYABLE_STATUS:  # Server errors
+                raise Exception(f"Erro do servidor após {self.max_retries} tentativas: {e}")
+            raise Exception(f"Erro Gmail API: {e}")
+        except OSError as e:
+            raise Exception(f"Erro após {self.max_retries} tentativas: {e}")
+        
+        messages = response.get('messages', [])
+        next_page_token = response.get('nextPageToken')
+        
+        return messages, next_page_token
 
     def process_all_receipt_emails(self, user_email: str, days_back: int = 30, 
                                  max_results: Optional[int] = None,
-                                 progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None) -> List[Dict[str, Any]]:
+                                 progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+                                 use_batch: bool = False,
+                                 concurrency: Optional[int] = None) -> List[Dict[str, Any]]:
         """
         Processa todos os emails de recibos com paginação automática.
         
@@ -583,6 +1287,8 @@ class GmailService:
             days_back: Número de dias para buscar no passado
             max_results: Limite máximo de resultados (None = sem limite)
             progress_callback: Função para reportar progresso
+            use_batch: Se True, busca as mensagens em lotes HTTP batch (até 100 por requisição)
+            concurrency: Workers de download; acima de 1 usa o pipeline concorrente
             
         Returns:
             Lista estruturada de todos os recibos processados
@@ -591,87 +1297,401 @@ class GmailService:
             # Construir query de busca
             query = self._build_receipt_search_query(days_back)
             
-            # Buscar todas as mensagens com paginação
-            all_messages = self.get_all_receipt_messages(
-                user_email, query, max_results, progress_callback
-            )
+            if concurrency and concurrency > 1:
+                return self.process_receipts_pipelined(
+                    user_email, query, max_results, concurrency, progress_callback=progress_callback
+                )
             
-            # Processar cada mensagem
-            processed_receipts = []
-            total_messages = len(all_messages)
+            # Listagem completa antes do processamento: o progresso informa "recibo i/N"
+            # (o caminho em streaming é `iter_receipts`)
+            messages = self.get_all_receipt_messages(user_email, query, max_results, progress_callback)
+            
+            return self._process_message_list(user_email, messages, progress_callback, use_batch)
+            
+        except Exception as e:
+            if progress_callback:
+                progress_callback({
+                    'status': 'error',
+                    'message': f'Erro no processamento: {str(e)}',
+                    'total_processed': 0
+                })
+            raise Exception(f"Erro ao processar todos os emails de recibos: {e}")
+
+    def process_receipt_emails_incremental(self, user_email: str, state_store, days_back: int = 30,
+                                           progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+                                           use_batch: bool = False) -> List[Dict[str, Any]]:
+        """
+        Processa apenas os emails de recibos recebidos desde a última execução.
+        
+        Usa o historyId salvo em `state_store`; a janela de `days_back` dias só é varrida
+        na primeira execução ou quando o historyId expira.
+        
+        Args:
+            user_email: Email do usuário para buscar
+            state_store: Store de checkpoints (ex.: GmailSyncStateStore)
+            days_back: Janela da varredura completa de fallback
+            progress_callback: Função para reportar progresso
+            use_batch: Se True, busca as mensagens em lotes HTTP batch
+            
+        Returns:
+            Lista estruturada dos recibos novos
+        """
+        try:
+            query = self._build_receipt_search_query(days_back)
+            senders = [email for emails in self.provider_registry.sender_map().values() for email in emails]
+            sync = self.sync_message_ids(user_email, query, state_store, scope='receipts', senders=senders,
+                                         backfill_days=days_back)
+            
+            if progress_callback:
+                progress_callback({
+                    'status': 'processing',
+                    'message': f"Sincronização {sync['mode']} - {len(sync['messages'])} mensagens novas",
+                    'sync_mode': sync['mode'],
+                    'total_messages': len(sync['messages'])
+                })
+            
+            receipts = self._process_message_list(user_email, sync['messages'], progress_callback, use_batch)
+            self.commit_sync(user_email, sync, state_store, scope='receipts')
+            return receipts
             
-            for idx, message in enumerate(all_messages):
+        except Exception as e:
+            if progress_callback:
+                progress_callback({
+                    'status': 'error',
+                    'message': f'Erro na sincronização incremental: {str(e)}',
+                    'total_processed': 0
+                })
+            raise Exception(f"Erro ao processar emails de recibos (incremental): {e}")
+
+    def _process_message_list(self, user_email: str, all_messages: Iterable[Dict[str, Any]],
+                              progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+                              use_batch: bool = False) -> List[Dict[str, Any]]:
+        """
+        Baixa e extrai os recibos de uma lista de mensagens já listadas.
+        
+        Args:
+            user_email: Email do usuário
+            all_messages: Mensagens no formato da listagem ({'id': ...}); aceita um gerador
+            progress_callback: Função para reportar progresso
+            use_batch: Se True, busca as mensagens em lotes HTTP batch
+            
+        Returns:
+            Lista estruturada de recibos processados
+        """
+        counters = {'messages': 0}
+        processed_receipts = list(self._iter_receipts_from_messages(
+            user_email, all_messages, progress_callback, use_batch, counters
+        ))
+        
+        # Callback final
+        if progress_callback:
+            progress_callback({
+                'status': 'completed',
+                'message': f'Processamento concluído - {len(processed_receipts)} recibos extraídos',
+                'total_processed': len(processed_receipts),
+                'total_messages': counters['messages']
+            })
+        
+        return processed_receipts
+
+    def _iter_receipts_from_messages(self, user_email: str, messages: Iterable[Dict[str, Any]],
+                                     progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+                                     use_batch: bool = False,
+                                     counters: Optional[Dict[str, int]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Baixa e extrai os recibos consumindo `messages` em blocos.
+        
+        Com `use_batch` cada bloco tem até `batch_size` mensagens (um batch HTTP);
+        sem ele, uma mensagem por vez. Só o bloco atual fica em memória.
+        
+        Args:
+            user_email: Email do usuário
+            messages: Mensagens no formato da listagem (lista ou gerador)
+            progress_callback: Função para reportar progresso
+            use_batch: Se True, busca as mensagens em lotes HTTP batch
+            counters: Dicionário opcional atualizado com o total de mensagens consumidas
+            
+        Yields:
+            Recibos estruturados
+        """
+        total_messages = len(messages) if isinstance(messages, (list, tuple)) else None
+        chunk_size = self.batch_size if use_batch else 1
+        iterator = iter(messages)
+        
+        idx = 0
+        while True:
+            batch_messages = list(islice(iterator, chunk_size))
+            if not batch_messages:
+                break
+            
+            fetched: Dict[str, Dict[str, Any]] = {}
+            rejected: set = set()
+            if use_batch and self.two_phase_fetch:
+                fetched, fetch_stats = self.fetch_candidate_messages(
+                    user_email, [m['id'] for m in batch_messages], self._is_receipt_candidate
+                )
+                rejected = set(fetch_stats['rejected_ids'])
+            elif use_batch:
+                fetched = self.get_messages_batch(user_email, [m['id'] for m in batch_messages])
+            
+            for message in batch_messages:
+                receipt_data = None
                 try:
                     # Callback de progresso para processamento
                     if progress_callback:
                         progress_callback({
                             'status': 'processing_receipts',
-                            'message': f'Processando recibo {idx + 1}/{total_messages}',
+                            'message': (f'Processando recibo {idx + 1}/{total_messages}' if total_messages is not None
+                                        else f'Processando recibo {idx + 1}'),
                             'current_message': idx + 1,
-                            'total_messages': total_messages
+                            'total_messages': total_messages if total_messages is not None else idx + 1
                         })
                     
                     # Obter dados completos do email
                     message_id = message['id']
-                    full_message = self.get_message(user_email, message_id)
-                    
-                    # Extrair dados básicos do email
-                    email_data = self._extract_basic_email_data(full_message)
-                    
-                    # Usar ReceiptExtractor para extrair dados estruturados
-                    receipt_data = self.receipt_extractor.extract_receipt_data(email_data)
-                    
-                    if receipt_data.get('success', False):
-                        # Adicionar metadados do email
-                        receipt_data.update({
-                            'message_id': message_id,
-                            'email_date': email_data.get('date'),
-                            'email_subject': email_data.get('subject'),
-                            'email_sender': email_data.get('sender'),
-                            'processed_at': datetime.now().isoformat()
-                        })
-                        
-                        processed_receipts.append(receipt_data)
+                    if message_id in rejected:
+                        continue  # remetente fora dos provedores: corpo não baixado
+                    if use_batch:
+                        fetch_result = fetched.get(message_id) or {'success': False, 'error': 'Mensagem ausente no batch'}
+                        if not fetch_result['success']:
+                            raise Exception(fetch_result['error'])
+                        full_message = fetch_result['message']
+                    else:
+                        full_message = self.get_message(user_email, message_id)
                     
-                    # Rate limiting entre processamentos
-                    time.sleep(self.rate_limit_delay)
+                    receipt_data = self._build_receipt_from_message(message_id, full_message)
                     
                 except Exception as e:
                     print(f"Erro ao processar email {message.get('id', 'unknown')}: {e}")
-                    continue
+                finally:
+                    idx += 1
+                    if counters is not None:
+                        counters['messages'] = idx
+                
+                if receipt_data:
+                    yield receipt_data
+
+    def process_receipts_pipelined(self, user_email: str, query: str,
+                                   max_results: Optional[int] = None,
+                                   concurrency: Optional[int] = None,
+                                   queue_size: Optional[int] = None,
+                                   progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None) -> List[Dict[str, Any]]:
+        """
+        Processa recibos em pipeline: listagem -> download -> extração.
+        
+        Uma thread pagina com `_fetch_page_with_retry`, um pool limitado de threads baixa
+        as mensagens completas e a thread chamadora extrai os recibos. Os estágios são
+        ligados por filas limitadas, então a listagem pausa quando o download não
+        acompanha (backpressure). O resultado segue a ordem da listagem, idêntico ao
+        caminho sequencial.
+        
+        Args:
+            user_email: Email do usuário para buscar
+            query: Query de busca Gmail
+            max_results: Limite máximo de mensagens (None = sem limite)
+            concurrency: Número de workers de download (padrão: `pipeline_concurrency`)
+            queue_size: Capacidade de cada fila (padrão: `pipeline_queue_size`)
+            progress_callback: Função para reportar progresso (sempre chamada na thread chamadora)
             
-            # Callback final
-            if progress_callback:
-                progress_callback({
-                    'status': 'completed',
-                    'message': f'Processamento concluído - {len(processed_receipts)} recibos extraídos',
-                    'total_processed': len(processed_receipts),
-                    'total_messages': total_messages
-                })
+        Returns:
+            Lista estruturada de recibos processados
+        """
+        workers = max(1, concurrency or self.pipeline_concurrency)
+        capacity = max(1, queue_size or self.pipeline_queue_size)
+        
+        fetch_queue: queue.Queue = queue.Queue(maxsize=capacity)
+        extract_queue: queue.Queue = queue.Queue(maxsize=capacity)
+        events: queue.Queue = queue.Queue()
+        stop = threading.Event()
+        done = object()
+        listing_error: List[Exception] = []
+        
+        def _put(target: queue.Queue, item: Any) -> bool:
+            # Bloqueia enquanto a fila estiver cheia, mas desiste se o pipeline for abortado
+            while not stop.is_set():
+                try:
+                    target.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        
+        def _list_stage():
+            page_token = None
+            page_count = 0
+            total_found = 0
+            try:
+                while not stop.is_set():
+                    if max_results and total_found >= max_results:
+                        break
+                    page_messages, page_token = self._fetch_page_with_retry(
+                        user_email, query, page_token, max_results, total_found
+                    )
+                    page_count += 1
+                    for message in page_messages:
+                        if not _put(fetch_queue, (total_found, message['id'])):
+                            return
+                        total_found += 1
+                    events.put({
+                        'status': 'processing',
+                        'message': f'Página {page_count} processada - {len(page_messages)} mensagens encontradas',
+                        'page_count': page_count,
+                        'total_messages': total_found,
+                        'messages_in_page': len(page_messages)
+                    })
+                    if not page_token:
+                        break
+            except Exception as e:
+                listing_error.append(e)
+            finally:
+                for _ in range(workers):
+                    _put(fetch_queue, done)
+        
+        def _fetch_stage():
+            try:
+                while not stop.is_set():
+                    try:
+                        item = fetch_queue.get(timeout=0.5)
+                    except queue.Empty:
+                        continue
+                    if item is done:
+                        break
+                    idx, message_id = item
+                    try:
+                        full_message = self.get_message(user_email, message_id)
+                        result = (idx, message_id, full_message, None)
+                    except Exception as e:
+                        result = (idx, message_id, None, e)
+                    if not _put(extract_queue, result):
+                        break
+            finally:
+                _put(extract_queue, done)
+        
+        def _drain_events():
+            while True:
+                try:
+                    event = events.get_nowait()
+                except queue.Empty:
+                    return
+                if progress_callback:
+                    progress_callback(event)
+        
+        lister = threading.Thread(target=_list_stage, name="gmail-pipeline-list", daemon=True)
+        fetchers = [
+            threading.Thread(target=_fetch_stage, name=f"gmail-pipeline-fetch-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        
+        receipts_by_idx: Dict[int, Dict[str, Any]] = {}
+        processed = 0
+        finished_workers = 0
+        
+        try:
+            lister.start()
+            for fetcher in fetchers:
+                fetcher.start()
             
-            return processed_receipts
+            while finished_workers < workers:
+                _drain_events()
+                try:
+                    item = extract_queue.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                if item is done:
+                    finished_workers += 1
+                    continue
+                
+                idx, message_id, full_message, error = item
+                processed += 1
+                if progress_callback:
+                    progress_callback({
+                        'status': 'processing_receipts',
+                        'message': f'Processando recibo {processed}',
+                        'current_message': processed,
+                        'total_messages': None
+                    })
+                
+                try:
+                    if error:
+                        raise error
+                    receipt_data = self._build_receipt_from_message(message_id, full_message)
+                    if receipt_data:
+                        receipts_by_idx[idx] = receipt_data
+                except Exception as e:
+                    print(f"Erro ao processar email {message_id}: {e}")
             
-        except Exception as e:
+            _drain_events()
+        finally:
+            stop.set()
+            lister.join(timeout=5)
+            for fetcher in fetchers:
+                fetcher.join(timeout=5)
+        
+        if listing_error:
             if progress_callback:
                 progress_callback({
                     'status': 'error',
-                    'message': f'Erro no processamento: {str(e)}',
-                    'total_processed': len(processed_receipts) if 'processed_receipts' in locals() else 0
+                    'message': f'Erro durante paginação: {str(listing_error[0])}',
+                    'total_processed': len(receipts_by_idx)
                 })
-            raise Exception(f"Erro ao processar todos os emails de recibos: {e}")
+            raise Exception(f"Erro na paginação de mensagens: {listing_error[0]}")
+        
+        processed_receipts = [receipts_by_idx[idx] for idx in sorted(receipts_by_idx)]
+        
+        if progress_callback:
+            progress_callback({
+                'status': 'completed',
+                'message': f'Processamento concluído - {len(processed_receipts)} recibos extraídos',
+                'total_processed': len(processed_receipts),
+                'total_messages': processed
+            })
+        
+        return processed_receipts
+
+    def _build_receipt_from_message(self, message_id: str, full_message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Extrai o recibo estruturado de uma mensagem completa do Gmail.
+        
+        Args:
+            message_id: ID da mensagem
+            full_message: Mensagem no formato "full"
+            
+        Returns:
+            Dados do recibo com metadados do email, ou None se não for um recibo reconhecido
+        """
+        # Extrair dados básicos do email
+        email_data = self._extract_basic_email_data(full_message)
+        
+        # Usar ReceiptExtractor para extrair dados estruturados
+        receipt_data = self.receipt_extractor.extract_receipt_data(email_data)
+        
+        if not receipt_data.get('success', False):
+            return None
+        
+        # Adicionar metadados do email
+        receipt_data.update({
+            'message_id': message_id,
+            'email_date': email_data.get('date'),
+            'email_subject': email_data.get('subject'),
+            'email_sender': email_data.get('sender'),
+            'processed_at': datetime.now().isoformat()
+        })
+        return receipt_data
 
-    def set_rate_limiting(self, delay: float = 0.1, max_retries: int = 3, 
-                         quota_delay: int = 60) -> None:
+    def set_rate_limiting(self, delay: Optional[float] = None, max_retries: int = 3, 
+                         quota_delay: int = 60, units_per_second: Optional[float] = None) -> None:
         """
         Configura parâmetros de rate limiting.
         
         Args:
-            delay: Delay entre requests (segundos)
+            delay: Atraso base do backoff exponencial (segundos)
             max_retries: Máximo de tentativas em caso de erro
-            quota_delay: Delay quando quota excedida (segundos)
+            quota_delay: Atraso máximo do backoff quando a quota é excedida (segundos)
+            units_per_second: Nova taxa do token bucket (afeta todas as instâncias do processo)
         """
-        self.rate_limit_delay = delay
+        if delay is not None:
+            self.backoff_base = delay
         self.max_retries = max_retries
         self.quota_exceeded_delay = quota_delay
-
-
+        if units_per_second:
+            self.rate_limiter.configure(rate=units_per_second)
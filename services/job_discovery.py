@@ -0,0 +1,108 @@
+"""
+Descoberta em lote de jobs de recibo a partir de mensagens do Gmail.
+
+Em vez de uma consulta de deduplicação e um commit por mensagem, os hashes já
+conhecidos são carregados com uma consulta `IN` por bloco de IDs e os novos
+jobs são gravados com um insert em lote por página, tudo em uma única transação.
+"""
+
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List
+
+from sqlalchemy import insert, select
+
+from database import SessionLocal
+from models.receipt_models import ReceiptJob, JobStatus
+
+logger = logging.getLogger(__name__)
+
+
+class JobDiscoveryService:
+    """Registra jobs DISCOVERED para mensagens ainda não conhecidas."""
+
+    def __init__(self, session_factory=SessionLocal, page_size: int = 500):
+        """
+        Inicializa o serviço.
+
+        Args:
+            session_factory: Fábrica de sessões SQLAlchemy
+            page_size: IDs por consulta `IN` / insert em lote (abaixo do limite de
+                parâmetros do SQLite)
+        """
+        self.session_factory = session_factory
+        self.page_size = max(1, page_size)
+
+    def discover(self, user_email: str, message_ids: Iterable[str]) -> Dict[str, Any]:
+        """
+        Cria jobs para as mensagens cujo hash ainda não está em `receipt_jobs`.
+
+        Args:
+            user_email: Caixa de origem (vira `collaborator_email`)
+            message_ids: IDs das mensagens candidatas
+
+        Returns:
+            Dicionário com created, skipped, created_ids e tempos por fase (segundos)
+        """
+        started = time.perf_counter()
+        candidate_ids = list(dict.fromkeys(mid for mid in message_ids if mid))
+        timings = {'dedup': 0.0, 'insert': 0.0, 'commit': 0.0}
+        created_ids: List[str] = []
+
+        session = self.session_factory()
+        try:
+            for start in range(0, len(candidate_ids), self.page_size):
+                page = candidate_ids[start:start + self.page_size]
+
+                phase = time.perf_counter()
+                known = set(session.execute(
+                    select(ReceiptJob.source_hash).where(ReceiptJob.source_hash.in_(page))
+                ).scalars())
+                timings['dedup'] += time.perf_counter() - phase
+
+                new_ids = [mid for mid in page if mid not in known]
+                if not new_ids:
+                    continue
+
+                now = datetime.utcnow()
+                rows = [{
+                    'source_email_id': mid,
+                    'source_type': 'EMAIL',
+                    'source_uri': f"gmail://{user_email}/{mid}",
+                    'source_hash': mid,
+                    'collaborator_email': user_email,
+                    'status': JobStatus.DISCOVERED,
+                    'attempts': 0,
+                    'created_at': now,
+                    'updated_at': now,
+                } for mid in new_ids]
+
+                phase = time.perf_counter()
+                session.execute(insert(ReceiptJob), rows)
+                timings['insert'] += time.perf_counter() - phase
+                created_ids.extend(new_ids)
+
+            phase = time.perf_counter()
+            session.commit()
+            timings['commit'] = time.perf_counter() - phase
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Erro na descoberta de jobs de {user_email}: {e}")
+            raise
+        finally:
+            session.close()
+
+        timings['total'] = time.perf_counter() - started
+        result = {
+            'created': len(created_ids),
+            'skipped': len(candidate_ids) - len(created_ids),
+            'created_ids': created_ids,
+            'timings': {k: round(v, 4) for k, v in timings.items()},
+        }
+        logger.info(
+            f"Descoberta {user_email}: {result['created']} novos, {result['skipped']} já conhecidos "
+            f"em {result['timings']['total']}s (dedup {result['timings']['dedup']}s, "
+            f"insert {result['timings']['insert']}s, commit {result['timings']['commit']}s)"
+        )
+        return result
@@ -0,0 +1,245 @@
+"""
+Motor de processamento paralelo de jobs de recibo.
+
+Os jobs DISCOVERED são reivindicados de forma atômica (UPDATE condicional ao
+status), processados por um pool de threads e têm seus status gravados em
+lotes pequenos. O limite de concorrência por provedor de LLM (`llm_slot`) é
+aplicado só em volta da chamada à LLM: jobs resolvidos pelas camadas
+determinística ou de cache não ocupam vaga. Jobs presos em PROCESSING por uma
+queda do processo voltam a ser reivindicados após `claim_timeout_seconds`.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from sqlalchemy import and_, or_, select, update
+
+from database import SessionLocal
+from models.receipt_models import ReceiptJob, JobStatus
+
+logger = logging.getLogger(__name__)
+
+
+def parse_provider_limits(spec: str) -> Dict[str, int]:
+    """
+    Converte "openai=4,zello=2" em {'openai': 4, 'zello': 2}.
+
+    Args:
+        spec: Lista de pares provedor=limite separados por vírgula
+
+    Returns:
+        Limites por provedor (entradas inválidas são ignoradas)
+    """
+    limits: Dict[str, int] = {}
+    for item in (spec or '').split(','):
+        name, _, value = item.partition('=')
+        try:
+            limits[name.strip().lower()] = max(1, int(value))
+        except ValueError:
+            continue
+    return limits
+
+
+class ProviderConcurrencyLimiter:
+    """Semáforos por provedor de LLM, compartilhados pelas threads do motor."""
+
+    def __init__(self, limits: Dict[str, int], default_limit: int):
+        """
+        Args:
+            limits: Limite de chamadas simultâneas por provedor
+            default_limit: Limite para provedores não listados
+        """
+        self.limits = dict(limits)
+        self.default_limit = max(1, default_limit)
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    def _semaphore(self, provider: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            if provider not in self._semaphores:
+                self._semaphores[provider] = threading.BoundedSemaphore(
+                    self.limits.get(provider, self.default_limit)
+                )
+            return self._semaphores[provider]
+
+    @contextmanager
+    def slot(self, provider: str) -> Iterator[None]:
+        """Bloqueia até haver vaga para o provedor durante o bloco `with`."""
+        semaphore = self._semaphore((provider or 'auto').lower())
+        semaphore.acquire()
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+
+class JobEngine:
+    """Reivindica e processa jobs DISCOVERED em paralelo."""
+
+    def __init__(self, process_job: Callable[[ReceiptJob], Dict[str, Any]],
+                 workers: int = 4,
+                 provider_limits: Optional[Dict[str, int]] = None,
+                 commit_batch: int = 10,
+                 claim_timeout_seconds: Optional[float] = 3600,
+                 session_factory=SessionLocal):
+        """
+        Inicializa o motor.
+
+        Args:
+            process_job: Função que processa um job e retorna {'success': bool, 'error': ...};
+                deve envolver as chamadas à LLM em `llm_slot(provedor)`
+            workers: Jobs processados simultaneamente
+            provider_limits: Limite de chamadas simultâneas à LLM por provedor
+            commit_batch: Quantidade de mudanças de status gravadas por commit
+            claim_timeout_seconds: Jobs em PROCESSING sem atualização há mais tempo são
+                reivindicados de novo (None desativa)
+            session_factory: Fábrica de sessões SQLAlchemy
+        """
+        self.process_job = process_job
+        self.claim_timeout_seconds = claim_timeout_seconds
+        self.workers = max(1, workers)
+        self.commit_batch = max(1, commit_batch)
+        self.session_factory = session_factory
+        self.provider_limiter = ProviderConcurrencyLimiter(provider_limits or {}, self.workers)
+
+    def llm_slot(self, provider: str):
+        """Context manager da vaga de `provider`; usar só em volta da chamada à LLM."""
+        return self.provider_limiter.slot(provider)
+
+    def _claimable(self, now: datetime):
+        """Condição de reivindicação: DISCOVERED, ou PROCESSING abandonado há mais que o timeout."""
+        if not self.claim_timeout_seconds:
+            return ReceiptJob.status == JobStatus.DISCOVERED
+        stale_before = now - timedelta(seconds=self.claim_timeout_seconds)
+        return or_(
+            ReceiptJob.status == JobStatus.DISCOVERED,
+            and_(ReceiptJob.status == JobStatus.PROCESSING, ReceiptJob.updated_at < stale_before),
+        )
+
+    def claim_jobs(self, limit: int) -> List[ReceiptJob]:
+        """
+        Reivindica até `limit` jobs DISCOVERED, marcando-os como PROCESSING.
+
+        Cada job só é reivindicado se o UPDATE condicional ao status afetar a linha,
+        então duas execuções concorrentes (threads ou processos) nunca pegam o mesmo job.
+        Jobs em PROCESSING sem atualização há mais de `claim_timeout_seconds` (reivindicados
+        por um processo que caiu) entram na mesma reivindicação.
+
+        Args:
+            limit: Máximo de jobs a reivindicar
+
+        Returns:
+            Jobs reivindicados (desanexados da sessão, com atributos carregados)
+        """
+        session = self.session_factory()
+        try:
+            claimed_ids: List[int] = []
+            for _ in range(3):  # nova rodada se outra execução levou parte dos candidatos
+                now = datetime.utcnow()
+                candidate_ids = list(session.execute(
+                    select(ReceiptJob.id)
+                    .where(self._claimable(now))
+                    .order_by(ReceiptJob.created_at, ReceiptJob.id)
+                    .limit(limit - len(claimed_ids))
+                ).scalars())
+                if not candidate_ids:
+                    break
+
+                for job_id in candidate_ids:
+                    result = session.execute(
+                        update(ReceiptJob)
+                        .where(ReceiptJob.id == job_id, self._claimable(now))
+                        .values(status=JobStatus.PROCESSING, attempts=ReceiptJob.attempts + 1, updated_at=now)
+                        .execution_options(synchronize_session=False)
+                    )
+                    if result.rowcount == 1:
+                        claimed_ids.append(job_id)
+                session.commit()
+                if len(claimed_ids) >= limit:
+                    break
+
+            if not claimed_ids:
+                return []
+            jobs = session.execute(
+                select(ReceiptJob).where(ReceiptJob.id.in_(claimed_ids)).order_by(ReceiptJob.id)
+            ).scalars().all()
+            session.expunge_all()
+            return list(jobs)
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def _run_job(self, job: ReceiptJob) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            result = self.process_job(job)
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+        result['duration'] = time.perf_counter() - started
+        return result
+
+    def _flush_status(self, updates: List[Dict[str, Any]]) -> None:
+        if not updates:
+            return
+        session = self.session_factory()
+        try:
+            session.execute(update(ReceiptJob), updates)  # UPDATE em lote pela chave primária
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        updates.clear()
+
+    def run(self, limit: int) -> Dict[str, Any]:
+        """
+        Reivindica e processa uma leva de jobs.
+
+        Args:
+            limit: Máximo de jobs desta execução
+
+        Returns:
+            Estatísticas da execução (reivindicados, processados, falhas, vazão)
+        """
+        started = time.perf_counter()
+        jobs = self.claim_jobs(limit)
+        stats: Dict[str, Any] = {'claimed': len(jobs), 'processed': 0, 'failed': 0, 'errors': []}
+        if not jobs:
+            stats['duration'] = round(time.perf_counter() - started, 3)
+            stats['jobs_per_minute'] = 0.0
+            return stats
+
+        pending_updates: List[Dict[str, Any]] = []
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(jobs)), thread_name_prefix='job-engine') as executor:
+            futures = {executor.submit(self._run_job, job): job for job in jobs}
+            for future in as_completed(futures):
+                job = futures[future]
+                result = future.result()
+                if result.get('success'):
+                    status = JobStatus.PROCESSED
+                    stats['processed'] += 1
+                    logger.info(f"Job {job.id} processado em {result['duration']:.1f}s")
+                else:
+                    status = JobStatus.FAILED
+                    stats['failed'] += 1
+                    stats['errors'].append({'job_id': job.id, 'error': result.get('error')})
+                    logger.error(f"Job {job.id} falhou: {result.get('error')}")
+
+                pending_updates.append({'id': job.id, 'status': status, 'updated_at': datetime.utcnow()})
+                if len(pending_updates) >= self.commit_batch:
+                    self._flush_status(pending_updates)
+
+        self._flush_status(pending_updates)
+
+        elapsed = time.perf_counter() - started
+        stats['duration'] = round(elapsed, 3)
+        stats['jobs_per_minute'] = round(len(jobs) / elapsed * 60, 2) if elapsed > 0 else 0.0
+        return stats
@@ -0,0 +1,161 @@
+"""
+Cache persistente das respostas de extração das LLMs.
+
+A chave é o SHA-256 de (provedor, versão do prompt, texto normalizado): o mesmo
+recibo processado de novo (reexecuções, e-mails encaminhados em duplicidade,
+novas tentativas na API) é respondido sem chamar a LLM. As entradas expiram
+por TTL e o total é limitado, removendo as menos usadas recentemente.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_receipt_text(text: str) -> str:
+    """Normaliza Unicode (NFKC) e espaços, sem alterar maiúsculas (números de recibo)."""
+    return _WHITESPACE.sub(' ', unicodedata.normalize('NFKC', text or '')).strip()
+
+
+def make_cache_key(provider: str, prompt_version: str, text: str) -> str:
+    """Gera a chave do cache para um recibo."""
+    raw = f"{(provider or 'auto').lower()}|{prompt_version}|{normalize_receipt_text(text)}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class LLMResponseCache:
+    """Cache SQLite com TTL e limite de entradas (remoção LRU), thread-safe."""
+
+    def __init__(self, path: str, ttl_seconds: float, max_entries: int):
+        """
+        Inicializa o cache.
+
+        Args:
+            path: Arquivo SQLite do cache
+            ttl_seconds: Validade de cada entrada
+            max_entries: Número máximo de entradas
+        """
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'writes': 0, 'expired': 0, 'evictions': 0}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_responses_last_access ON llm_responses (last_access)")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Busca uma resposta válida.
+
+        Args:
+            key: Chave gerada por `make_cache_key`
+
+        Returns:
+            Resultado armazenado ou None (ausente ou expirado)
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM llm_responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self._stats['misses'] += 1
+                return None
+            if now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+                self._stats['expired'] += 1
+                self._stats['misses'] += 1
+                return None
+            self._conn.execute("UPDATE llm_responses SET last_access = ? WHERE key = ?", (now, key))
+            self._stats['hits'] += 1
+
+        try:
+            return json.loads(row[0])
+        except ValueError:
+            return None
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        """
+        Grava uma resposta e aplica o limite de entradas.
+
+        Args:
+            key: Chave gerada por `make_cache_key`
+            value: Resultado serializável em JSON
+        """
+        try:
+            payload = json.dumps(value, ensure_ascii=False, default=str)
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Resultado não serializável, cache ignorado: {e}")
+            return
+
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_responses (key, value, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, payload, now, now)
+            )
+            self._stats['writes'] += 1
+
+            count = self._conn.execute("SELECT COUNT(*) FROM llm_responses").fetchone()[0]
+            if count > self.max_entries:
+                removed = self._conn.execute(
+                    "DELETE FROM llm_responses WHERE key IN ("
+                    "SELECT key FROM llm_responses ORDER BY last_access LIMIT ?)",
+                    (count - self.max_entries,)
+                ).rowcount
+                self._stats['evictions'] += removed
+
+    def clear(self) -> None:
+        """Remove todas as entradas."""
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_responses")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Retorna contadores do cache.
+
+        Returns:
+            Dicionário com hits, misses, taxa de acerto e número de entradas
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = self._conn.execute("SELECT COUNT(*) FROM llm_responses").fetchone()[0]
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+        stats.update({'max_entries': self.max_entries, 'ttl_seconds': self.ttl_seconds, 'path': self.path})
+        return stats
+
+
+_caches: Dict[str, LLMResponseCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_llm_cache(path: str, ttl_seconds: float, max_entries: int) -> LLMResponseCache:
+    """Retorna a instância compartilhada do cache para o arquivo informado."""
+    key = os.path.abspath(path)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = LLMResponseCache(path, ttl_seconds, max_entries)
+        return _caches[key]
@@ -1,129 +1,329 @@
 """
 Serviço para comunicação com LLMs (OpenAI e Zello MIND).
+
+O caminho síncrono usa uma `requests.Session` com pool de conexões keep-alive e
+retry (429/5xx/erros de conexão); o caminho assíncrono usa `httpx.AsyncClient`
+com concorrência limitada por semáforo. Ambos aceitam timeout por chamada.
 """
 
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
+import asyncio
+import random
 import requests
 import json
 import logging
 
+import httpx
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import config
+
 logger = logging.getLogger(__name__)
 
+# Status HTTP que justificam nova tentativa
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+
+class CappedRetry(Retry):
+    """Retry do urllib3 que respeita o Retry-After, mas nunca espera mais que `max_retry_after`."""
+
+    def __init__(self, *args, max_retry_after: Optional[float] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_retry_after = max_retry_after
+
+    def new(self, **kwargs) -> "CappedRetry":
+        retry = super().new(**kwargs)
+        retry.max_retry_after = self.max_retry_after
+        return retry
+
+    def get_retry_after(self, response) -> Optional[float]:
+        retry_after = super().get_retry_after(response)
+        if retry_after is None or self.max_retry_after is None:
+            return retry_after
+        return min(retry_after, self.max_retry_after)
+
 
 class LLMService:
     """Serviço unificado para comunicação com LLMs."""
-    
+
     def __init__(self):
-        self.openai_api_key = None
-        self.zello_api_key = None
-        self.zello_base_url = "https://api.zello.com"
-        
-        # Carregar chaves do ambiente
-        import os
-        from config import config
         self.openai_api_key = config.OPENAI_API_KEY
+        self.openai_base_url = config.OPENAI_BASE_URL.rstrip('/')
+        self.openai_model = config.OPENAI_MODEL
         self.zello_api_key = config.ZELLO_API_KEY
-        self.zello_base_url = config.ZELLO_BASE_URL
+        self.zello_base_url = config.ZELLO_BASE_URL.rstrip('/')
+
+        # Timeout, retry e concorrência
+        self.timeout = config.LLM_TIMEOUT_SECONDS
+        self.max_retries = max(0, config.LLM_MAX_RETRIES)
+        self.backoff = config.LLM_BACKOFF_SECONDS
+        self.max_retry_delay = max(0.0, config.LLM_MAX_RETRY_DELAY_SECONDS)  # Atraso máximo entre tentativas (segundos)
+        self.pool_size = max(1, config.LLM_POOL_SIZE)
+        self.async_concurrency = max(1, config.LLM_ASYNC_CONCURRENCY)
 
-    def generate_text(self, prompt: str, model: str = "zello", max_tokens: int = 1000) -> Dict[str, Any]:
+        self.session = self._build_session()
+
+    def _build_session(self) -> requests.Session:
+        """Cria a sessão HTTP compartilhada (keep-alive + retry com backoff)."""
+        retry = CappedRetry(
+            total=self.max_retries,
+            backoff_factor=self.backoff,
+            backoff_max=self.max_retry_delay,
+            status_forcelist=RETRYABLE_STATUS,
+            allowed_methods=frozenset(['POST']),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+            max_retry_after=self.max_retry_delay
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def generate_text(self, prompt: str, model: str = "zello", max_tokens: int = 1000,
+                      timeout: Optional[float] = None) -> Dict[str, Any]:
         """
         Gera texto usando o modelo especificado.
-        
+
         Args:
             prompt: Texto de entrada
             model: "openai" ou "zello"
             max_tokens: Número máximo de tokens
-            
+            timeout: Timeout da chamada em segundos (padrão: LLM_TIMEOUT_SECONDS)
+
+        Returns:
+            Dict com 'success', 'text' e 'error' (se houver)
+        """
+        return self.chat(model, [{"role": "user", "content": prompt}], max_tokens, timeout)
+
+    def chat(self, provider: str, messages: List[Dict[str, str]], max_tokens: int = 1000,
+             timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Envia mensagens no formato chat para um provedor.
+
+        Args:
+            provider: "openai" ou "zello"
+            messages: Lista de {'role', 'content'}
+            max_tokens: Número máximo de tokens
+            timeout: Timeout da chamada em segundos
+
         Returns:
             Dict com 'success', 'text' e 'error' (se houver)
         """
-        if model.lower() == "zello":
-            return self._call_zello(prompt, max_tokens)
-        elif model.lower() == "openai":
-            return self._call_openai(prompt, max_tokens)
-        else:
-            return {"success": False, "error": f"Modelo não suportado: {model}"}
-
-    def _call_zello(self, prompt: str, max_tokens: int) -> Dict[str, Any]:
-        """Chama a API do Zello MIND."""
-        if not self.zello_api_key:
-            return {"success": False, "error": "ZELLO_API_KEY não configurada"}
-        
+        request = self._build_request(provider, messages, max_tokens)
+        if 'error' in request:
+            return {"success": False, "error": request['error']}
+
         try:
-            headers = {
-                "Authorization": f"Bearer {self.zello_api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            data = {
-                "prompt": prompt,
-                "max_tokens": max_tokens,
-                "temperature": 0.7
-            }
-            
-            response = requests.post(
-                f"{self.zello_base_url}/v1/generate",
-                headers=headers,
-                json=data,
-                timeout=30
+            response = self.session.post(
+                request['url'],
+                headers=request['headers'],
+                json=request['payload'],
+                timeout=timeout or self.timeout
             )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return {
-                    "success": True,
-                    "text": result.get("text", ""),
-                    "usage": result.get("usage", {})
-                }
-            else:
-                return {
-                    "success": False,
-                    "error": f"Erro Zello API: {response.status_code} - {response.text}"
-                }
-                
+            return self._parse_response(provider, response.status_code, response.text)
         except Exception as e:
-            logger.error(f"Erro ao chamar Zello API: {e}")
+            logger.error(f"Erro ao chamar {provider} API: {e}")
             return {"success": False, "error": str(e)}
 
-    def _call_openai(self, prompt: str, max_tokens: int) -> Dict[str, Any]:
-        """Chama a API do OpenAI."""
-        if not self.openai_api_key:
-            return {"success": False, "error": "OPENAI_API_KEY não configurada"}
-        
-        try:
-            headers = {
-                "Authorization": f"Bearer {self.openai_api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            data = {
-                "model": "gpt-3.5-turbo",
-                "messages": [{"role": "user", "content": prompt}],
-                "max_tokens": max_tokens,
-                "temperature": 0.7
+    def get_completion(self, provider: str, messages: List[Dict[str, str]], max_tokens: int = 1000,
+                       timeout: Optional[float] = None) -> str:
+        """
+        Retorna o texto gerado, com fallback entre provedores quando provider='auto'.
+
+        Args:
+            provider: "auto", "openai" ou "zello"
+            messages: Lista de {'role', 'content'}
+            max_tokens: Número máximo de tokens
+            timeout: Timeout de cada chamada em segundos
+
+        Returns:
+            Texto gerado
+
+        Raises:
+            Exception: se nenhum provedor responder com sucesso
+        """
+        errors = []
+        for name in self._resolve_providers(provider):
+            result = self.chat(name, messages, max_tokens, timeout)
+            if result['success']:
+                return result['text']
+            errors.append(f"{name}: {result['error']}")
+        raise Exception("; ".join(errors) or f"Provedor não suportado: {provider}")
+
+    async def agenerate_text(self, prompt: str, model: str = "zello", max_tokens: int = 1000,
+                             timeout: Optional[float] = None,
+                             client: Optional[httpx.AsyncClient] = None) -> Dict[str, Any]:
+        """
+        Versão assíncrona de `generate_text`.
+
+        Args:
+            prompt: Texto de entrada
+            model: "openai" ou "zello"
+            max_tokens: Número máximo de tokens
+            timeout: Timeout da chamada em segundos
+            client: Cliente httpx compartilhado (um novo é criado se omitido)
+
+        Returns:
+            Dict com 'success', 'text' e 'error' (se houver)
+        """
+        return await self.achat(model, [{"role": "user", "content": prompt}], max_tokens, timeout, client)
+
+    async def achat(self, provider: str, messages: List[Dict[str, str]], max_tokens: int = 1000,
+                    timeout: Optional[float] = None,
+                    client: Optional[httpx.AsyncClient] = None) -> Dict[str, Any]:
+        """Versão assíncrona de `chat`, com retry em 429/5xx e erros de transporte."""
+        request = self._build_request(provider, messages, max_tokens)
+        if 'error' in request:
+            return {"success": False, "error": request['error']}
+
+        if client is None:
+            async with self.async_client() as own_client:
+                return await self.achat(provider, messages, max_tokens, timeout, own_client)
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await client.post(
+                    request['url'],
+                    headers=request['headers'],
+                    json=request['payload'],
+                    timeout=timeout or self.timeout
+                )
+                if response.status_code in RETRYABLE_STATUS and attempt < self.max_retries:
+                    await asyncio.sleep(self._retry_delay(attempt, response.headers.get('retry-after')))
+                    continue
+                return self._parse_response(provider, response.status_code, response.text)
+            except httpx.TransportError as e:
+                if attempt < self.max_retries:
+                    await asyncio.sleep(self._retry_delay(attempt))
+                    continue
+                logger.error(f"Erro ao chamar {provider} API: {e}")
+                return {"success": False, "error": str(e) or e.__class__.__name__}
+            except Exception as e:
+                logger.error(f"Erro ao chamar {provider} API: {e}")
+                return {"success": False, "error": str(e)}
+
+    async def aget_completion(self, provider: str, messages: List[Dict[str, str]], max_tokens: int = 1000,
+                              timeout: Optional[float] = None,
+                              client: Optional[httpx.AsyncClient] = None) -> str:
+        """Versão assíncrona de `get_completion` (mesmo fallback e mesmas exceções)."""
+        errors = []
+        for name in self._resolve_providers(provider):
+            result = await self.achat(name, messages, max_tokens, timeout, client)
+            if result['success']:
+                return result['text']
+            errors.append(f"{name}: {result['error']}")
+        raise Exception("; ".join(errors) or f"Provedor não suportado: {provider}")
+
+    async def agenerate_batch(self, prompts: List[str], model: str = "zello", max_tokens: int = 1000,
+                              timeout: Optional[float] = None,
+                              concurrency: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Gera textos para vários prompts em paralelo, com concorrência limitada.
+
+        Args:
+            prompts: Lista de prompts
+            model: "openai" ou "zello"
+            max_tokens: Número máximo de tokens
+            timeout: Timeout de cada chamada em segundos
+            concurrency: Chamadas simultâneas (padrão: LLM_ASYNC_CONCURRENCY)
+
+        Returns:
+            Resultados na mesma ordem dos prompts
+        """
+        limit = max(1, concurrency or self.async_concurrency)
+        semaphore = asyncio.Semaphore(limit)
+
+        async with self.async_client(limit) as client:
+            async def _one(prompt: str) -> Dict[str, Any]:
+                async with semaphore:
+                    return await self.agenerate_text(prompt, model, max_tokens, timeout, client)
+
+            return await asyncio.gather(*(_one(p) for p in prompts))
+
+    def async_client(self, max_connections: Optional[int] = None) -> httpx.AsyncClient:
+        """Cria um cliente httpx com pool de conexões dimensionado para a concorrência."""
+        size = max(1, max_connections or self.async_concurrency)
+        return httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=size, max_keepalive_connections=size),
+            timeout=self.timeout
+        )
+
+    def get_available_models(self) -> Dict[str, Any]:
+        """Retorna os provedores e modelos configurados."""
+        return {
+            "zello": {"configured": bool(self.zello_api_key), "base_url": self.zello_base_url},
+            "openai": {"configured": bool(self.openai_api_key), "base_url": self.openai_base_url,
+                       "model": self.openai_model},
+        }
+
+    def resolve_provider(self, provider: str) -> str:
+        """Provedor chamado primeiro para `provider` ('auto' -> primeiro configurado)."""
+        return self._resolve_providers(provider)[0]
+
+    def _resolve_providers(self, provider: str) -> List[str]:
+        """Lista os provedores a tentar, em ordem ('auto' usa todos os configurados)."""
+        provider = (provider or 'auto').lower()
+        if provider != 'auto':
+            return [provider]
+        configured = [name for name, key in (("zello", self.zello_api_key), ("openai", self.openai_api_key)) if key]
+        return configured or ["zello", "openai"]
+
+    def _retry_delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Atraso antes da próxima tentativa: Retry-After do servidor ou backoff com jitter, limitado ao teto."""
+        if retry_after:
+            try:
+                return min(max(0.0, float(retry_after)), self.max_retry_delay)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff * (2 ** attempt), self.max_retry_delay))
+
+    def _build_request(self, provider: str, messages: List[Dict[str, str]], max_tokens: int) -> Dict[str, Any]:
+        """Monta URL, headers e payload de cada provedor (compartilhado entre sync e async)."""
+        provider = (provider or '').lower()
+        if provider == "zello":
+            if not self.zello_api_key:
+                return {"error": "ZELLO_API_KEY não configurada"}
+            return {
+                "url": f"{self.zello_base_url}/v1/generate",
+                "headers": {"Authorization": f"Bearer {self.zello_api_key}", "Content-Type": "application/json"},
+                "payload": {
+                    "prompt": "\n\n".join(m.get("content", "") for m in messages),
+                    "max_tokens": max_tokens,
+                    "temperature": 0.7
+                }
             }
-            
-            response = requests.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers=headers,
-                json=data,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                text = result["choices"][0]["message"]["content"]
-                return {
-                    "success": True,
-                    "text": text,
-                    "usage": result.get("usage", {})
+        if provider == "openai":
+            if not self.openai_api_key:
+                return {"error": "OPENAI_API_KEY não configurada"}
+            return {
+                "url": f"{self.openai_base_url}/v1/chat/completions",
+                "headers": {"Authorization": f"Bearer {self.openai_api_key}", "Content-Type": "application/json"},
+                "payload": {
+                    "model": self.openai_model,
+                    "messages": messages,
+                    "max_tokens": max_tokens,
+                    "temperature": 0.7
                 }
+            }
+        return {"error": f"Modelo não suportado: {provider}"}
+
+    def _parse_response(self, provider: str, status_code: int, body: str) -> Dict[str, Any]:
+        """Converte a resposta HTTP no dicionário padrão do serviço."""
+        provider = provider.lower()
+        label = "Zello" if provider == "zello" else "OpenAI"
+        if status_code != 200:
+            return {"success": False, "error": f"Erro {label} API: {status_code} - {body}"}
+
+        try:
+            result = json.loads(body)
+            if provider == "zello":
+                text = result.get("text", "")
             else:
-                return {
-                    "success": False,
-                    "error": f"Erro OpenAI API: {response.status_code} - {response.text}"
-                }
-                
-        except Exception as e:
-            logger.error(f"Erro ao chamar OpenAI API: {e}")
-            return {"success": False, "error": str(e)}
+                text = result["choices"][0]["message"]["content"]
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            return {"success": False, "error": f"Resposta inválida da {label} API: {e}"}
+
+        return {"success": True, "text": text, "usage": result.get("usage", {})}
@@ -0,0 +1,187 @@
+"""
+Cache local em disco das mensagens brutas do Gmail.
+
+Mensagens do Gmail são imutáveis: o mesmo ID sempre devolve o mesmo conteúdo.
+Por isso cada mensagem é baixada uma única vez e guardada comprimida (gzip),
+com chave (caixa, ID, formato). O tamanho total é limitado e a remoção segue
+a política LRU.
+"""
+
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class MessageCache:
+    """Cache LRU limitado por tamanho, persistido em disco e thread-safe."""
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        """
+        Inicializa o cache e reconstrói o índice LRU a partir dos arquivos existentes.
+
+        Args:
+            cache_dir: Diretório dos arquivos comprimidos
+            max_bytes: Tamanho máximo total em disco (bytes)
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index: "OrderedDict[str, int]" = OrderedDict()  # caminho -> tamanho, do menos ao mais recente
+        self._total_bytes = 0
+        self._stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0, 'errors': 0}
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self) -> None:
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for filename in files:
+                if not filename.endswith('.json.gz'):
+                    continue
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, path, stat.st_size))
+
+        for _, path, size in sorted(entries):
+            self._index[path] = size
+            self._total_bytes += size
+
+        with self._lock:
+            self._evict_locked()
+
+    def _path_for(self, user_email: str, message_id: str, fmt: str) -> str:
+        user_key = hashlib.sha1((user_email or '').lower().encode('utf-8')).hexdigest()[:12]
+        safe_id = ''.join(c for c in message_id if c.isalnum() or c in '-_')
+        return os.path.join(self.cache_dir, user_key, safe_id[:2], f"{safe_id}.{fmt}.json.gz")
+
+    def get(self, user_email: str, message_id: str, fmt: str = 'full') -> Optional[Dict[str, Any]]:
+        """
+        Busca uma mensagem no cache.
+
+        Args:
+            user_email: Caixa de origem
+            message_id: ID da mensagem
+            fmt: Formato da mensagem ('full', 'metadata', ...)
+
+        Returns:
+            Mensagem ou None se não estiver em cache
+        """
+        path = self._path_for(user_email, message_id, fmt)
+
+        with self._lock:
+            if path not in self._index:
+                self._stats['misses'] += 1
+                return None
+            self._index.move_to_end(path)
+
+        try:
+            with open(path, 'rb') as f:
+                message = json.loads(gzip.decompress(f.read()).decode('utf-8'))
+            os.utime(path)  # persiste a recência para o próximo carregamento do índice
+        except (OSError, ValueError) as e:
+            logger.warning(f"Entrada de cache inválida {path}: {e}")
+            with self._lock:
+                self._stats['errors'] += 1
+                self._stats['misses'] += 1
+                self._drop_locked(path)
+            return None
+
+        with self._lock:
+            self._stats['hits'] += 1
+        return message
+
+    def contains(self, user_email: str, message_id: str, fmt: str = 'full') -> bool:
+        """Indica se a mensagem está em cache (não altera contadores nem a ordem LRU)."""
+        with self._lock:
+            return self._path_for(user_email, message_id, fmt) in self._index
+
+    def put(self, user_email: str, message_id: str, message: Dict[str, Any], fmt: str = 'full') -> None:
+        """
+        Grava uma mensagem no cache (escrita atômica) e aplica a remoção LRU.
+
+        Args:
+            user_email: Caixa de origem
+            message_id: ID da mensagem
+            message: Mensagem retornada pela Gmail API
+            fmt: Formato da mensagem
+        """
+        path = self._path_for(user_email, message_id, fmt)
+        data = gzip.compress(json.dumps(message, ensure_ascii=False).encode('utf-8'), compresslevel=6)
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Falha ao gravar cache {path}: {e}")
+            with self._lock:
+                self._stats['errors'] += 1
+            return
+
+        with self._lock:
+            self._total_bytes -= self._index.pop(path, 0)
+            self._index[path] = len(data)
+            self._total_bytes += len(data)
+            self._stats['writes'] += 1
+            self._evict_locked()
+
+    def _drop_locked(self, path: str) -> None:
+        self._total_bytes -= self._index.pop(path, 0)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _evict_locked(self) -> None:
+        while self._total_bytes > self.max_bytes and self._index:
+            path, _ = next(iter(self._index.items()))
+            self._drop_locked(path)
+            self._stats['evictions'] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Retorna contadores do cache.
+
+        Returns:
+            Dicionário com hits, misses, taxa de acerto, entradas e bytes ocupados
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'entries': len(self._index),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'cache_dir': self.cache_dir,
+            })
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+        return stats
+
+
+_caches: Dict[str, MessageCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_message_cache(cache_dir: str, max_bytes: int) -> MessageCache:
+    """Retorna a instância compartilhada do cache para o diretório (um índice por diretório)."""
+    key = os.path.abspath(cache_dir)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = MessageCache(cache_dir, max_bytes)
+        return _caches[key]
@@ -0,0 +1,271 @@
+"""
+Leitura do corpo de mensagens do Gmail (payload MIME da API).
+
+Percorre multiparts aninhados (ex.: multipart/mixed > multipart/alternative >
+text/plain + text/html, como nos recibos da Stripe/Anthropic), decodifica o
+base64 apenas da parte escolhida e converte HTML em texto com um tokenizador
+em streaming que descarta <style>/<script>, elementos ocultos e o ruído das
+tabelas de layout. O texto decodificado fica guardado na própria mensagem,
+então chamadas seguintes (extração, encaminhador, scheduler) não decodificam
+o payload de novo.
+"""
+
+from __future__ import annotations
+
+import base64
+import binascii
+import re
+from html.parser import HTMLParser
+from typing import Any, Dict, Iterator, List, Optional
+
+# Chave, no dict da mensagem, do cache de partes já decodificadas
+DECODED_CACHE_KEY = '_decoded_parts'
+
+# Tags cujo conteúdo nunca é texto visível
+_SKIP_TAGS = {'style', 'script', 'head', 'title', 'noscript', 'template'}
+
+# Tags que quebram linha no texto
+_BLOCK_TAGS = {
+    'address', 'article', 'aside', 'blockquote', 'br', 'div', 'dl', 'dt', 'dd', 'footer',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'li', 'ol', 'p', 'pre', 'section',
+    'table', 'tbody', 'thead', 'tfoot', 'tr', 'ul',
+}
+
+# Células de tabela viram colunas separadas por espaço
+_CELL_TAGS = {'td', 'th'}
+
+# Elementos sem tag de fechamento
+_VOID_TAGS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param',
+    'source', 'track', 'wbr',
+}
+
+_HIDDEN_STYLE = re.compile(r'display\s*:\s*none|visibility\s*:\s*hidden|max-height\s*:\s*0', re.IGNORECASE)
+_INLINE_SPACES = re.compile(r'[ \t\r\f\v\u00a0\u200b\u200c\u034f\ufeff]+')
+
+
+class _HTMLTextExtractor(HTMLParser):
+    """Tokenizador HTML -> texto em streaming (sem montar árvore)."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._chunks: List[str] = []
+        self._skip_tag: Optional[str] = None
+        self._skip_depth = 0
+        # Elemento oculto: a tag, o aninhamento dela e quantos elementos abertos o envolvem
+        self._hidden_tag: Optional[str] = None
+        self._hidden_depth = 0
+        self._hidden_parents = 0
+        # Elementos abertos fora do trecho oculto (o HTML de marketing raramente fecha tudo)
+        self._open_tags: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if self._skip_tag:
+            if tag == self._skip_tag:
+                self._skip_depth += 1
+            return
+        if tag in _SKIP_TAGS:
+            self._skip_tag, self._skip_depth = tag, 1
+            return
+        if self._hidden_tag:
+            if tag == self._hidden_tag:
+                self._hidden_depth += 1
+            return
+
+        style = next((value for name, value in attrs if name == 'style' and value), '')
+        if tag not in _VOID_TAGS and (('hidden', None) in attrs or (style and _HIDDEN_STYLE.search(style))):
+            # Pré-cabeçalhos ocultos dos e-mails de marketing
+            self._hidden_tag, self._hidden_depth = tag, 1
+            self._hidden_parents = len(self._open_tags)
+            return
+        if tag not in _VOID_TAGS:
+            self._open_tags.append(tag)
+
+        if tag in _BLOCK_TAGS:
+            self._chunks.append('\n')
+        elif tag in _CELL_TAGS:
+            self._chunks.append(' ')
+
+    def handle_startendtag(self, tag, attrs):
+        if not self._skip_tag and not self._hidden_tag and tag in _BLOCK_TAGS:
+            self._chunks.append('\n')
+
+    def handle_endtag(self, tag):
+        if self._skip_tag:
+            if tag == self._skip_tag:
+                self._skip_depth -= 1
+                if self._skip_depth == 0:
+                    self._skip_tag = None
+            return
+        if self._hidden_tag:
+            if tag == self._hidden_tag:
+                self._hidden_depth -= 1
+                if self._hidden_depth == 0:
+                    self._hidden_tag = None
+                return
+            if tag not in self._open_tags[:self._hidden_parents]:
+                return
+            # Fechou um elemento que envolve o oculto: o oculto ficou sem fechamento
+            self._hidden_tag = None
+        if tag in self._open_tags:
+            del self._open_tags[len(self._open_tags) - 1 - self._open_tags[::-1].index(tag):]
+        if tag in _BLOCK_TAGS:
+            self._chunks.append('\n')
+        elif tag in _CELL_TAGS:
+            self._chunks.append(' ')
+
+    def handle_data(self, data):
+        if not self._skip_tag and not self._hidden_tag:
+            self._chunks.append(data)
+
+    def get_text(self) -> str:
+        lines = (_INLINE_SPACES.sub(' ', line).strip() for line in ''.join(self._chunks).split('\n'))
+        return '\n'.join(line for line in lines if line)
+
+
+def html_to_text(html: str) -> str:
+    """
+    Converte HTML em texto legível.
+
+    Args:
+        html: Documento ou fragmento HTML
+
+    Returns:
+        Texto com uma linha por bloco/linha de tabela, sem linhas vazias
+    """
+    if not html:
+        return ''
+    parser = _HTMLTextExtractor()
+    parser.feed(html)
+    parser.close()
+    return parser.get_text()
+
+
+def iter_parts(payload: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """
+    Percorre as partes folha do payload em profundidade, na ordem do e-mail.
+
+    Anexos (partes com nome de arquivo) são ignorados.
+
+    Args:
+        payload: Campo 'payload' de uma mensagem no formato "full"
+
+    Yields:
+        Partes folha (com 'mimeType' e 'body')
+    """
+    stack = [payload or {}]
+    while stack:
+        part = stack.pop()
+        children = part.get('parts')
+        if children:
+            stack.extend(reversed(children))
+            continue
+        if part.get('filename'):
+            continue
+        yield part
+
+
+def iter_attachments(payload: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """
+    Percorre as partes de anexo do payload (com nome de arquivo), em profundidade.
+
+    Args:
+        payload: Campo 'payload' de uma mensagem no formato "full"
+
+    Yields:
+        Partes de anexo; o conteúdo está em body.data (inline) ou em body.attachmentId
+    """
+    stack = [payload or {}]
+    while stack:
+        part = stack.pop()
+        children = part.get('parts')
+        if children:
+            stack.extend(reversed(children))
+            continue
+        body = part.get('body', {})
+        if part.get('filename') and (body.get('attachmentId') or body.get('data')):
+            yield part
+
+
+def decode_base64url(data: str) -> bytes:
+    """Decodifica base64url da Gmail API (tolerante a padding ausente)."""
+    return base64.urlsafe_b64decode(data.encode() + b'=' * (-len(data) % 4))
+
+
+def find_part(payload: Dict[str, Any], mime_type: str) -> Optional[Dict[str, Any]]:
+    """Retorna a primeira parte folha com o MIME type informado e corpo inline."""
+    for part in iter_parts(payload):
+        if (part.get('mimeType') or '').lower() == mime_type and part.get('body', {}).get('data'):
+            return part
+    return None
+
+
+def decode_part_data(part: Dict[str, Any]) -> str:
+    """Decodifica o corpo base64url de uma parte (tolerante a padding ausente)."""
+    data = (part or {}).get('body', {}).get('data')
+    if not data:
+        return ''
+    try:
+        raw = decode_base64url(data)
+    except (binascii.Error, ValueError):
+        return ''
+    return raw.decode(_part_charset(part), errors='replace')
+
+
+def _part_charset(part: Dict[str, Any]) -> str:
+    for header in part.get('headers', []) or []:
+        if header.get('name', '').lower() == 'content-type':
+            match = re.search(r'charset="?([\w.:-]+)"?', header.get('value', ''), re.IGNORECASE)
+            if match:
+                charset = match.group(1)
+                try:
+                    ''.encode(charset)
+                    return charset
+                except LookupError:
+                    break
+    return 'utf-8'
+
+
+def _decoded_cache(message: Dict[str, Any]) -> Dict[str, str]:
+    cache = message.get(DECODED_CACHE_KEY)
+    if cache is None:
+        cache = message[DECODED_CACHE_KEY] = {}
+    return cache
+
+
+def get_part_text(message: Dict[str, Any], mime_type: str) -> str:
+    """
+    Conteúdo decodificado da primeira parte `mime_type` da mensagem (memoizado).
+
+    Args:
+        message: Mensagem no formato "full"
+        mime_type: 'text/plain' ou 'text/html'
+
+    Returns:
+        Conteúdo decodificado ('' se a parte não existir)
+    """
+    cache = _decoded_cache(message)
+    if mime_type not in cache:
+        cache[mime_type] = decode_part_data(find_part(message.get('payload', {}), mime_type))
+    return cache[mime_type]
+
+
+def extract_text(message: Dict[str, Any]) -> str:
+    """
+    Texto do corpo da mensagem: text/plain quando houver, senão HTML convertido.
+
+    Só a parte escolhida é decodificada, e o resultado fica em cache na mensagem.
+
+    Args:
+        message: Mensagem no formato "full"
+
+    Returns:
+        Texto do corpo ('' se não houver corpo legível)
+    """
+    cache = _decoded_cache(message)
+    if 'text' not in cache:
+        text = get_part_text(message, 'text/plain')
+        if not text.strip():
+            text = html_to_text(get_part_text(message, 'text/html'))
+        cache['text'] = text
+    return cache['text']
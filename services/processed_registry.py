@@ -0,0 +1,258 @@
+"""
+Registro persistente de recibos já encaminhados (detecção de duplicatas).
+
+O registro é um log append-only em JSON Lines: cada gravação acrescenta uma
+linha por índice (`by_invoice`, `by_triplet`) e os dois índices ficam em
+dicts em memória, então consultar e gravar custa O(1) independentemente do
+tamanho. Linhas sobrescritas são removidas por compactação periódica
+(reescrita atômica), e uma linha truncada por queda do processo é ignorada
+na leitura.
+
+Várias instâncias podem usar o mesmo arquivo (daemon do encaminhador, app,
+execuções avulsas): gravações e compactações são serializadas por um `flock`
+em `<arquivo>.lock`, a compactação relê o log antes de reescrevê-lo e cada
+gravação reabre o arquivo se outra instância o tiver trocado.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem trava entre processos
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+INDEXES = ('by_invoice', 'by_triplet')
+
+# Compacta quando o log tiver mais que este fator de linhas por entrada viva
+COMPACT_RATIO = 2.0
+COMPACT_MIN_LINES = 1000
+
+
+class ProcessedRegistry:
+    """Índices by_invoice/by_triplet em memória sobre um log JSON Lines."""
+
+    def __init__(self, path: str, legacy_json_path: Optional[str] = None, fsync: bool = True):
+        """
+        Carrega o registro.
+
+        Args:
+            path: Arquivo .jsonl do log
+            legacy_json_path: processed_registry.json antigo, importado se o log ainda não existir
+            fsync: Força cada gravação para o disco (seguro contra queda)
+        """
+        self.path = path
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._indexes: Dict[str, Dict[str, Any]] = {name: {} for name in INDEXES}
+        self._log_lines = 0
+        self._file = None
+        self._lock_file = None
+        self._file_lock_depth = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._file_lock():
+            if os.path.exists(path):
+                self._load()
+            elif legacy_json_path and os.path.exists(legacy_json_path):
+                self._import_legacy(legacy_json_path)
+
+            if self._needs_compaction():
+                self._compact_locked()
+
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        """Trava exclusiva entre processos (reentrante na mesma instância)."""
+        if fcntl is None:
+            yield
+            return
+        if self._lock_file is None:
+            self._lock_file = open(self.path + '.lock', 'a')
+        if self._file_lock_depth == 0:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+        self._file_lock_depth += 1
+        try:
+            yield
+        finally:
+            self._file_lock_depth -= 1
+            if self._file_lock_depth == 0:
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _read_log(self) -> int:
+        """Aplica o log do disco aos índices; retorna o número de linhas inválidas."""
+        skipped = 0
+        self._log_lines = 0
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    self._indexes[record['index']][record['key']] = record.get('value')
+                    self._log_lines += 1
+                except (ValueError, KeyError, TypeError):
+                    skipped += 1  # linha parcial de uma gravação interrompida
+        return skipped
+
+    def _load(self) -> None:
+        skipped = self._read_log()
+        if skipped:
+            logger.warning(f"Registry {self.path}: {skipped} linhas inválidas ignoradas")
+            self._compact_locked(merge=False)
+
+    def _import_legacy(self, legacy_json_path: str) -> None:
+        try:
+            with open(legacy_json_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            for name in INDEXES:
+                self._indexes[name].update(data.get(name) or {})
+            logger.info(f"Registry importado de {legacy_json_path}: {len(self)} entradas")
+        except Exception as e:
+            logger.warning(f"Falha ao importar registry antigo {legacy_json_path}: {e}")
+        self._compact_locked(merge=False)
+
+    def __len__(self) -> int:
+        return sum(len(index) for index in self._indexes.values())
+
+    def contains_invoice(self, invoice: str) -> bool:
+        """Indica se o número de recibo já foi registrado."""
+        return invoice in self._indexes['by_invoice']
+
+    def contains_triplet(self, triplet: str) -> bool:
+        """Indica se a chave (provedor, data, valor) já foi registrada."""
+        return triplet in self._indexes['by_triplet']
+
+    def register(self, triplet: str, triplet_value: Dict[str, Any],
+                 invoice: Optional[str] = None, invoice_value: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Registra um recibo processado (uma gravação append, O(1)).
+
+        Args:
+            triplet: Chave (provedor|data|valor)
+            triplet_value: Dados guardados em by_triplet
+            invoice: Número do recibo, se houver
+            invoice_value: Dados guardados em by_invoice
+        """
+        records = []
+        if invoice:
+            records.append({'index': 'by_invoice', 'key': invoice, 'value': invoice_value})
+        records.append({'index': 'by_triplet', 'key': triplet, 'value': triplet_value})
+
+        with self._lock:
+            self._append(records)
+            for record in records:
+                self._indexes[record['index']][record['key']] = record['value']
+            if self._needs_compaction():
+                self._compact_locked()
+
+    def _append(self, records) -> None:
+        with self._file_lock():
+            self._reopen_if_replaced()
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(''.join(
+                json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=str) + '\n'
+                for record in records
+            ))
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._log_lines += len(records)
+
+    def _reopen_if_replaced(self) -> None:
+        """Se outra instância trocou o arquivo (compactação), fecha o handle antigo e relê o log."""
+        if self._file is None:
+            return
+        try:
+            replaced = os.fstat(self._file.fileno()).st_ino != os.stat(self.path).st_ino
+        except FileNotFoundError:
+            replaced = True
+        if replaced:
+            self._file.close()
+            self._file = None
+            if os.path.exists(self.path):
+                self._read_log()
+
+    def _needs_compaction(self) -> bool:
+        return self._log_lines >= COMPACT_MIN_LINES and self._log_lines > COMPACT_RATIO * max(1, len(self))
+
+    def compact(self) -> None:
+        """Reescreve o log só com as entradas vivas (troca atômica do arquivo)."""
+        with self._lock:
+            self._compact_locked()
+
+    def _compact_locked(self, merge: bool = True) -> None:
+        """
+        Reescreve o log só com as entradas vivas.
+
+        Args:
+            merge: Relê o log antes (inclui o que outras instâncias gravaram); False
+                para reescrever exatamente os índices em memória (clear, importação)
+        """
+        with self._file_lock():
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if merge and os.path.exists(self.path):
+                self._read_log()
+
+            directory = os.path.dirname(self.path) or '.'
+            fd, tmp_path = tempfile.mkstemp(prefix='.registry-', suffix='.tmp', dir=directory)
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    for name in INDEXES:
+                        for key, value in self._indexes[name].items():
+                            f.write(json.dumps({'index': name, 'key': key, 'value': value},
+                                               ensure_ascii=False, separators=(',', ':'), default=str) + '\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            self._log_lines = len(self)
+
+    def clear(self) -> None:
+        """Remove todas as entradas."""
+        with self._lock:
+            for index in self._indexes.values():
+                index.clear()
+            self._compact_locked(merge=False)
+
+    def close(self) -> None:
+        """Fecha o arquivo do log."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        """Cópia dos índices no formato do antigo processed_registry.json."""
+        with self._lock:
+            return {name: dict(index) for name, index in self._indexes.items()}
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Retorna o tamanho dos índices e do log."""
+        with self._lock:
+            return {
+                'by_invoice': len(self._indexes['by_invoice']),
+                'by_triplet': len(self._indexes['by_triplet']),
+                'log_lines': self._log_lines,
+                'path': self.path,
+            }
@@ -0,0 +1,178 @@
+"""
+Registro dos provedores de IA e resolução do remetente de um email.
+
+O registro é montado uma vez por processo e indexado em dicts: endereço
+normalizado -> provedor e domínio -> provedor. Resolver um header `From`
+custa uma análise do endereço e algumas consultas O(1), independentemente do
+número de provedores:
+
+1. endereço exato (`receipts@anthropic.com`, inclusive com tag `+`);
+2. endereço sem a tag `+` (`billing+123@openai.com` -> `billing@openai.com`),
+   só contra endereços cadastrados sem tag, para que remetentes compartilhados
+   como `invoice+statements+acct_X@stripe.com` continuem específicos;
+3. domínio do provedor ou subdomínio dele (`mail.anthropic.com` -> `anthropic.com`).
+
+Os provedores podem ser redefinidos por um JSON em PROVIDERS_CONFIG_PATH, no
+formato {"Provedor": {"senders": [...], "domains": [...]}}.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import re
+import threading
+from email.utils import parseaddr
+from typing import Any, Dict, List, Optional
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Domínios só entram para remetentes próprios do provedor (não stripe.com, paddle.com, google.com)
+DEFAULT_PROVIDERS: Dict[str, Dict[str, List[str]]] = {
+    'OpenAI': {
+        'senders': ['noreply@openai.com', 'billing@openai.com'],
+        'domains': ['openai.com'],
+    },
+    'Anthropic': {
+        'senders': ['receipts@anthropic.com'],
+        'domains': ['anthropic.com'],
+    },
+    'Cursor': {
+        'senders': ['billing@cursor.com'],
+        'domains': ['cursor.com'],
+    },
+    'Manus': {
+        'senders': ['invoice+statements+acct_1R15XBHkfKp4fCS9@stripe.com'],
+        'domains': ['manus.ai'],
+    },
+    'N8N': {
+        'senders': ['help@paddle.com'],
+        'domains': ['n8n.io'],
+    },
+    'Gemini': {
+        'senders': ['gemini-noreply@google.com'],
+        'domains': [],
+    },
+}
+
+_ADDRESS_RE = re.compile(r'[\w.!#$%&\'*+/=?^`{|}~-]+@[\w-]+(?:\.[\w-]+)+')
+
+
+def parse_address(sender: str) -> Optional[str]:
+    """
+    Extrai o endereço normalizado (minúsculo) de um header `From`.
+
+    Aceita `"Anthropic, PBC" <invoice@mail.anthropic.com>` e endereços soltos.
+
+    Returns:
+        Endereço ou None se o header não tiver um endereço válido
+    """
+    if not sender:
+        return None
+    address = parseaddr(sender)[1].strip().lower()
+    if '@' not in address:
+        match = _ADDRESS_RE.search(sender)
+        address = match.group(0).lower() if match else ''
+    return address if '@' in address else None
+
+
+class ProviderRegistry:
+    """Índices endereço -> provedor e domínio -> provedor."""
+
+    def __init__(self, providers: Dict[str, Dict[str, List[str]]]):
+        """
+        Monta os índices.
+
+        Args:
+            providers: {provedor: {'senders': [...], 'domains': [...]}}
+        """
+        self.providers: Dict[str, Dict[str, List[str]]] = {}
+        self._by_address: Dict[str, str] = {}
+        self._by_domain: Dict[str, str] = {}
+
+        for name, entry in providers.items():
+            senders = [s.strip().lower() for s in entry.get('senders', []) if s and s.strip()]
+            domains = [d.strip().lower().lstrip('@.') for d in entry.get('domains', []) if d and d.strip()]
+            self.providers[name] = {'senders': senders, 'domains': domains}
+            for address in senders:
+                self._index(self._by_address, address, name)
+            for domain in domains:
+                self._index(self._by_domain, domain, name)
+
+    @staticmethod
+    def _index(index: Dict[str, str], key: str, name: str) -> None:
+        if index.setdefault(key, name) != name:
+            logger.warning(f"'{key}' cadastrado para {index[key]} e {name}; mantido {index[key]}")
+
+    @classmethod
+    def from_file(cls, path: str) -> 'ProviderRegistry':
+        """Carrega os provedores de um JSON no formato de DEFAULT_PROVIDERS."""
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def resolve_match(self, sender: str) -> Optional[Dict[str, Any]]:
+        """
+        Resolve o remetente, informando como foi reconhecido.
+
+        Args:
+            sender: Header `From` ou endereço
+
+        Returns:
+            Dict com 'provider', 'address' e 'match' ('address', 'plus' ou 'domain'), ou None
+        """
+        address = parse_address(sender)
+        if not address:
+            return None
+
+        provider = self._by_address.get(address)
+        if provider:
+            return {'provider': provider, 'address': address, 'match': 'address'}
+
+        local, _, domain = address.rpartition('@')
+        if '+' in local:
+            provider = self._by_address.get(f"{local.split('+', 1)[0]}@{domain}")
+            if provider:
+                return {'provider': provider, 'address': address, 'match': 'plus'}
+
+        labels = domain.split('.')
+        for start in range(len(labels) - 1):
+            provider = self._by_domain.get('.'.join(labels[start:]))
+            if provider:
+                return {'provider': provider, 'address': address, 'match': 'domain'}
+        return None
+
+    def resolve(self, sender: str) -> Optional[str]:
+        """Nome do provedor do remetente, ou None."""
+        match = self.resolve_match(sender)
+        return match['provider'] if match else None
+
+    def names(self) -> List[str]:
+        """Provedores cadastrados."""
+        return list(self.providers)
+
+    def sender_map(self) -> Dict[str, List[str]]:
+        """Remetentes cadastrados por provedor (formato do antigo `ReceiptExtractor.ia_providers`)."""
+        return {name: list(entry['senders']) for name, entry in self.providers.items()}
+
+
+_registry: Optional[ProviderRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_provider_registry() -> ProviderRegistry:
+    """Retorna o registro compartilhado (PROVIDERS_CONFIG_PATH, ou os provedores padrão)."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            path = config.PROVIDERS_CONFIG_PATH
+            if path:
+                try:
+                    _registry = ProviderRegistry.from_file(path)
+                    logger.info(f"Provedores carregados de {path}: {len(_registry.providers)}")
+                except Exception as e:
+                    logger.error(f"Erro ao carregar provedores de {path}: {e}; usando os padrões")
+            if _registry is None:
+                _registry = ProviderRegistry(DEFAULT_PROVIDERS)
+        return _registry
@@ -0,0 +1,180 @@
+"""
+Rate limiting por token bucket para a Gmail API.
+
+O orçamento é medido em unidades de quota da Gmail API (não em requisições):
+cada método consome um número fixo de unidades e o limite por usuário é de
+250 unidades/segundo. Uma única instância compartilhada por processo faz com
+que varreduras concorrentes (threads, usuários diferentes) dividam o mesmo
+orçamento.
+"""
+
+from __future__ import annotations
+
+import random
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from config import config
+
+
+# Custo em unidades de quota de cada método usado (tabela oficial da Gmail API)
+GMAIL_QUOTA_UNITS: Dict[str, int] = {
+    'getProfile': 1,
+    'labels.list': 1,
+    'labels.create': 5,
+    'history.list': 2,
+    'messages.list': 5,
+    'messages.get': 5,
+    'messages.attachments.get': 5,
+    'messages.batchModify': 50,
+}
+
+# Status HTTP que justificam nova tentativa com backoff
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+
+class TokenBucketRateLimiter:
+    """Token bucket thread-safe com backoff exponencial com jitter."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+        Inicializa o limitador.
+
+        Args:
+            rate: Unidades repostas por segundo
+            capacity: Tamanho máximo do bucket (rajada); padrão = 1 segundo de taxa
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+        # Métricas
+        self._metrics = {
+            'requests': 0,
+            'units_consumed': 0,
+            'wait_seconds': 0.0,
+            'throttled_responses': 0,
+            'server_errors': 0,
+            'backoff_seconds': 0.0,
+        }
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._last_refill
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._last_refill = now
+
+    def acquire(self, units: float = 1) -> float:
+        """
+        Bloqueia até haver unidades disponíveis e as consome.
+
+        Pedidos maiores que a capacidade (ex.: batch de 100 mensagens) esperam o
+        bucket encher e deixam o saldo negativo, atrasando os próximos pedidos.
+
+        Args:
+            units: Unidades de quota a consumir
+
+        Returns:
+            Tempo total de espera em segundos
+        """
+        waited = 0.0
+        needed = min(float(units), self.capacity)
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+
+                if now < self._blocked_until:
+                    delay = self._blocked_until - now
+                elif self._tokens >= needed:
+                    self._tokens -= units
+                    self._metrics['requests'] += 1
+                    self._metrics['units_consumed'] += units
+                    self._metrics['wait_seconds'] += waited
+                    return waited
+                else:
+                    delay = (needed - self._tokens) / self.rate
+
+            time.sleep(delay)
+            waited += delay
+
+    def backoff(self, attempt: int, status: Optional[int] = None,
+                base: float = 1.0, cap: float = 60.0) -> float:
+        """
+        Calcula o atraso de backoff exponencial com jitter total e pausa o bucket.
+
+        A pausa vale para todas as threads que compartilham o limitador, para que
+        uma resposta 429 desacelere a varredura inteira e não só a chamada que falhou.
+
+        Args:
+            attempt: Número da tentativa (0 = primeira falha)
+            status: Status HTTP recebido (429 ou 5xx)
+            base: Atraso base em segundos
+            cap: Atraso máximo em segundos
+
+        Returns:
+            Atraso sorteado em segundos (o chamador deve dormir esse tempo)
+        """
+        delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+
+        with self._lock:
+            if status == 429:
+                self._metrics['throttled_responses'] += 1
+                self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+                self._tokens = min(self._tokens, 0.0)
+            elif status is not None:
+                self._metrics['server_errors'] += 1
+            self._metrics['backoff_seconds'] += delay
+
+        return delay
+
+    def configure(self, rate: Optional[float] = None, capacity: Optional[float] = None) -> None:
+        """Altera taxa e/ou capacidade em tempo de execução."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if rate:
+                self.rate = float(rate)
+            if capacity:
+                self.capacity = float(capacity)
+            self._tokens = min(self._tokens, self.capacity)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Retorna métricas acumuladas do limitador.
+
+        Returns:
+            Dicionário com contadores, taxa configurada e saldo atual do bucket
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            metrics = dict(self._metrics)
+            metrics.update({
+                'rate_units_per_second': self.rate,
+                'capacity_units': self.capacity,
+                'available_units': round(self._tokens, 2),
+                'blocked_for_seconds': round(max(0.0, self._blocked_until - time.monotonic()), 2),
+            })
+        metrics['wait_seconds'] = round(metrics['wait_seconds'], 3)
+        metrics['backoff_seconds'] = round(metrics['backoff_seconds'], 3)
+        return metrics
+
+
+_gmail_limiter: Optional[TokenBucketRateLimiter] = None
+_gmail_limiter_lock = threading.Lock()
+
+
+def get_gmail_rate_limiter() -> TokenBucketRateLimiter:
+    """Retorna o limitador compartilhado por todas as instâncias de GmailService."""
+    global _gmail_limiter
+    with _gmail_limiter_lock:
+        if _gmail_limiter is None:
+            _gmail_limiter = TokenBucketRateLimiter(
+                rate=config.GMAIL_QUOTA_UNITS_PER_SECOND,
+                capacity=config.GMAIL_QUOTA_BURST_UNITS,
+            )
+        return _gmail_limiter
@@ -8,9 +8,27 @@ dados de recibos de emails de provedores de IA como OpenAI, Anthropic, Cursor, e
 import re
 import time
 import logging
-from typing import Dict, Optional, List, Union, Tuple
+from functools import lru_cache
+from typing import Callable, Dict, FrozenSet, Optional, List, Union, Tuple
 from datetime import datetime
 
+from .provider_registry import get_provider_registry
+
+
+_DIGIT = re.compile(r'\d')
+
+
+@lru_cache(maxsize=64)
+def _compile_patterns(patterns: Tuple[str, ...]) -> Tuple[Tuple[str, re.Pattern], ...]:
+    """Compila uma lista de padrões uma vez por processo, mantendo a ordem de prioridade."""
+    return tuple((pattern, re.compile(pattern, re.IGNORECASE)) for pattern in patterns)
+
+
+@lru_cache(maxsize=64)
+def _lowercase_set(values: Tuple[str, ...]) -> FrozenSet[str]:
+    """Blacklist normalizada para consulta O(1)."""
+    return frozenset(value.lower() for value in values)
+
 
 class ReceiptExtractor:
     """
@@ -30,25 +48,9 @@ class ReceiptExtractor:
         self.timeout = timeout
         self.logger = logging.getLogger(__name__)
         
-        # Dicionário de provedores de IA com seus remetentes
-        self.ia_providers = {
-            'OpenAI': [
-                'noreply@openai.com',
-                'billing@openai.com'
-            ],
-            'Anthropic': [
-                'receipts@anthropic.com'
-            ],
-            'Cursor': [
-                'billing@cursor.com'
-            ],
-            'Manus': [
-                'invoice+statements+acct_1R15XBHkfKp4fCS9@stripe.com'
-            ],
-            'N8N': [
-                'help@paddle.com'
-            ]
-        }
+        # Provedores de IA (registro compartilhado) e seus remetentes
+        self.provider_registry = get_provider_registry()
+        self.ia_providers = self.provider_registry.sender_map()
         
         # Padrões regex robustos para extração de dados
         self.patterns = {
@@ -287,20 +289,16 @@ class ReceiptExtractor:
         """
         Identifica o provedor de IA baseado no email do remetente.
         
+        Aceita o header `From` completo; reconhece o endereço exato, o endereço
+        sem tag `+` e subdomínios do provedor (ver `services.provider_registry`).
+        
         Args:
-            sender_email: Email do remetente do recibo
+            sender_email: Email (ou header From) do remetente do recibo
             
         Returns:
             Nome do provedor identificado ou None se não encontrado
         """
-        sender_email = sender_email.lower().strip()
-        
-        for provider, emails in self.ia_providers.items():
-            for email in emails:
-                if sender_email == email.lower():
-                    return provider
-        
-        return None
+        return self.provider_registry.resolve(sender_email)
     
     def extract_receipt_data(self, email_data: Dict) -> Dict:
         """
@@ -341,15 +339,16 @@ class ReceiptExtractor:
             # Extrair dados básicos
             subject = email_data.get('subject', '')
             body = email_data.get('body', '')
+            text = f"{subject} {body}"
             
             # Extrair valor monetário
-            currency_value = self._extract_currency_value(subject + ' ' + body)
+            currency_value = self._extract_currency_value(text)
             
             # Extrair data
-            date_value = self._extract_date(subject + ' ' + body)
+            date_value = self._extract_date(text)
             
             # Extrair número do recibo
-            receipt_number = self._extract_receipt_number(subject + ' ' + body)
+            receipt_number = self._extract_receipt_number(text)
             
             # Identificar serviço (básico)
             service = self._identify_service(subject, body, provider)
@@ -387,9 +386,8 @@ class ReceiptExtractor:
         """
         monetary_values = []
         
-        for pattern in self.patterns['currency_values']:
-            matches = re.findall(pattern, text, re.IGNORECASE)
-            for match in matches:
+        for pattern, compiled in self._compiled_patterns('currency_values'):
+            for match in (m.group(1) for m in compiled.finditer(text)):
                 if self._is_valid_currency_value(match):
                     # Determinar moeda baseada no padrão
                     currency = self._extract_currency_symbol(pattern, match)
@@ -416,9 +414,8 @@ class ReceiptExtractor:
         """
         dates = []
         
-        for pattern in self.patterns['dates']:
-            matches = re.findall(pattern, text, re.IGNORECASE)
-            for match in matches:
+        for _, compiled in self._compiled_patterns('dates'):
+            for match in (m.group(1) for m in compiled.finditer(text)):
                 if self._is_valid_date(match):
                     # Normalizar formato da data
                     normalized_date = self._normalize_date(match)
@@ -445,9 +442,8 @@ class ReceiptExtractor:
         """
         receipt_numbers = []
         
-        for pattern in self.patterns['receipt_numbers']:
-            matches = re.findall(pattern, text, re.IGNORECASE)
-            for match in matches:
+        for pattern, compiled in self._compiled_patterns('receipt_numbers'):
+            for match in (m.group(1) for m in compiled.finditer(text)):
                 if self._is_valid_receipt_number(match):
                     # Determinar tipo baseado no padrão
                     receipt_type = self._extract_receipt_type(pattern)
@@ -461,25 +457,49 @@ class ReceiptExtractor:
         
         return receipt_numbers
     
+    def _compiled_patterns(self, field: str) -> Tuple[Tuple[str, re.Pattern], ...]:
+        """Padrões compilados de `self.patterns[field]` (cache compartilhado entre instâncias)."""
+        return _compile_patterns(tuple(self.patterns[field]))
+    
+    def _first_valid_match(self, field: str, text: str,
+                           is_valid: Callable[[str], bool]) -> Optional[Tuple[str, str]]:
+        """
+        Primeira ocorrência válida de um campo, na ordem de prioridade dos padrões.
+        
+        Mesmo resultado que o primeiro item de `extract_monetary_values`/`extract_dates`/
+        `extract_receipt_numbers`, sem montar as listas: cada padrão para na primeira
+        ocorrência válida e os seguintes (inclusive os genéricos, como `(\\d{4,12})`,
+        que casam com quase todo token de um HTML) só rodam se os anteriores falharem.
+        
+        Returns:
+            Tupla (padrão, valor) ou None
+        """
+        for pattern, compiled in self._compiled_patterns(field):
+            for match in compiled.finditer(text):
+                value = match.group(1)
+                if is_valid(value):
+                    return pattern, value
+        return None
+    
     def _extract_currency_value(self, text: str) -> Optional[str]:
         """Extrai valor monetário do texto (método legado)."""
-        values = self.extract_monetary_values(text)
-        if values:
-            return values[0]['formatted']
+        hit = self._first_valid_match('currency_values', text, self._is_valid_currency_value)
+        if hit:
+            pattern, value = hit
+            return f"{self._extract_currency_symbol(pattern, value)}{value}"
         return None
     
     def _extract_date(self, text: str) -> Optional[str]:
         """Extrai data do texto (método legado)."""
-        dates = self.extract_dates(text)
-        if dates:
-            return dates[0]['formatted']
-        return None
+        hit = self._first_valid_match('dates', text, self._is_valid_date)
+        return hit[1] if hit else None
     
     def _extract_receipt_number(self, text: str) -> Optional[str]:
         """Extrai número do recibo do texto (método legado)."""
-        numbers = self.extract_receipt_numbers(text)
-        if numbers:
-            return numbers[0]['formatted']
+        hit = self._first_valid_match('receipt_numbers', text, self._is_valid_receipt_number)
+        if hit:
+            pattern, value = hit
+            return self._format_receipt_number(self._extract_receipt_type(pattern), value)
         return None
     
     def _identify_service(self, subject: str, body: str, provider: str) -> str:
@@ -543,7 +563,7 @@ class ReceiptExtractor:
             return False
         
         # Verificar blacklist
-        if value.lower() in [v.lower() for v in self.blacklist_values['currency']]:
+        if value.lower() in _lowercase_set(tuple(self.blacklist_values['currency'])):
             return False
         
         # Verificar se é um número válido
@@ -573,7 +593,7 @@ class ReceiptExtractor:
             return False
         
         # Verificar blacklist
-        if date_str.lower() in [d.lower() for d in self.blacklist_values['dates']]:
+        if date_str.lower() in _lowercase_set(tuple(self.blacklist_values['dates'])):
             return False
         
         try:
@@ -602,7 +622,7 @@ class ReceiptExtractor:
             return False
         
         # Verificar blacklist
-        if number.lower() in [n.lower() for n in self.blacklist_values['receipt_numbers']]:
+        if number.lower() in _lowercase_set(tuple(self.blacklist_values['receipt_numbers'])):
             return False
         
         # Verificar comprimento mínimo
@@ -610,7 +630,7 @@ class ReceiptExtractor:
             return False
         
         # Verificar se contém pelo menos um dígito
-        if not re.search(r'\d', number):
+        if not _DIGIT.search(number):
             return False
         
         return True
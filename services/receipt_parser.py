@@ -2,7 +2,8 @@
 Parser simples para extrair dados estruturados de recibos em PT/EN.
 
 Regras:
-- Detecção de idioma: heurística por palavras‑chave (PT/EN) e meses.
+- Detecção de idioma: heurística por palavras‑chave (PT/EN) e meses, contadas em uma
+  única varredura (`scan_keywords`, compartilhada com o filtro do encaminhador).
 - Valor: suporta R$, US$, $, EUR, €, BRL, USD, EUR e formatos 1.234,56 ou 1,234.56.
 - Número de recibo: padrões comuns como #XXXX-XXXX-XXXX, n.º XXXX-XXXX, INV-XXXX, etc.
 """
@@ -10,7 +11,7 @@ Regras:
 from __future__ import annotations
 
 import re
-from typing import Optional, Tuple, Dict, Any
+from typing import Optional, Tuple, Dict, Any, List
 
 
 PT_KEYWORDS = [
@@ -26,22 +27,144 @@ EN_KEYWORDS = [
 PT_MONTHS = r"janeiro|fevereiro|mar[çc]o|abril|maio|junho|julho|agosto|setembro|outubro|novembro|dezembro"
 EN_MONTHS = r"january|february|march|april|may|june|july|august|september|october|november|december"
 
+# Palavras que indicam recibo/fatura (filtro do encaminhador; busca por substring)
+RECEIPT_KEYWORDS = [
+    'invoice', 'recibo', 'fatura', 'bill', 'receipt',
+    'billing', 'payment', 'pagamento', 'cobranca',
+    'subscription', 'assinatura', 'usage', 'uso'
+]
+
+
+def _expand_literals(pattern: str) -> List[str]:
+    """Expande um padrão simples (literais, [classes] e `\\.?`) em todas as suas formas literais."""
+    variants = [""]
+    for token in re.findall(r"\[[^\]]+\]|\\\.\?|\\.|.", pattern):
+        if token.startswith("["):
+            options = list(token[1:-1])
+        elif token == r"\.?":
+            options = ["", "."]
+        elif token.startswith("\\"):
+            options = [token[1]]
+        else:
+            options = [token]
+        variants = [variant + option for variant in variants for option in options]
+    return variants
+
+
+def _trie_regex(words: List[str]) -> str:
+    """Alternação em forma de trie: um ramo por letra inicial, opcionais gulosos (casa a mais longa)."""
+    trie: Dict[str, Any] = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node: Dict[str, Any]) -> str:
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            body = (f"(?:{body})" if len(branches) == 1 else body) + "?"
+        return body
+
+    return build(trie)
+
+
+def _build_keyword_automaton():
+    """
+    Monta o casador único de `scan_keywords`.
+
+    Todas as formas literais das palavras-chave, meses e palavras de recibo viram
+    uma alternação em trie (casa sempre a mais longa); a varredura recomeça uma
+    posição após cada início, então acha também ocorrências sobrepostas. Em cada
+    posição, as demais palavras que começam ali são exatamente os prefixos da mais longa.
+    """
+    groups: Dict[str, List[Tuple[str, str]]] = {}
+    for kind, patterns in (
+        ("pt", PT_KEYWORDS), ("en", EN_KEYWORDS),
+        ("pt_month", PT_MONTHS.split("|")), ("en_month", EN_MONTHS.split("|")),
+        ("receipt", RECEIPT_KEYWORDS),
+    ):
+        for pattern in patterns:
+            for literal in _expand_literals(pattern):
+                groups.setdefault(literal, []).append((kind, pattern))
+
+    literals = sorted(groups, key=len, reverse=True)
+    prefixes = {
+        literal: [(other, kind, pattern) for other in literals if literal.startswith(other)
+                  for kind, pattern in groups[other]]
+        for literal in literals
+    }
+    regex = re.compile(_trie_regex(literals))
+    return regex, prefixes
+
+
+_KEYWORD_REGEX, _KEYWORD_PREFIXES = _build_keyword_automaton()
+
+
+def scan_keywords(text: str) -> Dict[str, Any]:
+    """Classifica o texto em uma única varredura linear.
+
+    Returns: dict com 'pt_keywords' e 'en_keywords' (padrões de PT_KEYWORDS/EN_KEYWORDS
+    encontrados), 'pt_months' e 'en_months' (ocorrências, contadas como em `re.findall`)
+    e 'receipt_keywords' (palavras de RECEIPT_KEYWORDS encontradas)
+    """
+    found: Dict[str, set] = {"pt": set(), "en": set(), "receipt": set()}
+    months_end = {"pt_month": 0, "en_month": 0}
+    months = {"pt_month": 0, "en_month": 0}
+    lowered = (text or "").lower()
+    search = _KEYWORD_REGEX.search
+    m = search(lowered)
+    while m:
+        start = m.start()
+        for literal, kind, pattern in _KEYWORD_PREFIXES[m.group()]:
+            if kind in months:
+                # Meses: ocorrências sem sobreposição, como no findall da alternação
+                if start >= months_end[kind]:
+                    months[kind] += 1
+                    months_end[kind] = start + len(literal)
+            else:
+                found[kind].add(pattern)
+        m = search(lowered, start + 1)
+    return {
+        "pt_keywords": found["pt"],
+        "en_keywords": found["en"],
+        "pt_months": months["pt_month"],
+        "en_months": months["en_month"],
+        "receipt_keywords": found["receipt"],
+    }
+
 
-def detect_language(text: str) -> str:
+def count_keyword_hits(text: str) -> int:
+    """Número de ocorrências (sem sobreposição) de palavras-chave, meses e palavras de recibo."""
+    return len(_KEYWORD_REGEX.findall((text or "").lower()))
+
+
+def detect_language(text: str, keyword_hits: Optional[Dict[str, Any]] = None) -> str:
     """Detecta idioma PT/EN por heurística simples.
 
+    `keyword_hits` reaproveita um `scan_keywords` já feito sobre o mesmo texto.
+
     Returns: "pt" | "en"
     """
-    t = (text or "").lower()
-    pt_score = len(re.findall(PT_MONTHS, t)) + sum(1 for k in PT_KEYWORDS if re.search(k, t))
-    en_score = len(re.findall(EN_MONTHS, t)) + sum(1 for k in EN_KEYWORDS if re.search(k, t))
+    hits = keyword_hits if keyword_hits is not None else scan_keywords(text)
+    pt_score = hits["pt_months"] + len(hits["pt_keywords"])
+    en_score = hits["en_months"] + len(hits["en_keywords"])
     return "pt" if pt_score >= en_score else "en"
 
 
+# O valor é consumido por inteiro (sem centavos ou com separador de milhar), nunca um pedaço
+# dele: "$1,000" é 1000, e não 1,00. Depois da moeda aceita inteiro solto ("R$ 20"); antes da
+# moeda exige separador, para não tomar anos e quantidades por valor.
+_AMOUNT_WITH_SEPARATOR = r"\d{1,3}(?:[\.,]\d{3})+(?:[\.,]\d{1,2})?|\d+[\.,]\d{1,2}"
+_AMOUNT_END = r"(?![\.,]?\d)"
+
 _CURRENCY_PATTERNS = [
     # Símbolos e códigos antes/depois
-    r"(?P<currency>R\$|US\$|\$|USD|BRL|EUR|€)\s*(?P<amount>\d{1,3}(?:[\.,]\d{3})*[\.,]\d{2})",
-    r"(?P<amount>\d{1,3}(?:[\.,]\d{3})*[\.,]\d{2})\s*(?P<currency>R\$|US\$|\$|USD|BRL|EUR|€)",
+    rf"(?P<currency>R\$|US\$|\$|USD|BRL|EUR|€)\s*(?P<amount>{_AMOUNT_WITH_SEPARATOR}|\d+){_AMOUNT_END}",
+    rf"(?<![\d\.,])(?P<amount>{_AMOUNT_WITH_SEPARATOR}){_AMOUNT_END}\s*(?P<currency>R\$|US\$|\$|USD|BRL|EUR|€)",
 ]
 
 
@@ -56,12 +179,15 @@ def _normalize_amount_str(amount_str: str, currency: str) -> float:
             s = s.replace(".", "").replace(",", ".")
         else:
             s = s.replace(",", "")
-    elif "," in s and "." not in s:
-        # Formato brasileiro 1.234,56 -> trocar vírgula por ponto
-        s = s.replace(".", "").replace(",", ".")
     else:
-        # Formato 1,234.56 -> remover vírgulas de milhar
-        s = s.replace(",", "")
+        sep = "," if "," in s else "."
+        head, _, tail = s.rpartition(sep)
+        # Um só tipo de separador: milhar se repetido ou seguido de 3 dígitos (1,000 / 2.500 / 1.000.000),
+        # decimal se seguido de 1-2 dígitos (20,00 / 20.5); "0.125" continua decimal
+        if s.count(sep) > 1 or (head and len(tail) == 3 and head != "0"):
+            s = s.replace(sep, "")
+        else:
+            s = s.replace(sep, ".")
     try:
         return float(s)
     except Exception:
@@ -84,8 +210,29 @@ def extract_amount(text: str) -> Optional[Tuple[float, str, str]]:
     return None
 
 
+def extract_amounts(text: str) -> List[Tuple[float, str, str]]:
+    """Extrai todos os valores monetários, na ordem em que aparecem.
+
+    Returns: lista de (valor, moeda, linha onde o valor aparece)
+    """
+    t = text or ""
+    found: List[Tuple[int, float, str, str]] = []
+    seen = set()
+    for pat in _CURRENCY_PATTERNS:
+        for m in re.finditer(pat, t, flags=re.IGNORECASE):
+            if m.start("amount") in seen:
+                continue
+            seen.add(m.start("amount"))
+            currency = m.group("currency").upper().replace("US$", "USD").replace("R$", "BRL").replace("€", "EUR").replace("$", "USD")
+            line_start = t.rfind("\n", 0, m.start()) + 1
+            line_end = t.find("\n", m.end())
+            line = t[line_start:line_end if line_end != -1 else len(t)]
+            found.append((m.start(), _normalize_amount_str(m.group("amount"), currency), currency, line))
+    return [(value, currency, line) for _, value, currency, line in sorted(found)]
+
+
 _INVOICE_PATTERNS = [
-    r"(#|n\.?º|n\.?o|no\.|nf\.|inv[-\s]?)\s*([A-Z]{0,4}-?\d{3,6}(?:-\d{2,6}){0,3})",
+    r"(#|\bn\.?º|\bn\.?o|\bno\.|\bnf\.|\binv[-\s]?)\s*([A-Z]{0,4}-?\d{3,6}(?:-\d{2,6}){0,3})",
     r"\bINV[-_ ]?\d{3,8}\b",
     r"\b\d{3,6}-\d{2,6}-\d{2,6}\b",
 ]
@@ -102,13 +249,40 @@ def extract_invoice_number(text: str) -> Optional[str]:
     return None
 
 
-def parse_receipt_basic(subject: str, body: str) -> Dict[str, Any]:
+# Só números precedidos de um rótulo (invoice/receipt/recibo/fatura, #, nº, INV-); o código tem um dígito
+_LABELLED_INVOICE_PATTERNS = [
+    r"\b(?:invoice|receipt|recibo|fatura)(?:\s+(?:number|no\.?|n[úu]mero|n\.?º))?[\s:#-]*(?=[A-Z-]*\d)([A-Z0-9]+(?:-[A-Z0-9]+)*)",
+    r"#\s*(?=[A-Z-]*\d)([A-Z0-9]+(?:-[A-Z0-9]+)*)",
+    r"\bn\.?º\s*(?=[A-Z-]*\d)([A-Z0-9]+(?:-[A-Z0-9]+)*)",
+    r"\b(INV[-_ ]?\d{3,8})\b",
+]
+_HEX_COLOR = re.compile(r"[0-9a-f]{3}|[0-9a-f]{6}", re.IGNORECASE)
+
+
+def extract_labelled_invoice_number(text: str) -> Optional[str]:
+    """Extrai o número de recibo só quando vem rotulado (mais estrito que `extract_invoice_number`).
+
+    Ignora números soltos (anos, datas, planos) e cores HTML como #333333.
+    """
+    t = text or ""
+    for pat in _LABELLED_INVOICE_PATTERNS:
+        for m in re.finditer(pat, t, flags=re.IGNORECASE):
+            value = m.group(1)
+            if len(value) < 3 or (pat.startswith("#") and _HEX_COLOR.fullmatch(value)):
+                continue
+            return value
+    return None
+
+
+def parse_receipt_basic(subject: str, body: str, keyword_hits: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """Extrai idioma, valor e número de recibo de subject/body.
 
+    `keyword_hits` reaproveita um `scan_keywords(f"{subject}\\n{body}")` já feito.
+
     Retorna dict com: language, amount, currency, amount_match, invoice_number
     """
     combined = f"{subject}\n{body}"
-    lang = detect_language(combined)
+    lang = detect_language(combined, keyword_hits)
     amt = extract_amount(combined)
     inv = extract_invoice_number(combined)
 
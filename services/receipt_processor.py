@@ -2,10 +2,19 @@
 Serviço para processamento e extração de dados de recibos de IA com auto-correção.
 """
 
+import asyncio
 import json
 import re
-from typing import Dict, Any, List, Tuple, Optional
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, ContextManager, Dict, List, Optional, Tuple
+from config import config
 from services.llm_service import LLMService
+from services.llm_cache import get_llm_cache, make_cache_key
+from services.receipt_extractor import ReceiptExtractor
+from services.receipt_parser import extract_amounts, extract_labelled_invoice_number
+from services.receipt_segmenter import segment_receipt
 from prompts.receipt_prompts import ReceiptPrompts
 
 
@@ -21,19 +30,84 @@ class ReceiptProcessor:
         """
         self.llm_service = llm_service
         self.prompts = ReceiptPrompts()
+        
+        # Cache persistente de extrações (provedor + versão do prompt + texto normalizado)
+        self.response_cache = None
+        if config.LLM_CACHE_ENABLED:
+            self.response_cache = get_llm_cache(
+                config.LLM_CACHE_PATH, config.LLM_CACHE_TTL_HOURS * 3600, config.LLM_CACHE_MAX_ENTRIES
+            )
+        
+        # Camada determinística (regex) antes da LLM
+        self.receipt_extractor = ReceiptExtractor()
+        self.fast_path_enabled = config.RECEIPT_FAST_PATH_ENABLED
+        self.fast_path_min_confidence = config.RECEIPT_FAST_PATH_MIN_CONFIDENCE
+        
+        # Métricas por camada de extração
+        self._stats_lock = threading.Lock()
+        self._tier_stats = {tier: {"count": 0, "seconds": 0.0} for tier in ("deterministic", "cache", "llm")}
+        self._llm_calls = 0
     
-    def extract_receipt_data(self, receipt_text: str, provider: str = "auto", max_attempts: int = 3) -> Dict[str, Any]:
+    def extract_receipt_data(self, receipt_text: str, provider: str = "auto", max_attempts: int = 3,
+                             sender: Optional[str] = None, subject: str = "",
+                             llm_slot: Optional[Callable[[str], ContextManager]] = None) -> Dict[str, Any]:
         """
-        Extrai dados de recibo com auto-correção baseada em validação.
+        Extrai dados de recibo em camadas: regex -> cache -> LLM com auto-correção.
+        
+        Recibos de provedores conhecidos cujo parse determinístico preenche todos os
+        campos obrigatórios com confiança alta não chegam à LLM. Recibos já extraídos
+        (mesmo provedor, versão de prompt e texto normalizado) vêm do cache. A camada
+        que produziu o resultado fica em `extraction_tier`.
         
         Args:
             receipt_text: Texto do recibo para processar
             provider: Provedor da LLM ('auto', 'openai' ou 'zello')
             max_attempts: Número máximo de tentativas
+            sender: Remetente do e-mail (identifica o provedor do recibo)
+            subject: Assunto do e-mail
+            llm_slot: Recebe o provedor de LLM efetivo e devolve um context manager mantido só
+                durante as chamadas à LLM (ex.: `JobEngine.llm_slot`, limite por provedor)
             
         Returns:
             Dicionário com resultado da extração
         """
+        started = time.perf_counter()
+        result, cache_key = self._pre_llm_tiers(receipt_text, provider, sender, subject, started)
+        if result is not None:
+            return result
+        
+        if llm_slot is None:
+            result = self._run_extraction(receipt_text, provider, max_attempts)
+        else:
+            with llm_slot(self.llm_service.resolve_provider(provider)):
+                result = self._run_extraction(receipt_text, provider, max_attempts)
+        return self._finish_llm_tier(result, cache_key, started)
+    
+    def _pre_llm_tiers(self, receipt_text: str, provider: str, sender: Optional[str], subject: str,
+                       started: float) -> Tuple[Optional[Dict[str, Any]], str]:
+        """Tenta as camadas sem LLM (determinística e cache); devolve (resultado ou None, chave do cache)."""
+        fast = self._deterministic_extraction(receipt_text, sender, subject)
+        if fast["success"]:
+            self._record_tier("deterministic", started)
+            return fast, ""
+        
+        cache_key = make_cache_key(provider, self.prompts.PROMPT_VERSION, receipt_text)
+        cached = self._cached_result(cache_key)
+        if cached is not None:
+            cached["extraction_tier"] = "cache"
+            self._record_tier("cache", started)
+            return cached, cache_key
+        
+        return None, cache_key
+    
+    def _finish_llm_tier(self, result: Dict[str, Any], cache_key: str, started: float) -> Dict[str, Any]:
+        result["extraction_tier"] = "llm"
+        self._store_result(cache_key, result)
+        self._record_tier("llm", started)
+        return result
+    
+    def _run_extraction(self, receipt_text: str, provider: str, max_attempts: int) -> Dict[str, Any]:
+        """Executa o ciclo extração -> validação -> correção na LLM."""
         attempts = []
         
         for attempt in range(max_attempts):
@@ -84,6 +158,246 @@ class ReceiptProcessor:
             "final_validation": validation_result
         }
     
+    async def aextract_receipt_data(self, receipt_text: str, provider: str = "auto", max_attempts: int = 3,
+                                    client=None, sender: Optional[str] = None, subject: str = "") -> Dict[str, Any]:
+        """
+        Versão assíncrona de `extract_receipt_data` (mesmo fluxo de auto-correção).
+        
+        Args:
+            receipt_text: Texto do recibo para processar
+            provider: Provedor da LLM ('auto', 'openai' ou 'zello')
+            max_attempts: Número máximo de tentativas
+            client: Cliente httpx compartilhado entre recibos (opcional)
+            sender: Remetente do e-mail
+            subject: Assunto do e-mail
+            
+        Returns:
+            Dicionário com resultado da extração
+        """
+        started = time.perf_counter()
+        result, cache_key = self._pre_llm_tiers(receipt_text, provider, sender, subject, started)
+        if result is not None:
+            return result
+        
+        result = await self._arun_extraction(receipt_text, provider, max_attempts, client)
+        return self._finish_llm_tier(result, cache_key, started)
+    
+    async def _arun_extraction(self, receipt_text: str, provider: str, max_attempts: int,
+                               client=None) -> Dict[str, Any]:
+        """Versão assíncrona de `_run_extraction`."""
+        attempts = []
+        validation_result = None
+        
+        for attempt in range(max_attempts):
+            generation_result = await self._agenerate_extraction(receipt_text, provider, client)
+            if not generation_result["success"]:
+                return generation_result
+            
+            validation_result = await self._avalidate_extraction(
+                generation_result["content"], receipt_text, provider, client
+            )
+            if not validation_result["success"]:
+                return validation_result
+            
+            attempts.append({
+                "attempt": attempt + 1,
+                "generation": generation_result,
+                "validation": validation_result
+            })
+            
+            if validation_result["is_approved"]:
+                return {
+                    "success": True,
+                    "extracted_data": self._parse_extracted_json(generation_result["content"]),
+                    "raw_response": generation_result["content"],
+                    "provider": provider,
+                    "attempts": attempts,
+                    "final_validation": validation_result,
+                    "auto_correction_used": attempt > 0
+                }
+            
+            if attempt < max_attempts - 1:
+                receipt_text = self._update_prompt_with_feedback(receipt_text, validation_result["feedback"])
+        
+        return {
+            "success": False,
+            "error": f"Não foi possível extrair dados adequados após {max_attempts} tentativas",
+            "provider": provider,
+            "attempts": attempts,
+            "final_validation": validation_result
+        }
+    
+    async def aextract_receipts_batch(self, receipt_texts: List[str], provider: str = "auto",
+                                      max_attempts: int = 3, concurrency: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Extrai vários recibos em paralelo, com número limitado de recibos simultâneos.
+        
+        Args:
+            receipt_texts: Textos dos recibos
+            provider: Provedor da LLM
+            max_attempts: Tentativas de auto-correção por recibo
+            concurrency: Recibos simultâneos (padrão: LLM_ASYNC_CONCURRENCY)
+            
+        Returns:
+            Resultados na mesma ordem dos textos
+        """
+        limit = max(1, concurrency or self.llm_service.async_concurrency)
+        semaphore = asyncio.Semaphore(limit)
+        
+        async with self.llm_service.async_client(limit) as client:
+            async def _one(text: str) -> Dict[str, Any]:
+                async with semaphore:
+                    try:
+                        return await self.aextract_receipt_data(text, provider, max_attempts, client)
+                    except Exception as e:
+                        return {"success": False, "error": f"Erro na extração: {str(e)}", "provider": provider}
+            
+            return await asyncio.gather(*(_one(t) for t in receipt_texts))
+    
+    def extract_receipts_batch(self, receipt_texts: List[str], provider: str = "auto",
+                               max_attempts: int = 3, concurrency: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Wrapper síncrono de `aextract_receipts_batch` (não chamar de dentro de um event loop)."""
+        return asyncio.run(self.aextract_receipts_batch(receipt_texts, provider, max_attempts, concurrency))
+    
+    def _deterministic_extraction(self, receipt_text: str, sender: Optional[str], subject: str) -> Dict[str, Any]:
+        """
+        Camada determinística: preenche os campos obrigatórios de `Recibo` só com regex.
+        
+        A confiança soma pontos por campo (plataforma pelo remetente 25 / pelo texto 15,
+        valor 25, moeda 10, data 20 / ambígua 10, número do recibo 20). Só é aceita quando
+        o remetente é de um provedor conhecido, todos os campos existem e a soma atinge
+        RECEIPT_FAST_PATH_MIN_CONFIDENCE; o provedor citado só no texto conta pontos,
+        mas não dispensa a LLM.
+        
+        Returns:
+            Resultado no formato de `extract_receipt_data` ({'success': False, ...} se não confiável)
+        """
+        if not self.fast_path_enabled:
+            return {"success": False, "confidence": 0, "missing": []}
+        
+        text = f"{subject}\n{receipt_text}" if subject else (receipt_text or "")
+        confidence = 0
+        data: Dict[str, Any] = {"plataforma": None, "valor": None, "moeda": None,
+                                "data_emissao": None, "numero_recibo": None}
+        
+        # Plataforma: remetente conhecido; senão, um único provedor citado no texto
+        sender_platform = self.receipt_extractor.identify_provider(sender) if sender else None
+        platform = sender_platform
+        if platform:
+            confidence += 25
+        else:
+            lowered = text.lower()
+            named = [p for p in self.receipt_extractor.get_supported_providers()
+                     if re.search(rf"\b{re.escape(p.lower())}\b", lowered)]
+            if len(named) == 1:
+                platform = named[0]
+                confidence += 15
+        data["plataforma"] = platform
+        
+        # Valor: único valor distinto ou o valor da linha de total
+        amounts = extract_amounts(text)
+        distinct = {(value, currency) for value, currency, _ in amounts if value > 0}
+        chosen = None
+        if len(distinct) == 1:
+            chosen = next(iter(distinct))
+        elif distinct:
+            total_lines = [(v, c) for v, c, line in amounts
+                           if v > 0 and re.search(r"\b(total|amount paid|valor pago|total pago)\b", line, re.IGNORECASE)]
+            if len(set(total_lines)) == 1:
+                chosen = total_lines[0]
+        if chosen:
+            data["valor"], data["moeda"] = chosen
+            confidence += 35
+        
+        # Data de emissão (DD-MM-YYYY, como no prompt de extração)
+        for item in self.receipt_extractor.extract_dates(text):
+            try:
+                parsed = datetime.strptime(item["date"], "%Y-%m-%d")
+            except ValueError:
+                continue
+            data["data_emissao"] = parsed.strftime("%d-%m-%Y")
+            parts = re.findall(r"\d+", item["formatted"])
+            ambiguous = (not re.search(r"[A-Za-z]", item["formatted"]) and len(parts) == 3
+                         and len(parts[0]) <= 2 and int(parts[0]) <= 12 and int(parts[1]) <= 12
+                         and parts[0] != parts[1])
+            confidence += 10 if ambiguous else 20
+            break
+        
+        # Número do recibo: só rotulado (números soltos podem ser ano, plano ou data)
+        data["numero_recibo"] = extract_labelled_invoice_number(text)
+        if data["numero_recibo"]:
+            confidence += 20
+        
+        data["confianca"] = confidence
+        missing = [field for field in ("plataforma", "valor", "moeda", "data_emissao", "numero_recibo") if not data[field]]
+        if missing or confidence < self.fast_path_min_confidence or not sender_platform:
+            return {"success": False, "confidence": confidence, "missing": missing,
+                    "known_sender": bool(sender_platform)}
+        
+        return {
+            "success": True,
+            "extracted_data": data,
+            "raw_response": None,
+            "provider": "deterministic",
+            "attempts": [],
+            "auto_correction_used": False,
+            "extraction_tier": "deterministic",
+            "confidence": confidence
+        }
+    
+    def _count_llm_call(self) -> None:
+        with self._stats_lock:
+            self._llm_calls += 1
+    
+    def _record_tier(self, tier: str, started: float) -> None:
+        with self._stats_lock:
+            self._tier_stats[tier]["count"] += 1
+            self._tier_stats[tier]["seconds"] += time.perf_counter() - started
+    
+    def get_tier_stats(self) -> Dict[str, Any]:
+        """
+        Retorna quantos recibos cada camada resolveu e a economia estimada de chamadas/latência.
+        
+        Returns:
+            Dicionário com contagem, latência média por camada e economia estimada
+        """
+        with self._stats_lock:
+            tiers = {tier: dict(values) for tier, values in self._tier_stats.items()}
+            llm_calls = self._llm_calls
+        
+        for values in tiers.values():
+            values["avg_seconds"] = round(values["seconds"] / values["count"], 4) if values["count"] else 0.0
+            values["seconds"] = round(values["seconds"], 3)
+        
+        llm_count = tiers["llm"]["count"]
+        calls_per_llm = llm_calls / llm_count if llm_count else 0.0
+        avoided = tiers["deterministic"]["count"] + tiers["cache"]["count"]
+        seconds_saved = sum(
+            tiers[tier]["count"] * max(0.0, tiers["llm"]["avg_seconds"] - tiers[tier]["avg_seconds"])
+            for tier in ("deterministic", "cache")
+        )
+        return {
+            "tiers": tiers,
+            "llm_calls": llm_calls,
+            "llm_calls_per_extraction": round(calls_per_llm, 2),
+            "estimated_llm_calls_saved": round(avoided * calls_per_llm, 1),
+            "estimated_seconds_saved": round(seconds_saved, 2),
+        }
+    
+    def _cached_result(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """Retorna a extração em cache (marcada com cache_hit) ou None."""
+        if not self.response_cache:
+            return None
+        cached = self.response_cache.get(cache_key)
+        if cached is not None:
+            cached["cache_hit"] = True
+        return cached
+    
+    def _store_result(self, cache_key: str, result: Dict[str, Any]) -> None:
+        """Grava no cache apenas extrações bem-sucedidas."""
+        if self.response_cache and result.get("success"):
+            self.response_cache.put(cache_key, result)
+    
     def _generate_extraction(self, receipt_text: str, provider: str) -> Dict[str, Any]:
         """
         Gera extração de dados usando LLM.
@@ -96,25 +410,11 @@ class ReceiptProcessor:
             Dicionário com resultado da geração
         """
         try:
-            # Gerar prompt para extração
-            prompt = self.prompts.extract_receipt_data(receipt_text)
-            
-            # Preparar mensagens para a LLM
-            messages = [
-                {
-                    "role": "system",
-                    "content": "Você é um especialista em análise de recibos de provedores de IA. Extraia os dados financeiros de forma estruturada e precisa seguindo rigorosamente as instruções fornecidas."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ]
-            
-            # Resolver provider com fallback automático
-            provider_call = provider if provider in ["openai", "zello"] else "auto"
+            prompt, messages = self._extraction_messages(receipt_text)
+            provider_call = self._resolve_provider(provider)
             
             # Chamar a LLM
+            self._count_llm_call()
             response = self.llm_service.get_completion(provider_call, messages)
             
             return {
@@ -131,6 +431,41 @@ class ReceiptProcessor:
                 "provider": provider
             }
     
+    async def _agenerate_extraction(self, receipt_text: str, provider: str, client=None) -> Dict[str, Any]:
+        """Versão assíncrona de `_generate_extraction`."""
+        try:
+            prompt, messages = self._extraction_messages(receipt_text)
+            provider_call = self._resolve_provider(provider)
+            self._count_llm_call()
+            response = await self.llm_service.aget_completion(provider_call, messages, client=client)
+            return {
+                "success": True,
+                "content": response,
+                "provider": provider_call,
+                "prompt_used": prompt
+            }
+        except Exception as e:
+            return {
+                "success": False,
+                "error": f"Erro na extração: {str(e)}",
+                "provider": provider
+            }
+    
+    def _extraction_messages(self, receipt_text: str) -> Tuple[str, List[Dict[str, str]]]:
+        """Monta o prompt de extração e as mensagens para a LLM."""
+        prompt = self.prompts.extract_receipt_data(receipt_text)
+        messages = [
+            {
+                "role": "system",
+                "content": "Você é um especialista em análise de recibos de provedores de IA. Extraia os dados financeiros de forma estruturada e precisa seguindo rigorosamente as instruções fornecidas."
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
+        return prompt, messages
+    
     def _validate_extraction(self, extracted_json: str, original_text: str, provider: str) -> Dict[str, Any]:
         """
         Valida dados extraídos usando LLM.
@@ -144,38 +479,30 @@ class ReceiptProcessor:
             Dicionário com resultado da validação
         """
         try:
-            # Gerar prompt para validação
-            prompt = self.prompts.analyze_receipt_quality(extracted_json)
-            
-            # Preparar mensagens para a LLM
-            messages = [
-                {
-                    "role": "system",
-                    "content": "Você é um validador especializado em dados de recibos de IA. Analise rigorosamente a qualidade da extração e forneça feedback detalhado."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ]
-            
-            # Resolver provider com fallback automático
-            provider_call = provider if provider in ["openai", "zello"] else "auto"
+            messages = self._validation_messages(extracted_json)
+            provider_call = self._resolve_provider(provider)
             
             # Chamar a LLM
+            self._count_llm_call()
             response = self.llm_service.get_completion(provider_call, messages)
+            return self._validation_result(response, provider_call)
             
-            # Analisar a resposta para determinar se foi aprovada
-            is_approved, feedback = self._analyze_validation_response(response)
-            
+        except Exception as e:
             return {
-                "success": True,
-                "is_approved": is_approved,
-                "feedback": feedback,
-                "full_response": response,
-                "provider": provider_call
+                "success": False,
+                "error": f"Erro na validação: {str(e)}",
+                "provider": provider
             }
-            
+    
+    async def _avalidate_extraction(self, extracted_json: str, original_text: str, provider: str,
+                                    client=None) -> Dict[str, Any]:
+        """Versão assíncrona de `_validate_extraction`."""
+        try:
+            messages = self._validation_messages(extracted_json)
+            provider_call = self._resolve_provider(provider)
+            self._count_llm_call()
+            response = await self.llm_service.aget_completion(provider_call, messages, client=client)
+            return self._validation_result(response, provider_call)
         except Exception as e:
             return {
                 "success": False,
@@ -183,6 +510,36 @@ class ReceiptProcessor:
                 "provider": provider
             }
     
+    def _validation_messages(self, extracted_json: str) -> List[Dict[str, str]]:
+        """Monta as mensagens de validação para a LLM."""
+        prompt = self.prompts.analyze_receipt_quality(extracted_json)
+        return [
+            {
+                "role": "system",
+                "content": "Você é um validador especializado em dados de recibos de IA. Analise rigorosamente a qualidade da extração e forneça feedback detalhado."
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
+    
+    def _validation_result(self, response: str, provider_call: str) -> Dict[str, Any]:
+        """Analisa a resposta de validação para determinar se foi aprovada."""
+        is_approved, feedback = self._analyze_validation_response(response)
+        return {
+            "success": True,
+            "is_approved": is_approved,
+            "feedback": feedback,
+            "full_response": response,
+            "provider": provider_call
+        }
+    
+    @staticmethod
+    def _resolve_provider(provider: str) -> str:
+        """Resolve provider com fallback automático."""
+        return provider if provider in ["openai", "zello"] else "auto"
+    
     def _analyze_validation_response(self, response: str) -> Tuple[bool, str]:
         """
         Analisa a resposta de validação para determinar aprovação.
@@ -380,24 +737,9 @@ class ReceiptProcessor:
             email_content: Conteúdo completo do email
             
         Returns:
-            Texto do recibo extraído
+            Blocos do email com mais cara de recibo (limitados a RECEIPT_SEGMENT_MAX_CHARS)
         """
-        # Padrões comuns para identificar recibos em emails
-        receipt_patterns = [
-            r"(?:invoice|recibo|fatura|bill|receipt).*?(?=\n\n|\n[A-Z]|$)",
-            r"(?:amount|valor|total|price|preço).*?(?=\n\n|\n[A-Z]|$)",
-            r"(?:date|data).*?(?=\n\n|\n[A-Z]|$)",
-            r"(?:openai|anthropic|cursor|manus|n8n).*?(?=\n\n|\n[A-Z]|$)"
-        ]
-        
-        # Procurar por padrões de recibo
-        for pattern in receipt_patterns:
-            matches = re.findall(pattern, email_content, re.IGNORECASE | re.DOTALL)
-            if matches:
-                return matches[0].strip()
-        
-        # Se não encontrar padrões específicos, retornar o conteúdo completo
-        return email_content.strip()
+        return segment_receipt(email_content)["text"]
     
     def get_processing_stats(self) -> Dict[str, Any]:
         """
@@ -410,5 +752,8 @@ class ReceiptProcessor:
             "service": "ReceiptProcessor",
             "llm_service_available": self.llm_service is not None,
             "prompts_available": self.prompts is not None,
-            "supported_providers": ["auto", "openai", "zello"]
+            "supported_providers": ["auto", "openai", "zello"],
+            "prompt_version": self.prompts.PROMPT_VERSION,
+            "response_cache": self.response_cache.get_stats() if self.response_cache else {"enabled": False},
+            "extraction_tiers": self.get_tier_stats()
         }
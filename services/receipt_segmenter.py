@@ -0,0 +1,142 @@
+"""
+Segmentação do email para localizar o recibo.
+
+Em vez de padrões `.*?` com lookahead sobre o email inteiro (backtracking em
+corpos HTML grandes, e só o primeiro trecho casado), o email é dividido em
+blocos em uma única passada pelas linhas: uma linha em branco fecha o bloco,
+assim como o limite de tamanho (o texto vindo de HTML não tem linhas em
+branco). Cada bloco recebe uma pontuação pela densidade de palavras de recibo
+e valores monetários, e os k melhores voltam na ordem original, dentro de um
+orçamento de caracteres. O custo é linear no tamanho do email (limitado a
+RECEIPT_SEGMENT_MAX_INPUT_CHARS) e o texto enviado à LLM fica limitado ao orçamento.
+"""
+
+from __future__ import annotations
+
+import heapq
+import html
+import re
+from typing import Any, Dict, List, Optional
+
+from config import config
+from .mime_parser import html_to_text
+from .receipt_parser import count_keyword_hits, extract_amounts
+
+_HTML_HINT = re.compile(r'<(?:html|body|div|table|tr|td|p|br|span)\b', re.IGNORECASE)
+# Sem '<' dentro da tag: um '<' sem fechamento não faz a busca varrer o resto do texto
+_TAG = re.compile(r'<[^<>]*>')
+
+# Valores monetários pesam mais que palavras-chave soltas
+AMOUNT_WEIGHT = 3
+# Suavização da densidade: blocos muito curtos não dominam com um único acerto
+DENSITY_SMOOTHING_CHARS = 200
+
+
+def split_blocks(text: str, block_max_chars: int) -> List[Dict[str, Any]]:
+    """
+    Divide o texto em blocos em uma passada pelas linhas.
+
+    Args:
+        text: Texto do email
+        block_max_chars: Tamanho a partir do qual o bloco é fechado
+
+    Returns:
+        Lista de dicts com 'index' e 'text', na ordem do email
+    """
+    blocks: List[Dict[str, Any]] = []
+    lines: List[str] = []
+    size = 0
+
+    def close() -> None:
+        nonlocal lines, size
+        if lines:
+            blocks.append({'index': len(blocks), 'text': '\n'.join(lines)})
+        lines = []
+        size = 0
+
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            close()
+            continue
+        # Linhas maiores que o bloco (HTML minificado sem quebras) viram fatias
+        while len(line) > block_max_chars:
+            close()
+            lines.append(line[:block_max_chars])
+            size = block_max_chars
+            close()
+            line = line[block_max_chars:]
+        if size + len(line) > block_max_chars:
+            close()
+        lines.append(line)
+        size += len(line) + 1
+    close()
+    return blocks
+
+
+def score_block(text: str) -> float:
+    """Densidade de palavras de recibo e valores monetários do bloco (acertos por 1000 caracteres)."""
+    hits = count_keyword_hits(text) + AMOUNT_WEIGHT * len(extract_amounts(text))
+    return hits * 1000.0 / (len(text) + DENSITY_SMOOTHING_CHARS)
+
+
+def segment_receipt(email_content: str, top_k: Optional[int] = None,
+                    max_chars: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Seleciona os trechos do email com mais cara de recibo.
+
+    Args:
+        email_content: Conteúdo do email (texto ou HTML)
+        top_k: Máximo de blocos (padrão: RECEIPT_SEGMENT_TOP_K)
+        max_chars: Orçamento de caracteres do resultado (padrão: RECEIPT_SEGMENT_MAX_CHARS)
+
+    Returns:
+        Dict com 'text' (blocos escolhidos, na ordem do email), 'blocks' (índice e
+        pontuação de cada bloco escolhido), 'total_blocks' e 'input_chars'
+    """
+    top_k = max(1, top_k or config.RECEIPT_SEGMENT_TOP_K)
+    max_chars = max(1, max_chars or config.RECEIPT_SEGMENT_MAX_CHARS)
+
+    text = (email_content or '')[:config.RECEIPT_SEGMENT_MAX_INPUT_CHARS]
+    if _HTML_HINT.search(text):
+        converted = html_to_text(text)
+        # Corpo só com conteúdo oculto/script: as tags removidas do HTML original
+        text = converted if converted.strip() else html.unescape(_TAG.sub('\n', text))
+
+    blocks = split_blocks(text, max(1, config.RECEIPT_SEGMENT_BLOCK_MAX_CHARS))
+    for block in blocks:
+        block['score'] = score_block(block['text'])
+
+    # Melhores pontuações primeiro; empate favorece o bloco que vem antes
+    ranked = heapq.nsmallest(top_k, (b for b in blocks if b['score'] > 0),
+                             key=lambda b: (-b['score'], b['index']))
+
+    chosen: List[Dict[str, Any]] = []
+    used = 0
+    for block in ranked:
+        cost = len(block['text']) + (2 if chosen else 0)
+        if used + cost > max_chars:
+            continue
+        chosen.append(block)
+        used += cost
+
+    if chosen:
+        chosen.sort(key=lambda b: b['index'])
+        selected = '\n\n'.join(b['text'] for b in chosen)
+    elif ranked:
+        # Nenhum bloco cabe inteiro: o melhor, cortado no orçamento
+        chosen = ranked[:1]
+        selected = ranked[0]['text'][:max_chars]
+    else:
+        # Sem nenhum sinal de recibo: o começo do email, dentro do orçamento
+        selected = '\n'.join(block['text'] for block in blocks)[:max_chars]
+    if not selected.strip():
+        # Nunca devolve vazio para um email com conteúdo
+        selected = (email_content or '').strip()[:max_chars]
+
+    return {
+        'text': selected,
+        'blocks': [{'index': b['index'], 'score': round(b['score'], 2)} for b in chosen],
+        'total_blocks': len(blocks),
+        'input_chars': len(email_content or ''),
+    }
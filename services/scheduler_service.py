@@ -7,21 +7,30 @@ import os
 import json
 import logging
 from datetime import datetime, timedelta
+from email.utils import parseaddr
 from typing import Dict, Any, List, Optional
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.interval import IntervalTrigger
 from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_ERROR
+from sqlalchemy.exc import IntegrityError
 
 from database import SessionLocal
 from models.receipt_models import ReceiptJob, Recibo, JobStatus
 from services.llm_service import LLMService
 from services.receipt_processor import ReceiptProcessor
 from services.gmail_service import GmailService
+from services.attachment_service import get_attachment_service
+from services.sync_state_store import GmailSyncStateStore
+from services.job_discovery import JobDiscoveryService
+from services.job_engine import JobEngine, parse_provider_limits
 from services.email_service import EmailService
 from config import config
 
 
+GEMINI_SENDER = 'gemini-noreply@google.com'
+
+
 class SchedulerService:
     """Serviço de agendamento para automação de recibos."""
     
@@ -37,6 +46,15 @@ class SchedulerService:
         self.llm_service = LLMService()
         self.receipt_processor = ReceiptProcessor(self.llm_service)
         self.email_service = EmailService()
+        self.sync_state_store = GmailSyncStateStore()
+        self.job_discovery = JobDiscoveryService()
+        self.job_engine = JobEngine(
+            process_job=self._process_single_job,
+            workers=config.JOB_WORKERS,
+            provider_limits=parse_provider_limits(config.JOB_PROVIDER_CONCURRENCY),
+            commit_batch=config.JOB_STATUS_COMMIT_BATCH,
+            claim_timeout_seconds=config.JOB_CLAIM_TIMEOUT_MINUTES * 60
+        )
         self.logger = self._setup_logger()
         
         # Configurar listeners de eventos
@@ -95,13 +113,15 @@ class SchedulerService:
                 replace_existing=True
             )
             
-            # Job 3: Processamento de jobs pendentes (a cada 2 horas)
+            # Job 3: Processamento de jobs pendentes (intervalo configurável)
             self.scheduler.add_job(
                 func=self._process_pending_jobs,
-                trigger=IntervalTrigger(hours=2),
+                trigger=IntervalTrigger(minutes=config.JOB_PROCESS_INTERVAL_MINUTES),
                 id='process_pending_jobs',
                 name='Processar Jobs Pendentes',
-                replace_existing=True
+                replace_existing=True,
+                max_instances=1,
+                coalesce=True
             )
             
             # Job 4: Relatório mensal (dia 1 às 9h)
@@ -181,7 +201,6 @@ class SchedulerService:
             return
         
         try:
-            session = SessionLocal()
             created_count = 0
             errors = []
             
@@ -190,47 +209,38 @@ class SchedulerService:
             
             for user in users:
                 try:
-                    # Buscar mensagens de recibos
-                    messages = self.gmail_service.list_gemini_messages(user, max_results=50)
-                    
-                    for msg in messages:
-                        msg_id = msg['id']
-                        
-                        # Verificar se já existe
-                        existing = session.query(ReceiptJob).filter_by(
-                            source_hash=msg_id
-                        ).first()
-                        
-                        if existing:
-                            continue
-                        
-                        # Obter detalhes da mensagem
-                        full_msg = self.gmail_service.get_message(user, msg_id)
-                        text = self.gmail_service.extract_plain_text(full_msg)
-                        
-                        # Criar job
-                        job = ReceiptJob(
-                            source_uri=f"gmail://{user}/{msg_id}",
-                            source_hash=msg_id,
-                            status=JobStatus.DISCOVERED,
-                            attempts=0,
-                            created_at=datetime.utcnow(),
-                            updated_at=datetime.utcnow(),
-                            collaborator_email=user
+                    # Buscar mensagens de recibos (delta via historyId quando habilitado)
+                    sync = None
+                    if config.GMAIL_INCREMENTAL_SYNC:
+                        start_date = datetime.now() - timedelta(days=config.GMAIL_SYNC_DAYS_BACK)
+                        sync = self.gmail_service.sync_message_ids(
+                            user,
+                            query=f"from:{GEMINI_SENDER} after:{start_date.strftime('%Y/%m/%d')}",
+                            state_store=self.sync_state_store,
+                            scope='gemini_jobs',
+                            senders=[GEMINI_SENDER],
+                            backfill_days=config.GMAIL_SYNC_DAYS_BACK
                         )
-                        
-                        session.add(job)
-                        created_count += 1
+                        messages = sync['messages']
+                        self.logger.info(f"🔄 Sincronização {sync['mode']} de {user}: {len(messages)} mensagens novas")
+                    else:
+                        messages = self.gmail_service.list_gemini_messages(user, max_results=50)
+                    
+                    # Deduplicação e insert em lote (uma transação por usuário)
+                    result = self.job_discovery.discover(user, [msg['id'] for msg in messages])
+                    created_count += result['created']
                     
-                    session.commit()
-                    self.logger.info(f"✅ Coletados {created_count} recibos do usuário {user}")
+                    if sync:
+                        self.gmail_service.commit_sync(user, sync, self.sync_state_store, scope='gemini_jobs')
+                    self.logger.info(
+                        f"✅ Coletados {result['created']} recibos do usuário {user} "
+                        f"({result['skipped']} já registrados, {result['timings']['total']}s)"
+                    )
                     
                 except Exception as e:
                     errors.append(f"Usuário {user}: {str(e)}")
                     self.logger.error(f"❌ Erro ao coletar de {user}: {str(e)}")
             
-            session.close()
-            
             # Enviar notificação se houver novos recibos
             if created_count > 0:
                 self._send_new_receipts_notification(created_count)
@@ -256,51 +266,17 @@ class SchedulerService:
             self.logger.error(f"❌ Erro na coleta de APIs: {str(e)}")
     
     def _process_pending_jobs(self):
-        """Processa jobs pendentes."""
+        """Processa jobs pendentes em paralelo (reivindicação atômica, commits em lote)."""
         self.logger.info("⚙️ Iniciando processamento de jobs pendentes")
         
         try:
-            session = SessionLocal()
-            
-            # Buscar jobs pendentes
-            pending_jobs = session.query(ReceiptJob).filter(
-                ReceiptJob.status == JobStatus.DISCOVERED
-            ).limit(10).all()
-            
-            processed_count = 0
-            
-            for job in pending_jobs:
-                try:
-                    # Atualizar status para processando
-                    job.status = JobStatus.PROCESSING
-                    job.attempts = (job.attempts or 0) + 1
-                    job.updated_at = datetime.utcnow()
-                    session.commit()
-                    
-                    # Processar recibo
-                    result = self._process_single_job(job)
-                    
-                    if result['success']:
-                        job.status = JobStatus.PROCESSED
-                        processed_count += 1
-                        self.logger.info(f"✅ Job {job.id} processado com sucesso")
-                    else:
-                        job.status = JobStatus.FAILED
-                        self.logger.error(f"❌ Job {job.id} falhou: {result.get('error')}")
-                    
-                    job.updated_at = datetime.utcnow()
-                    session.commit()
-                    
-                except Exception as e:
-                    job.status = JobStatus.FAILED
-                    job.updated_at = datetime.utcnow()
-                    session.commit()
-                    self.logger.error(f"❌ Erro ao processar job {job.id}: {str(e)}")
-            
-            session.close()
+            stats = self.job_engine.run(limit=config.JOB_BATCH_LIMIT)
             
-            if processed_count > 0:
-                self.logger.info(f"✅ Processados {processed_count} jobs")
+            if stats['claimed'] > 0:
+                self.logger.info(
+                    f"✅ Processados {stats['processed']}/{stats['claimed']} jobs "
+                    f"({stats['failed']} falhas) em {stats['duration']}s - {stats['jobs_per_minute']} jobs/min"
+                )
             
         except Exception as e:
             self.logger.error(f"❌ Erro no processamento de jobs: {str(e)}")
@@ -330,6 +306,16 @@ class SchedulerService:
                 user, msg_id = parts
                 full_msg = self.gmail_service.get_message(user, msg_id)
                 text = self.gmail_service.extract_plain_text(full_msg)
+                if config.ATTACHMENT_INGESTION_ENABLED:
+                    # Faturas que só existem no PDF/imagem anexo
+                    attachments_text = get_attachment_service().get_message_attachments_text(
+                        self.gmail_service, user, full_msg
+                    )
+                    if attachments_text:
+                        text = f"{text}\n\n{attachments_text}" if text.strip() else attachments_text
+                headers = {h['name'].lower(): h['value'] for h in full_msg.get('payload', {}).get('headers', [])}
+                sender = parseaddr(headers.get('from', ''))[1]
+                subject = headers.get('subject', '')
                 
             else:
                 # Processar arquivo local
@@ -344,52 +330,97 @@ class SchedulerService:
                     return {"success": False, "error": text_result['error']}
                 
                 text = text_result['text']
+                sender, subject = None, ''
             
-            # Processar com ReceiptProcessor
-            result = self.receipt_processor.extract_receipt_data(text, provider='auto')
+            # Processar com ReceiptProcessor (vaga do provedor só durante a chamada à LLM)
+            result = self.receipt_processor.extract_receipt_data(
+                text, provider=config.JOB_LLM_PROVIDER, sender=sender, subject=subject,
+                llm_slot=self.job_engine.llm_slot
+            )
             
             if result['success']:
-                # Salvar dados extraídos
-                self._save_extracted_data(job, result['extracted_data'])
-                return {"success": True, "data": result['extracted_data']}
+                # Salvar dados extraídos (falha no salvamento = job FAILED)
+                saved = self._save_extracted_data(job, result['extracted_data'])
+                if not saved['success']:
+                    return {"success": False, "error": saved['error']}
+                return {"success": True, "data": result['extracted_data'], "extraction_tier": result.get('extraction_tier'),
+                        "already_saved": saved.get('already_saved', False)}
             else:
                 return {"success": False, "error": result.get('error', 'Erro desconhecido')}
                 
         except Exception as e:
             return {"success": False, "error": str(e)}
     
-    def _save_extracted_data(self, job: ReceiptJob, data: Dict[str, Any]):
+    def _save_extracted_data(self, job: ReceiptJob, data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Salva dados extraídos no banco.
         
         Args:
             job: Job processado
             data: Dados extraídos
+            
+        Returns:
+            {'success': True} se salvo, {'success': True, 'already_saved': True} se o recibo
+            (numero_recibo, plataforma) já existia, ou {'success': False, 'error': ...}
         """
+        # Campos obrigatórios de Recibo (NOT NULL): falha explícita em vez de erro no commit
+        data_emissao = None
+        for fmt in ('%d-%m-%Y', '%Y-%m-%d', '%d/%m/%Y'):
+            try:
+                data_emissao = datetime.strptime(str(data.get('data_emissao')), fmt).date()
+                break
+            except ValueError:
+                continue
         try:
-            session = SessionLocal()
-            
-            # Criar registro de recibo
+            valor = float(data.get('valor'))
+        except (TypeError, ValueError):
+            valor = None
+        plataforma = data.get('plataforma')
+        numero_recibo = data.get('numero_recibo')
+        missing = [name for name, value in (('plataforma', plataforma), ('valor', valor),
+                                            ('data_emissao', data_emissao), ('numero_recibo', numero_recibo))
+                   if value is None or value == '']
+        if missing:
+            return {"success": False, "error": f"Campos obrigatórios ausentes ou inválidos: {', '.join(missing)}"}
+        
+        session = SessionLocal()
+        try:
+            existing = session.query(Recibo.id).filter(
+                Recibo.numero_recibo == numero_recibo, Recibo.plataforma == plataforma
+            ).first()
+            if existing:
+                self.logger.info(f"Recibo {plataforma} {numero_recibo} já salvo (id {existing[0]})")
+                return {"success": True, "already_saved": True, "recibo_id": existing[0]}
+            
+            # Criar registro de recibo (campos no formato do prompt de extração)
             recibo = Recibo(
                 job_id=job.id,
-                provider=data.get('provider'),
-                amount=data.get('amount'),
-                currency=data.get('currency'),
-                date=data.get('date'),
-                description=data.get('description'),
-                invoice_number=data.get('invoice_number'),
-                vendor=data.get('vendor'),
-                confidence_score=data.get('confidence_score'),
-                raw_data=json.dumps(data),
+                plataforma=plataforma,
+                valor=valor,
+                moeda=data.get('moeda') or 'BRL',
+                data_emissao=data_emissao,
+                numero_recibo=numero_recibo,
+                confianca=int(data.get('confianca') or 0),
+                fonte_dados='EMAIL' if (job.source_uri or '').startswith('gmail://') else 'API',
+                raw_data=json.dumps(data, default=str),
                 created_at=datetime.utcnow()
             )
             
             session.add(recibo)
             session.commit()
-            session.close()
+            return {"success": True, "recibo_id": recibo.id}
             
+        except IntegrityError:
+            # Outro job salvou o mesmo recibo entre a consulta e o commit
+            session.rollback()
+            self.logger.info(f"Recibo {plataforma} {numero_recibo} já salvo por outro job")
+            return {"success": True, "already_saved": True}
         except Exception as e:
+            session.rollback()
             self.logger.error(f"❌ Erro ao salvar dados extraídos: {str(e)}")
+            return {"success": False, "error": f"Erro ao salvar recibo: {str(e)}"}
+        finally:
+            session.close()
     
     def _generate_monthly_report(self):
         """Gera relatório mensal."""
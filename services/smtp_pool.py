@@ -0,0 +1,187 @@
+"""
+Pool de sessões SMTP autenticadas.
+
+Abrir uma conexão, negociar STARTTLS e fazer login custa várias idas e voltas
+ao servidor; reaproveitar a sessão para vários envios elimina esse custo. O
+pool mantém algumas sessões prontas, valida com NOOP as que ficaram ociosas
+e reconecta (com uma nova tentativa do envio) quando o servidor derruba a
+sessão.
+"""
+
+from __future__ import annotations
+
+import logging
+import queue
+import smtplib
+import ssl
+import threading
+import time
+from contextlib import contextmanager
+from email.message import Message
+from typing import Any, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _is_stale_error(error: BaseException) -> bool:
+    """Erro de conexão/sessão morta (reconectar), e não recusa do servidor."""
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    # SMTPException herda de OSError: recusas do servidor não são erro de conexão
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+class SMTPConnectionPool:
+    """Sessões SMTP reaproveitáveis, seguras para uso por várias threads."""
+
+    def __init__(self, host: str, port: int, username: Optional[str] = None, password: Optional[str] = None,
+                 size: int = 3, starttls: bool = True, timeout: float = 30,
+                 max_idle_seconds: float = 60, max_messages_per_session: int = 100):
+        """
+        Inicializa o pool (as conexões são abertas sob demanda).
+
+        Args:
+            host: Servidor SMTP
+            port: Porta
+            username: Usuário (login só é feito se informado e o servidor anunciar AUTH)
+            password: Senha
+            size: Máximo de sessões simultâneas
+            starttls: Exige STARTTLS antes do login
+            timeout: Timeout de socket em segundos
+            max_idle_seconds: Sessões ociosas há mais tempo são validadas com NOOP
+            max_messages_per_session: Renova a sessão após este número de envios
+        """
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.size = max(1, size)
+        self.starttls = starttls
+        self.timeout = timeout
+        self.max_idle_seconds = max_idle_seconds
+        self.max_messages_per_session = max(1, max_messages_per_session)
+
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._stats = {'connections_opened': 0, 'reconnects': 0, 'stale_detected': 0,
+                       'messages_sent': 0, 'send_errors': 0}
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._stats[key] += 1
+
+    def _connect(self) -> Dict[str, Any]:
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            server.ehlo()
+            if self.starttls:
+                server.starttls(context=ssl.create_default_context())
+                server.ehlo()
+            if self.username and server.has_extn('auth'):
+                server.login(self.username, self.password or '')
+        except Exception:
+            self._quit(server)
+            raise
+        self._count('connections_opened')
+        return {'server': server, 'last_used': time.monotonic(), 'sent': 0}
+
+    @staticmethod
+    def _quit(server) -> None:
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    def _is_alive(self, session: Dict[str, Any], validate: bool = False) -> bool:
+        if not validate and time.monotonic() - session['last_used'] < self.max_idle_seconds:
+            return True
+        try:
+            return session['server'].noop()[0] == 250
+        except Exception:
+            return False
+
+    @contextmanager
+    def session(self, validate: bool = False) -> Iterator[Dict[str, Any]]:
+        """
+        Empresta uma sessão pronta (bloqueia se todas estiverem em uso).
+
+        Args:
+            validate: Confirma com NOOP mesmo sessões usadas há pouco
+        """
+        if self._closed:
+            raise Exception("Pool SMTP encerrado")
+        self._slots.acquire()
+        session = None
+        try:
+            while session is None:
+                try:
+                    candidate = self._idle.get_nowait()
+                except queue.Empty:
+                    session = self._connect()
+                    break
+                if candidate['sent'] < self.max_messages_per_session and self._is_alive(candidate, validate):
+                    session = candidate
+                else:
+                    self._count('stale_detected')
+                    self._quit(candidate['server'])
+            yield session
+        except BaseException as e:
+            # Recusas do servidor (destinatário, remetente) deixam a sessão utilizável
+            if session is not None and (not isinstance(e, smtplib.SMTPException) or _is_stale_error(e)):
+                self._quit(session['server'])
+                session = None
+            raise
+        finally:
+            if session is not None:
+                session['last_used'] = time.monotonic()
+                if self._closed:
+                    self._quit(session['server'])
+                else:
+                    self._idle.put(session)
+            self._slots.release()
+
+    def send_message(self, msg: Message) -> None:
+        """
+        Envia uma mensagem por uma sessão do pool.
+
+        Se a sessão tiver caído, tenta de novo uma vez validando as sessões
+        ociosas (o servidor costuma derrubar várias de uma vez).
+
+        Raises:
+            smtplib.SMTPException: se o servidor recusar o envio
+        """
+        for attempt in range(2):
+            try:
+                with self.session(validate=attempt > 0) as session:
+                    session['server'].send_message(msg)
+                    session['sent'] += 1
+                self._count('messages_sent')
+                return
+            except Exception as e:
+                if attempt == 0 and _is_stale_error(e):
+                    logger.warning(f"Sessão SMTP perdida ({e.__class__.__name__}); reconectando")
+                    self._count('reconnects')
+                    continue
+                self._count('send_errors')
+                raise
+
+    def close(self) -> None:
+        """Encerra todas as sessões ociosas; as emprestadas são fechadas ao voltar."""
+        self._closed = True
+        while True:
+            try:
+                self._quit(self._idle.get_nowait()['server'])
+            except queue.Empty:
+                break
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Retorna contadores de conexões, reconexões e envios."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({'size': self.size, 'idle': self._idle.qsize()})
+        return stats
@@ -0,0 +1,73 @@
+"""
+Persistência do estado de sincronização incremental do Gmail (historyId por usuário).
+"""
+
+import logging
+from datetime import datetime
+from typing import Optional
+
+from database import SessionLocal
+from models.sync_models import GmailSyncState
+
+logger = logging.getLogger(__name__)
+
+
+class GmailSyncStateStore:
+    """Lê e grava o último historyId sincronizado de cada caixa monitorada."""
+
+    def __init__(self, session_factory=SessionLocal):
+        """
+        Inicializa o store.
+
+        Args:
+            session_factory: Fábrica de sessões SQLAlchemy
+        """
+        self.session_factory = session_factory
+
+    def get_history_id(self, user_email: str, scope: str = 'receipts') -> Optional[str]:
+        """
+        Retorna o último historyId salvo.
+
+        Args:
+            user_email: Caixa monitorada
+            scope: Escopo da coleta (cada escopo tem seu próprio checkpoint)
+
+        Returns:
+            historyId ou None se a caixa nunca foi sincronizada
+        """
+        session = self.session_factory()
+        try:
+            state = session.query(GmailSyncState).filter_by(user_email=user_email, scope=scope).first()
+            return state.history_id if state else None
+        finally:
+            session.close()
+
+    def save_history_id(self, user_email: str, history_id: str, scope: str = 'receipts',
+                        full_sync: bool = False) -> None:
+        """
+        Grava o historyId após uma sincronização concluída.
+
+        Args:
+            user_email: Caixa monitorada
+            history_id: Novo checkpoint
+            scope: Escopo da coleta
+            full_sync: True se o checkpoint veio de uma varredura completa
+        """
+        session = self.session_factory()
+        try:
+            now = datetime.utcnow()
+            state = session.query(GmailSyncState).filter_by(user_email=user_email, scope=scope).first()
+            if not state:
+                state = GmailSyncState(user_email=user_email, scope=scope, history_id=str(history_id))
+                session.add(state)
+            state.history_id = str(history_id)
+            state.updated_at = now
+            if full_sync:
+                state.last_full_sync_at = now
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Erro ao salvar historyId de {user_email}: {e}")
+            raise
+        finally:
+            session.close()
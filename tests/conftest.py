@@ -0,0 +1,6 @@
+"""Configuração comum dos testes: a raiz do projeto no sys.path (imports `services.*`, `config`)."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,108 @@
+"""
+Retry de mensagens limitadas (429) dentro de um HTTP batch da Gmail API.
+
+Um servidor local faz o papel do endpoint batch (`batch_uri`): no primeiro lote
+uma das mensagens volta com 429 e só ela deve ser reenviada no lote seguinte.
+"""
+
+import email
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httplib2
+import pytest
+from googleapiclient.discovery import build
+
+from services.gmail_service import GmailService
+
+_MESSAGE_PATH = re.compile(r'^GET /gmail/v1/users/[^/]+/messages/([^/?\s]+)')
+
+
+class _BatchStub(BaseHTTPRequestHandler):
+    """Responde lotes multipart/mixed com 429 para `throttle_once` (uma vez) e `throttle_always`."""
+
+    batches = []
+    throttle_once = set()
+    throttle_always = set()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        request = email.message_from_bytes(
+            b'Content-Type: ' + self.headers['Content-Type'].encode() + b'\r\n\r\n' + body
+        )
+        parts = []
+        batch_ids = []
+        for part in request.get_payload():
+            message_id = _MESSAGE_PATH.match(part.get_payload()).group(1)
+            batch_ids.append(message_id)
+            if message_id in self.throttle_always or message_id in self.throttle_once:
+                self.throttle_once.discard(message_id)
+                status, payload = '429 Too Many Requests', {'error': {'code': 429, 'message': 'Rate Limit Exceeded'}}
+            else:
+                status, payload = '200 OK', {'id': message_id, 'payload': {'headers': []}}
+            parts.append(
+                '--stub_boundary\r\n'
+                'Content-Type: application/http\r\n'
+                f"Content-ID: <response-{part['Content-ID'].strip('<>')}>\r\n\r\n"
+                f'HTTP/1.1 {status}\r\nContent-Type: application/json\r\n\r\n'
+                f'{json.dumps(payload)}\r\n'
+            )
+        self.batches.append(batch_ids)
+
+        response = (''.join(parts) + '--stub_boundary--\r\n').encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'multipart/mixed; boundary=stub_boundary')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def batch_server():
+    _BatchStub.batches = []
+    _BatchStub.throttle_once = set()
+    _BatchStub.throttle_always = set()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _BatchStub)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def gmail(batch_server, monkeypatch):
+    service = GmailService('credenciais-inexistentes.json', delegated_user='usuario@exemplo.com')
+    service.batch_uri = f'http://127.0.0.1:{batch_server.server_port}/batch/gmail/v1'
+    service.backoff_base = 0.0
+    # Recurso gerado do discovery embutido, sem credenciais: as chamadas vão só para o stub
+    resource = build('gmail', 'v1', http=httplib2.Http(), static_discovery=True)
+    monkeypatch.setattr(service, '_get_service', lambda user_email=None: resource)
+    return service
+
+
+def test_batch_retries_only_throttled_messages(gmail):
+    _BatchStub.throttle_once = {'m2'}
+
+    results = gmail._execute_get_batch('usuario@exemplo.com', ['m1', 'm2', 'm3'])
+
+    assert _BatchStub.batches == [['m1', 'm2', 'm3'], ['m2']]
+    assert all(results[mid]['success'] for mid in ('m1', 'm2', 'm3'))
+    assert results['m2']['message']['id'] == 'm2'
+
+
+def test_batch_gives_up_after_max_retries(gmail):
+    gmail.max_retries = 2
+    _BatchStub.throttle_always = {'m1'}
+
+    results = gmail._execute_get_batch('usuario@exemplo.com', ['m1', 'm2'])
+
+    assert _BatchStub.batches == [['m1', 'm2'], ['m1']]
+    assert results['m2']['success']
+    assert not results['m1']['success']
+    assert results['m1']['status'] == 429
@@ -0,0 +1,143 @@
+"""
+Retry do LLMService contra um servidor HTTP local.
+
+O stub devolve uma sequência roteirizada de respostas (429/5xx com ou sem
+Retry-After e depois 200), cobrindo a sessão síncrona (urllib3 Retry) e o
+caminho assíncrono (`achat`).
+"""
+
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from config import config
+from services.llm_service import LLMService
+
+_OK = (200, {}, {'text': 'ok'})
+
+
+class _LLMStub(BaseHTTPRequestHandler):
+    """Responde cada POST com o próximo item de `script` (o último se repete)."""
+
+    script = []
+    hits = []
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length'] or 0))
+        self.hits.append(time.monotonic())
+        status, headers, payload = self.script[min(len(self.hits), len(self.script)) - 1]
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def llm_server():
+    _LLMStub.script = [_OK]
+    _LLMStub.hits = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _LLMStub)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def make_llm(llm_server, monkeypatch):
+    def _make(max_retries=2, max_retry_delay=5.0):
+        monkeypatch.setattr(config, 'ZELLO_API_KEY', 'chave-de-teste')
+        monkeypatch.setattr(config, 'ZELLO_BASE_URL', f'http://127.0.0.1:{llm_server.server_port}')
+        monkeypatch.setattr(config, 'LLM_MAX_RETRIES', max_retries)
+        monkeypatch.setattr(config, 'LLM_BACKOFF_SECONDS', 0.01)
+        monkeypatch.setattr(config, 'LLM_MAX_RETRY_DELAY_SECONDS', max_retry_delay)
+        return LLMService()
+    return _make
+
+
+def _chat(llm):
+    return llm.chat('zello', [{'role': 'user', 'content': 'oi'}])
+
+
+def _achat(llm):
+    return asyncio.run(llm.achat('zello', [{'role': 'user', 'content': 'oi'}]))
+
+
+def test_sync_retries_server_errors(make_llm):
+    _LLMStub.script = [(503, {}, {}), (502, {}, {}), _OK]
+
+    result = _chat(make_llm())
+
+    assert result == {'success': True, 'text': 'ok', 'usage': {}}
+    assert len(_LLMStub.hits) == 3
+
+
+def test_sync_honours_retry_after(make_llm):
+    _LLMStub.script = [(429, {'Retry-After': '1'}, {}), _OK]
+
+    result = _chat(make_llm())
+
+    assert result['success']
+    assert _LLMStub.hits[1] - _LLMStub.hits[0] >= 0.9
+
+
+def test_sync_retry_after_is_capped(make_llm):
+    _LLMStub.script = [(429, {'Retry-After': '3600'}, {}), _OK]
+
+    started = time.monotonic()
+    result = _chat(make_llm(max_retry_delay=0.2))
+
+    assert result['success']
+    assert time.monotonic() - started < 2
+
+
+def test_sync_gives_up_after_max_retries(make_llm):
+    _LLMStub.script = [(503, {}, {'error': 'indisponível'})]
+
+    result = _chat(make_llm(max_retries=2))
+
+    assert not result['success']
+    assert '503' in result['error']
+    assert len(_LLMStub.hits) == 3
+
+
+def test_async_honours_retry_after(make_llm):
+    _LLMStub.script = [(429, {'Retry-After': '1'}, {}), _OK]
+
+    result = _achat(make_llm())
+
+    assert result['success']
+    assert _LLMStub.hits[1] - _LLMStub.hits[0] >= 0.9
+
+
+def test_async_retry_after_is_capped(make_llm):
+    _LLMStub.script = [(429, {'Retry-After': '3600'}, {}), (503, {'Retry-After': '3600'}, {}), _OK]
+
+    started = time.monotonic()
+    result = _achat(make_llm(max_retry_delay=0.2))
+
+    assert result['success']
+    assert len(_LLMStub.hits) == 3
+    assert time.monotonic() - started < 2
+
+
+def test_async_gives_up_after_max_retries(make_llm):
+    _LLMStub.script = [(429, {}, {'error': 'quota'})]
+
+    result = _achat(make_llm(max_retries=1))
+
+    assert not result['success']
+    assert '429' in result['error']
+    assert len(_LLMStub.hits) == 2
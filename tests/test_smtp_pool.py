@@ -0,0 +1,171 @@
+"""
+Reconexão do SMTPConnectionPool contra um servidor SMTP mínimo em socket local.
+
+O sink fala o suficiente do protocolo (EHLO/MAIL/RCPT/DATA/NOOP/RSET/QUIT),
+guarda as mensagens recebidas e permite derrubar todas as conexões abertas,
+simulando o servidor que encerra sessões ociosas.
+"""
+
+import smtplib
+import socket
+import socketserver
+import threading
+from email.message import EmailMessage
+
+import pytest
+
+from services.smtp_pool import SMTPConnectionPool
+
+
+class _SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _SMTPHandler)
+        self.messages = []
+        self.refused_recipients = set()
+        self.connections = []
+        self.lock = threading.Lock()
+
+    def drop_connections(self):
+        """Fecha todas as conexões abertas do lado do servidor."""
+        with self.lock:
+            connections, self.connections = self.connections, []
+        for conn in connections:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            conn.close()
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+
+    def _reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        with self.server.lock:
+            self.server.connections.append(self.request)
+        try:
+            self._reply('220 sink ESMTP')
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                command = line.decode().strip()
+                verb = command[:4].upper()
+                if verb in ('EHLO', 'HELO'):
+                    self._reply('250-sink')
+                    self._reply('250 8BITMIME')
+                elif verb == 'RCPT' and any(r in command for r in self.server.refused_recipients):
+                    self._reply('550 mailbox unavailable')
+                elif verb in ('MAIL', 'RCPT', 'NOOP', 'RSET'):
+                    self._reply('250 OK')
+                elif verb == 'DATA':
+                    self._reply('354 End data with <CR><LF>.<CR><LF>')
+                    data = []
+                    for data_line in self.rfile:
+                        if data_line == b'.\r\n':
+                            break
+                        data.append(data_line)
+                    with self.server.lock:
+                        self.server.messages.append(b''.join(data))
+                    self._reply('250 queued')
+                elif verb == 'QUIT':
+                    self._reply('221 bye')
+                    return
+                else:
+                    self._reply('502 command not implemented')
+        except OSError:
+            pass
+
+
+@pytest.fixture
+def sink():
+    server = _SMTPSink()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.drop_connections()
+    server.server_close()
+
+
+def _pool(sink, **kwargs):
+    host, port = sink.server_address
+    return SMTPConnectionPool(host, port, size=2, starttls=False, timeout=5, **kwargs)
+
+
+def _message(to='destino@exemplo.com', subject='Recibo'):
+    msg = EmailMessage()
+    msg['From'] = 'origem@exemplo.com'
+    msg['To'] = to
+    msg['Subject'] = subject
+    msg.set_content('corpo')
+    return msg
+
+
+def test_reuses_session_between_messages(sink):
+    pool = _pool(sink)
+    try:
+        pool.send_message(_message(subject='um'))
+        pool.send_message(_message(subject='dois'))
+        stats = pool.get_stats()
+    finally:
+        pool.close()
+
+    assert len(sink.messages) == 2
+    assert stats['connections_opened'] == 1
+    assert stats['messages_sent'] == 2
+
+
+def test_reconnects_when_server_drops_session(sink):
+    pool = _pool(sink)
+    try:
+        pool.send_message(_message(subject='antes'))
+        sink.drop_connections()
+        # A sessão ociosa parece recente, então o envio descobre a queda e reconecta
+        pool.send_message(_message(subject='depois'))
+        stats = pool.get_stats()
+    finally:
+        pool.close()
+
+    assert [b'Subject: depois' in m for m in sink.messages] == [False, True]
+    assert stats['reconnects'] == 1
+    assert stats['connections_opened'] == 2
+    assert stats['messages_sent'] == 2
+    assert stats['send_errors'] == 0
+
+
+def test_idle_session_is_validated_before_use(sink):
+    pool = _pool(sink, max_idle_seconds=0)
+    try:
+        pool.send_message(_message())
+        sink.drop_connections()
+        pool.send_message(_message())
+        stats = pool.get_stats()
+    finally:
+        pool.close()
+
+    assert len(sink.messages) == 2
+    assert stats['stale_detected'] == 1
+    assert stats['reconnects'] == 0
+
+
+def test_recipient_refusal_keeps_session(sink):
+    sink.refused_recipients = {'recusado@exemplo.com'}
+    pool = _pool(sink)
+    try:
+        with pytest.raises(smtplib.SMTPRecipientsRefused):
+            pool.send_message(_message(to='recusado@exemplo.com'))
+        pool.send_message(_message())
+        stats = pool.get_stats()
+    finally:
+        pool.close()
+
+    assert len(sink.messages) == 1
+    assert stats['connections_opened'] == 1
+    assert stats['reconnects'] == 0
+    assert stats['send_errors'] == 1